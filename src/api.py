@@ -0,0 +1,335 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List, Optional
+
+import psycopg2
+import redis
+import uvicorn
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
+from psycopg2.extensions import QueryCanceledError
+
+from metrics import REGISTRY
+from psql_analytics import PSQLAnalytics
+from psql_manager import PSQLManager
+from query_cache import QueryCache, encode_frame
+from redis_analytics import RedisAnalytics
+from redis_manager import RedisManager
+
+"""
+HTTP analytics service in front of PSQLAnalytics and RedisAnalytics.
+
+Dashboards and other consumers read the same metrics as the Streamlit app
+without each holding their own database connections:
+
+    python src/api.py --port 8000
+    curl localhost:8000/postgres/top-wikis?limit=5
+    curl -H "Accept: application/vnd.apache.arrow.stream" localhost:8000/postgres/time-series
+
+Postgres endpoints return JSON records, or an Arrow IPC stream when the Accept
+header asks for one, and take an optional start/end (ISO 8601) range instead
+of "today". Redis endpoints return JSON.
+
+psycopg2 and redis-py are blocking, so queries run in worker threads on a
+shared connection pool (PSQL_POOL_SIZE) and Redis client, and postgres
+results go through the shared QueryCache. Rendered responses are also kept
+for a few seconds, and concurrent identical requests share one render.
+Every response carries an ETag, so a client that sends it back in
+If-None-Match gets a 304 while the data is unchanged. Large bodies are
+gzipped.
+"""
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+# seconds a rendered response is reused (and may be cached by clients)
+POSTGRES_MAX_AGE_SECONDS = 5
+REDIS_MAX_AGE_SECONDS = 1
+
+# fresh: rendered for this request, cached: reused, coalesced: shared an in-flight render, not_modified: 304
+RESPONSES = REGISTRY.counter("wiki_api_responses_total", "analytics api responses by how they were served", ("result",))
+
+
+class ResponseCache:
+    """Short-lived in-process cache of rendered response bodies, shared by concurrent identical requests."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        # key -> (expires at, body, media type, etag)
+        self.entries = {}
+        # key -> render task still running, awaited by every request for that key
+        self.pending = {}
+
+    async def get(self, key, max_age_seconds, render):
+        """Return (body, media type, etag) for key, awaiting render() only if no fresh copy exists."""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            RESPONSES.labels("cached").inc()
+            return entry[1:]
+
+        task = self.pending.get(key)
+        if task is None:
+            RESPONSES.labels("fresh").inc()
+            task = asyncio.ensure_future(self._render(key, max_age_seconds, render))
+            self.pending[key] = task
+            task.add_done_callback(lambda _: self.pending.pop(key, None))
+        else:
+            RESPONSES.labels("coalesced").inc()
+        # a client that disconnects doesn't cancel the render other requests are waiting on
+        return await asyncio.shield(task)
+
+    async def _render(self, key, max_age_seconds, render):
+        body, media_type = await render()
+        # weak, since gzip changes the bytes on the wire but not the content
+        etag = f'W/"{hashlib.sha1(body).hexdigest()}"'
+        now = time.monotonic()
+        if len(self.entries) >= self.max_entries:
+            self.entries = {k: v for k, v in self.entries.items() if v[0] > now}
+        self.entries[key] = (now + max_age_seconds, body, media_type, etag)
+        return body, media_type, etag
+
+
+def etag_matches(if_none_match, etag):
+    """Return True if an If-None-Match header lists etag (compared weakly) or is *."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in (tag.removeprefix("W/") for tag in tags)
+
+
+async def respond(request, max_age_seconds, render, variant=""):
+    """Serve a cached or freshly rendered body, or a 304 if the client already has it."""
+    key = (request.url.path, tuple(sorted(request.query_params.multi_items())), variant)
+    body, media_type, etag = await request.app.state.responses.get(key, max_age_seconds, render)
+
+    headers = {"ETag": etag, "Cache-Control": f"max-age={max_age_seconds}", "Vary": "Accept"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        RESPONSES.labels("not_modified").inc()
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=media_type, headers=headers)
+
+
+def window_minutes(minutes, ttl_seconds):
+    """Return the requested rolling windows, each between one minute and the lifetime of the buckets they read."""
+    # minute buckets expire after ttl_seconds, so a longer window would silently undercount
+    longest = ttl_seconds // 60
+    if not all(1 <= window <= longest for window in minutes):
+        raise HTTPException(400, f"windows must be between 1 and {longest} minutes")
+    return minutes
+
+
+def time_range(start, end):
+    """Return the requested [start, end) range, or None to use the query's default."""
+    if start is None and end is None:
+        return None
+    if start is None or end is None or start >= end:
+        raise HTTPException(400, "start and end must be given together, with start before end")
+    # naive times are local, like the dashboard's day boundaries
+    return start.astimezone(), end.astimezone()
+
+
+async def frame_response(request, query, **kwargs):
+    """Run a PSQLAnalytics method in a worker thread and respond with its DataFrame as JSON or Arrow."""
+    state = request.app.state
+    arrow = ARROW_MEDIA_TYPE in request.headers.get("accept", "")
+
+    async def render():
+        frame = await asyncio.to_thread(state.analytics._timed_query, state.timeout_seconds, query, **kwargs)
+        if arrow:
+            return encode_frame(frame), ARROW_MEDIA_TYPE
+        return frame.to_json(orient="records", date_format="iso").encode(), "application/json"
+
+    return await respond(request, POSTGRES_MAX_AGE_SECONDS, render, "arrow" if arrow else "json")
+
+
+async def json_response(request, read, *args):
+    """Run a RedisAnalytics read in a worker thread and respond with its result as JSON."""
+
+    async def render():
+        result = await asyncio.to_thread(read, *args)
+        response = JSONResponse(result)
+        return response.body, response.media_type
+
+    return await respond(request, REDIS_MAX_AGE_SECONDS, render)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Open the shared Postgres pool and Redis client for the lifetime of the service."""
+    load_dotenv()
+    redis_manager = RedisManager()
+    if not redis_manager.connect():
+        # the client reconnects on its own; until then redis endpoints return 503
+        print("redis unavailable, redis endpoints will fail until it is back")
+
+    psql_manager = PSQLManager()
+    if not psql_manager.connect_pool(minconn=1, maxconn=int(os.getenv("PSQL_POOL_SIZE", "10"))):
+        raise RuntimeError("could not connect to PostgreSQL")
+
+    cache = QueryCache(redis_manager) if os.getenv("QUERY_CACHE", "1") == "1" else None
+    app.state.analytics = PSQLAnalytics(psql_manager, cache=cache)
+    app.state.redis_analytics = RedisAnalytics(redis_manager)
+    app.state.timeout_seconds = float(os.getenv("API_QUERY_TIMEOUT_SECONDS", "10"))
+    app.state.responses = ResponseCache()
+    try:
+        yield
+    finally:
+        psql_manager.pool.closeall()
+        redis_manager.client.close()
+
+
+app = FastAPI(title="Wikipedia edit analytics", lifespan=lifespan)
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+
+@app.exception_handler(QueryCanceledError)
+async def query_timed_out(request, exc):
+    return JSONResponse({"detail": "query timed out"}, status_code=504)
+
+
+@app.exception_handler(psycopg2.Error)
+async def postgres_unavailable(request, exc):
+    return JSONResponse({"detail": f"postgres query failed: {str(exc).strip()}"}, status_code=503)
+
+
+@app.exception_handler(redis.RedisError)
+async def redis_unavailable(request, exc):
+    return JSONResponse({"detail": f"redis read failed: {exc}"}, status_code=503)
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(REGISTRY.render(), media_type="text/plain")
+
+
+@app.get("/postgres/top-users-per-minute")
+async def top_users_per_minute(request: Request, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """Per-minute event counts by user."""
+    analytics = request.app.state.analytics
+    return await frame_response(request, analytics.top_users_per_minute_today, time_range=time_range(start, end))
+
+
+@app.get("/postgres/top-users")
+async def top_users(
+    request: Request,
+    limit: int = Query(10, ge=1, le=1000),
+    user_type: str = Query("all", pattern="^(all|bot|human)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """Top users by event count, optionally only bots or humans."""
+    analytics = request.app.state.analytics
+    return await frame_response(
+        request, analytics.top_users_today, limit=limit, user_type=user_type, time_range=time_range(start, end)
+    )
+
+
+@app.get("/postgres/top-wikis")
+async def top_wikis(
+    request: Request,
+    limit: int = Query(10, ge=1, le=1000),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """Top wikis by event count."""
+    analytics = request.app.state.analytics
+    return await frame_response(request, analytics.top_wikis_today, limit=limit, time_range=time_range(start, end))
+
+
+@app.get("/postgres/time-series")
+async def time_series(
+    request: Request,
+    window_hours: int = Query(1, ge=1, le=48),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """Events per minute, with empty minutes filled in, over the last window_hours or [start, end)."""
+    analytics = request.app.state.analytics
+    return await frame_response(
+        request, analytics.gap_filled_time_series, window_hours=window_hours, time_range=time_range(start, end)
+    )
+
+
+@app.get("/postgres/event-size")
+async def event_size(request: Request):
+    """Average event size for all, bot and human edits."""
+    return await frame_response(request, request.app.state.analytics.event_size_distribution)
+
+
+@app.get("/postgres/event-types")
+async def event_types(request: Request, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """Event-type counts and percentages."""
+    analytics = request.app.state.analytics
+    return await frame_response(request, analytics.event_type_distribution_today, time_range=time_range(start, end))
+
+
+@app.get("/postgres/wiki-event-types")
+async def wiki_event_types(request: Request, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """Per-wiki totals with type-specific counts."""
+    analytics = request.app.state.analytics
+    return await frame_response(
+        request, analytics.wiki_event_type_distribution_today, time_range=time_range(start, end)
+    )
+
+
+@app.get("/postgres/patrolled")
+async def patrolled(request: Request, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """Patrolled vs unpatrolled counts for bots and humans."""
+    analytics = request.app.state.analytics
+    return await frame_response(
+        request, analytics.patrolled_bot_distribution_today, time_range=time_range(start, end)
+    )
+
+
+@app.get("/redis/windows")
+async def windows(request: Request, minutes: List[int] = Query([5, 60])):
+    """Rolling-window counters, keyed by window length in minutes."""
+    redis_analytics = request.app.state.redis_analytics
+    windows = window_minutes(minutes, redis_analytics.redis.minute_ttl_seconds)
+    return await json_response(request, redis_analytics.rolling_totals, windows)
+
+
+@app.get("/redis/distinct")
+async def distinct(request: Request, minutes: List[int] = Query([5, 60])):
+    """Approximate distinct users, pages and wikis per rolling window."""
+    redis_analytics = request.app.state.redis_analytics
+    windows = window_minutes(minutes, redis_analytics.redis.minute_ttl_seconds)
+    return await json_response(request, redis_analytics.distinct_counts, windows)
+
+
+@app.get("/redis/top-users")
+async def window_top_users(
+    request: Request, minutes: int = Query(5), limit: int = Query(10, ge=1, le=100)
+):
+    """Top users for a rolling window; true counts are at most count + error_bound."""
+    redis_analytics = request.app.state.redis_analytics
+    window_minutes([minutes], redis_analytics.redis.top_users_minute_ttl_seconds)
+
+    def read():
+        entries, bound = redis_analytics.top_users_window_bounded(minutes, limit)
+        return {"users": [{"user": user, "count": count} for user, count in entries], "error_bound": bound}
+
+    return await json_response(request, read)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="serve postgres and redis analytics over http")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="server processes, each with its own pool")
+    args = parser.parse_args()
+    uvicorn.run("api:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta, timezone
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from archive_manager import ARCHIVE_SCHEMA, PARTITIONING
+from psql_analytics import PSQLAnalytics, minute_range, patrolled_frame, today_range, type_mix_frame
+
+"""
+Historical analytics over the Parquet archive (see archive_manager.py).
+
+ArchiveAnalytics answers the same queries as PSQLAnalytics, with the same
+arguments and DataFrame columns, by scanning the day/hour partitioned archive
+with pyarrow datasets instead of querying PostgreSQL. A [start, end) range
+only opens the day directories it overlaps and reads only the columns a query
+needs, so multi-day history stays cheap to query locally. snapshot() and
+print_sql_analytics() work unchanged, as do counts_since() and the LiveSnapshot
+built on it, e.g. over the last week:
+
+    ArchiveAnalytics("archive").print_sql_analytics(time_range=(start, end))
+"""
+
+
+class ArchiveAnalytics(PSQLAnalytics):
+    """PSQLAnalytics-compatible queries over archived raw events."""
+
+    def __init__(self, directory):
+        """Read the archive under directory; there are no rollups or indexes to choose between."""
+        super().__init__(None, use_rollups=False)
+        self.directory = directory
+        # scans release the GIL, so the snapshot queries can run side by side
+        self.executor = ThreadPoolExecutor(max_workers=6, thread_name_prefix="archive-snapshot")
+
+    def _run_query(self, query, params=None):
+        raise NotImplementedError("the archive is queried through pyarrow scans, not SQL")
+
+    def _scan(self, columns, time_range=None, condition=None):
+        """Return the archived rows in [start, end) that match condition, with only columns read.
+
+        An end of None reads everything from start on.
+        """
+        scan_columns = sorted(set(columns) | {"dt"}) if time_range else list(columns)
+        if not os.path.isdir(self.directory):
+            return ARCHIVE_SCHEMA.empty_table().select(scan_columns)
+
+        # half-written exports are dot-files, which dataset discovery skips
+        dataset = ds.dataset(
+            self.directory, format="parquet", partitioning=ds.partitioning(PARTITIONING, flavor="hive")
+        )
+        if time_range:
+            start, end = time_range
+            start = start.astimezone(timezone.utc)
+            dt_type = ARCHIVE_SCHEMA.field("dt").type
+            # the day filter prunes whole directories before any file is opened
+            if end is None:
+                # iso days compare in date order
+                in_range = (ds.field("day") >= start.date().isoformat()) & (ds.field("dt") >= pa.scalar(start, dt_type))
+            else:
+                end = end.astimezone(timezone.utc)
+                days = []
+                day = start.date()
+                while day <= (end - timedelta(microseconds=1)).date():
+                    days.append(day.isoformat())
+                    day += timedelta(days=1)
+                in_range = (
+                    ds.field("day").isin(days)
+                    & (ds.field("dt") >= pa.scalar(start, dt_type))
+                    & (ds.field("dt") < pa.scalar(end, dt_type))
+                )
+            condition = in_range if condition is None else in_range & condition
+
+        return dataset.to_table(columns=scan_columns, filter=condition)
+
+    def _count(self, table, keys):
+        """Return event counts grouped by keys as a DataFrame with an event_count column."""
+        counts = table.group_by(keys).aggregate([([], "count_all")])
+        return counts.to_pandas().rename(columns={"count_all": "event_count"})
+
+    def top_users_per_minute_today(self, time_range=None):
+        """Return per-minute event counts by user for the current day."""
+        table = self._scan(["user"], time_range or today_range(), ds.field("user").is_valid())
+        table = table.append_column("minute_ts", pc.floor_temporal(table["dt"], unit="minute"))
+        frame = self._count(table, ["minute_ts", "user"])
+        frame = frame.sort_values(["minute_ts", "event_count"], ascending=False, ignore_index=True)
+        return frame[["minute_ts", "user", "event_count"]]
+
+    def top_users_today(self, limit=10, user_type="all", time_range=None):
+        """Return top users for today, optionally filtered by bot/human segment."""
+        user_type = (user_type or "all").lower()
+        condition = ds.field("user").is_valid()
+        if user_type == "bot":
+            condition = condition & ds.field("bot")
+        elif user_type == "human":
+            condition = condition & ~ds.field("bot")
+
+        frame = self._count(self._scan(["user"], time_range or today_range(), condition), ["user"])
+        return frame.sort_values("event_count", ascending=False, ignore_index=True).head(limit)
+
+    def top_wikis_today(self, limit=10, time_range=None):
+        """Return top wikis by event volume for the current day."""
+        frame = self._count(self._scan(["wiki"], time_range or today_range(), ds.field("wiki").is_valid()), ["wiki"])
+        return frame.sort_values("event_count", ascending=False, ignore_index=True).head(limit)
+
+    def gap_filled_time_series(self, window_hours=1, time_range=None):
+        """Return a gap-filled minute time series for the requested hour window."""
+        start, end = time_range or minute_range(window_hours)
+        table = self._scan([], (start, end))
+        table = table.append_column("minute_ts", pc.floor_temporal(table["dt"], unit="minute"))
+        per_minute = self._count(table, ["minute_ts"]).set_index("minute_ts")["event_count"]
+
+        minutes = pd.date_range(start, end, freq="min", inclusive="left").tz_convert("UTC")
+        events = per_minute.reindex(minutes, fill_value=0).astype("int64")
+        return pd.DataFrame({"minutes_ts": minutes, "events": events.to_numpy()})
+
+    def event_size_distribution(self, time_range=None):
+        """Return average event size for all, bot, and human edits (over the whole archive by default)."""
+        frame = self._scan(["length", "bot"], time_range, ds.field("length").is_valid()).to_pandas()
+
+        def average(lengths):
+            return round(lengths.mean(), 2) if len(lengths) else None
+
+        return pd.DataFrame(
+            [
+                {
+                    "all_avg_length": average(frame["length"]),
+                    "bot_avg_length": average(frame.loc[frame["bot"].eq(True), "length"]),
+                    "human_avg_length": average(frame.loc[frame["bot"].eq(False), "length"]),
+                }
+            ]
+        )
+
+    def event_type_distribution_today(self, time_range=None):
+        """Return today's event-type counts and percentages."""
+        condition = ds.field("type").isin(["edit", "categorize", "log", "new"])
+        return type_mix_frame(self._count(self._scan(["type"], time_range or today_range(), condition), ["type"]))
+
+    def wiki_event_type_distribution_today(self, time_range=None):
+        """Return per-wiki totals with type-specific counts for today."""
+        table = self._scan(["wiki", "type"], time_range or today_range(), ds.field("wiki").is_valid())
+        counts = self._count(table, ["wiki", "type"])
+        by_type = counts.pivot_table(index="wiki", columns="type", values="event_count", aggfunc="sum", fill_value=0)
+
+        frame = pd.DataFrame({"wiki": by_type.index, "total_count": by_type.sum(axis=1).to_numpy()})
+        for event_type in ("edit", "new", "log", "categorize"):
+            column = by_type[event_type] if event_type in by_type else 0
+            frame[f"{event_type}_count"] = pd.Series(column, index=by_type.index).to_numpy()
+        return frame.sort_values("total_count", ascending=False, ignore_index=True)
+
+    def patrolled_bot_distribution_today(self, time_range=None):
+        """Return patrolled vs unpatrolled counts split by bot/human for today."""
+        condition = ds.field("patrolled").is_valid() & ds.field("bot").is_valid()
+        table = self._scan(["bot", "patrolled"], time_range or today_range(), condition)
+        return patrolled_frame(self._count(table, ["bot", "patrolled"]))
+
+    def counts_since(self, dimensions, since, until=None, user_type="all", by_minute=False):
+        """Return event counts grouped by dimensions for [since, until), per minute when by_minute."""
+        dimensions = list(dimensions)
+        unknown = set(dimensions) - set(self.COUNT_DIMENSIONS)
+        if unknown:
+            raise ValueError(f"unknown count dimensions: {sorted(unknown)}")
+        user_type = (user_type or "all").lower()
+
+        condition = None
+        for dimension in dimensions:
+            valid = ds.field(dimension).is_valid()
+            condition = valid if condition is None else condition & valid
+        if user_type in ("bot", "human"):
+            # a null bot matches neither, like IS TRUE / IS FALSE
+            bot = ds.field("bot") if user_type == "bot" else ~ds.field("bot")
+            condition = bot if condition is None else condition & bot
+
+        table = self._scan(dimensions, (since, until), condition)
+        keys = list(dimensions)
+        if by_minute:
+            table = table.append_column("minute", pc.floor_temporal(table["dt"], unit="minute"))
+            keys.insert(0, "minute")
+        return self._count(table, keys)[keys + ["event_count"]]
+
+    def explain_index_usage(self):
+        """The archive has no indexes; range queries are pruned by day directory instead."""
+        return {}
@@ -0,0 +1,183 @@
+import os
+import time
+from datetime import timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from psycopg2 import sql
+
+"""
+Columnar Parquet archive for raw events aged out of PostgreSQL.
+
+Before retention drops an hourly raw_events partition (or deletes stragglers
+from the default partition), PSQLManager hands its rows to ArchiveManager,
+which streams them through a server-side cursor into Parquet files laid out
+as hive partitions:
+
+    archive/day=2026-10-17/hour=13/raw_events_p2026101713.parquet
+
+Rows are sorted by wiki inside each hour, so the dictionary-encoded wiki
+column compresses to long runs and row-group statistics let a wiki filter
+skip most of a file. archive_analytics.py queries the tree with pyarrow
+dataset scans.
+"""
+
+# raw_events columns in schema order, as stored in the archive
+ARCHIVE_SCHEMA = pa.schema(
+    [
+        ("id", pa.string()),
+        ("domain", pa.string()),
+        ("dt", pa.timestamp("us", tz="UTC")),
+        ("type", pa.string()),
+        ("namespace", pa.int32()),
+        ("title", pa.string()),
+        ("comment", pa.string()),
+        ("user", pa.string()),
+        ("bot", pa.bool_()),
+        ("wiki", pa.string()),
+        ("minor", pa.bool_()),
+        ("patrolled", pa.bool_()),
+        ("log_type", pa.string()),
+        ("length", pa.int32()),
+    ]
+)
+# low-cardinality columns; ids, titles and comments are near-unique so a dictionary only costs space
+DICTIONARY_COLUMNS = ["domain", "type", "user", "wiki", "log_type"]
+# directory levels above each file, read back by archive_analytics
+PARTITIONING = pa.schema([("day", pa.string()), ("hour", pa.int8())])
+
+
+def utc_hour(dt):
+    """Return the start of the UTC hour containing an aware datetime."""
+    return dt.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+class ArchiveManager:
+    """Writes expiring raw_events rows to the day/hour partitioned Parquet archive."""
+
+    def __init__(self, directory, fetch_rows=50000, compression="zstd"):
+        """Archive under directory, fetching (and writing as one row group) fetch_rows rows at a time."""
+        self.directory = directory
+        self.fetch_rows = fetch_rows
+        self.compression = compression
+
+    def hour_directory(self, hour_start):
+        """Return the directory holding one UTC hour of archived events."""
+        return os.path.join(self.directory, f"day={hour_start:%Y-%m-%d}", f"hour={hour_start.hour}")
+
+    def export_partition(self, conn, partition_name):
+        """Archive every row of one hourly partition; return the number of rows written.
+
+        The file is named after the partition, so exporting it again (e.g. after a drop that
+        failed) replaces the earlier copy instead of duplicating it.
+        """
+        query = sql.SQL("SELECT {} FROM {} ORDER BY wiki, dt").format(
+            sql.SQL(", ").join(sql.Identifier(name) for name in ARCHIVE_SCHEMA.names), sql.Identifier(partition_name)
+        )
+        return self._export(conn, query, (), lambda hour_start: f"{partition_name}.parquet")
+
+    def export_before(self, conn, table_name, cutoff):
+        """Archive the rows of table_name older than cutoff, one file per UTC hour; return (rows, paths).
+
+        Callers delete the same rows in the transaction they archived them in, and remove the
+        returned files if that delete doesn't commit.
+        """
+        query = sql.SQL(
+            "SELECT {} FROM {} WHERE dt < %s ORDER BY date_trunc('hour', dt AT TIME ZONE 'UTC'), wiki, dt"
+        ).format(sql.SQL(", ").join(sql.Identifier(name) for name in ARCHIVE_SCHEMA.names), sql.Identifier(table_name))
+        # stragglers for an hour can be archived more than once, so each export gets its own file
+        exported_at = int(time.time())
+        paths = []
+
+        def file_name(hour_start):
+            name = f"{table_name}-{exported_at}.parquet"
+            paths.append(os.path.join(self.hour_directory(hour_start), name))
+            return name
+
+        try:
+            rows = self._export(conn, query, (cutoff,), file_name)
+        except Exception:
+            self.remove(paths)
+            raise
+        return rows, paths
+
+    def remove(self, paths):
+        """Delete archived files whose rows are staying in postgres after all."""
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _export(self, conn, query, params, file_name):
+        """Stream query results (ordered by hour) into one Parquet file per UTC hour."""
+        writer = None
+        hour_start = None
+        path = None
+        rows = 0
+
+        # a named cursor keeps the result server-side, so an hour of events never sits in memory at once
+        cur = conn.cursor(name="archive_export")
+        cur.itersize = self.fetch_rows
+        try:
+            cur.execute(query, params)
+            while True:
+                chunk = cur.fetchmany(self.fetch_rows)
+                if not chunk:
+                    break
+
+                # split the chunk where the hour changes; rows arrive grouped by hour
+                for hour_rows in self._split_hours(chunk):
+                    row_hour = utc_hour(hour_rows[0][2])
+                    if row_hour != hour_start:
+                        if writer is not None:
+                            self._close(writer, path)
+                        hour_start = row_hour
+                        directory = self.hour_directory(hour_start)
+                        os.makedirs(directory, exist_ok=True)
+                        path = os.path.join(directory, file_name(hour_start))
+                        writer = pq.ParquetWriter(
+                            self._temporary_path(path),
+                            ARCHIVE_SCHEMA,
+                            compression=self.compression,
+                            use_dictionary=DICTIONARY_COLUMNS,
+                        )
+
+                    writer.write_table(self._to_table(hour_rows))
+                    rows += len(hour_rows)
+
+            if writer is not None:
+                self._close(writer, path)
+                writer = None
+        finally:
+            cur.close()
+            # a failed export leaves no half-written file behind
+            if writer is not None:
+                writer.close()
+                os.remove(self._temporary_path(path))
+        return rows
+
+    def _split_hours(self, chunk):
+        """Yield runs of consecutive rows that share a UTC hour."""
+        start = 0
+        for i in range(1, len(chunk)):
+            if utc_hour(chunk[i][2]) != utc_hour(chunk[i - 1][2]):
+                yield chunk[start:i]
+                start = i
+        yield chunk[start:]
+
+    def _to_table(self, rows):
+        """Build an Arrow table from raw_events row tuples."""
+        columns = list(zip(*rows))
+        return pa.Table.from_arrays(
+            [pa.array(values, type=column.type) for values, column in zip(columns, ARCHIVE_SCHEMA)],
+            schema=ARCHIVE_SCHEMA,
+        )
+
+    def _temporary_path(self, path):
+        """Return where a file is written before it is complete; dataset scans skip dot-files."""
+        directory, name = os.path.split(path)
+        return os.path.join(directory, f".{name}.tmp")
+
+    def _close(self, writer, path):
+        """Finish a file and move it into place, so readers never see a partial one."""
+        writer.close()
+        os.replace(self._temporary_path(path), path)
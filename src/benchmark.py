@@ -0,0 +1,491 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import platform
+import statistics
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from psql_analytics import PSQLAnalytics
+from psql_manager import PSQLManager
+from redis_analytics import RedisAnalytics
+from redis_manager import RedisManager
+from replay import synthetic_events, synthetic_payloads
+from wiki_event import DECODERS, decode_event
+
+"""
+Benchmark suite for the ingest and dashboard query paths.
+
+    decode  SSE payload decode + projection, old json/dict path vs each WikiEvent decoder
+    ingest  events/sec through RedisManager / PSQLManager, one event per call vs batched
+    redis   latency of the RedisAnalytics window reads and print_metrics at N total keys
+    psql    latency of every PSQLAnalytics query at N seeded raw_events rows
+    all     every suite the given targets allow
+
+The redis suite flushes its database and the psql suite seeds raw_events, so they only
+run against a scratch target: --fakeredis or --redis-db N, and --psql-dbname NAME (a
+database already set up with `utilities.py setup`). --json writes machine-readable
+results for tracking regressions between releases.
+
+    python src/benchmark.py decode --payloads recorded.sse
+    python src/benchmark.py all --fakeredis --psql-dbname wiki_bench --json bench.json
+"""
+
+
+def load_payloads(path):
+    """Read recorded payloads as SSE `data: ...` lines (raw JSON lines are wrapped)."""
+    lines = []
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.rstrip(b"\r\n")
+            if line.startswith(b"data: "):
+                lines.append(line)
+            elif line.startswith(b"{"):
+                lines.append(b"data: " + line)
+    return lines
+
+
+def legacy_project(line, psql_manager, redis_manager):
+    """Decode and project one line the way the pipeline did before WikiEvent."""
+    clean_line = line.decode().strip()
+    if not clean_line.startswith("data: "):
+        return None
+    json_data = json.loads(clean_line[6:])
+    if "type" not in json_data or "meta" not in json_data:
+        return None
+
+    # PSQLManager._event_row
+    meta = json_data.get("meta", {})
+    length = json_data.get("length")
+    row = (
+        meta.get("id"),
+        meta.get("domain"),
+        meta.get("dt"),
+        json_data.get("type"),
+        json_data.get("namespace"),
+        json_data.get("title"),
+        json_data.get("comment"),
+        json_data.get("user"),
+        json_data.get("wiki"),
+        json_data.get("minor"),
+        json_data.get("patrolled"),
+        json_data.get("log_type"),
+        (length.get("new") or 0) - (length.get("old") or 0) if length else None,
+        json_data.get("bot"),
+    )
+
+    # RedisManager._event_tuple
+    def flag(value):
+        return "1" if value is True else "0" if value is False else ""
+
+    namespace = json_data.get("namespace")
+    fields = (
+        json_data.get("type") or "",
+        "" if namespace is None else str(namespace),
+        json_data.get("log_type") or "",
+        json_data.get("user") or "",
+        flag(json_data.get("bot")),
+        flag(json_data.get("minor")),
+        flag(json_data.get("patrolled")),
+        json_data.get("wiki") or "",
+        json_data.get("title") or "",
+        # dedup key is disabled in the benchmark manager, the event id is still sent
+        "",
+        meta.get("id") or "",
+    )
+    return row, fields
+
+
+def wiki_event_project(decode, line, psql_manager, redis_manager):
+    """Decode and project one line through a WikiEvent decoder."""
+    if not line.startswith(b"data: "):
+        return None
+    event = decode(line[6:])
+    if event is None:
+        return None
+    return psql_manager._event_row(event), redis_manager._event_tuple(event)
+
+
+def measure(fn, runs):
+    """Call fn runs times and return latency stats in milliseconds."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "runs": runs,
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "mean_ms": round(statistics.fmean(timings), 3),
+    }
+
+
+def decode_suite(lines, repeat):
+    """Return events/sec records per decode variant (best of repeat passes), after checking variants agree."""
+    psql_manager = PSQLManager()
+    redis_manager = RedisManager(dedup_seconds=0)
+    variants = {"stdlib dict (before)": lambda line: legacy_project(line, psql_manager, redis_manager)}
+    for name, decode in DECODERS.items():
+        variants[f"{name} WikiEvent"] = lambda line, decode=decode: wiki_event_project(
+            decode, line, psql_manager, redis_manager
+        )
+
+    # every variant has to produce the same rows and redis fields
+    expected = [variants["stdlib dict (before)"](line) for line in lines]
+    for name, project in variants.items():
+        if [project(line) for line in lines] != expected:
+            raise RuntimeError(f"{name} projection differs from the stdlib path")
+
+    # interleave variants across passes so machine noise and gc state hit them alike
+    best = {}
+    for _ in range(repeat):
+        for name, project in variants.items():
+            gc.collect()
+            start = time.perf_counter()
+            for line in lines:
+                project(line)
+            elapsed = time.perf_counter() - start
+            best[name] = min(elapsed, best.get(name, elapsed))
+
+    return [
+        {"suite": "decode", "name": name, "params": {"payloads": len(lines)}, "events_per_sec": round(len(lines) / elapsed)}
+        for name, elapsed in best.items()
+    ]
+
+
+def fresh_events(count, **kwargs):
+    """Decode count synthetic events (new ids every call, so redis dedup never skips them)."""
+    return [decode_event(frame.data) for frame in synthetic_events(count, **kwargs)]
+
+
+def redis_manager_for(args, write_mode="pipeline"):
+    """Return a RedisManager on the scratch target: fakeredis or the --redis-db database."""
+    manager = RedisManager(write_mode=write_mode)
+    if args.fakeredis:
+        import fakeredis
+
+        manager.client = fakeredis.FakeRedis(server=args.fakeredis_server, decode_responses=True)
+    else:
+        manager.db = args.redis_db
+        if not manager.connect():
+            sys.exit(1)
+    if write_mode == "lua":
+        manager.register_scripts()
+    return manager
+
+
+def psql_manager_for(args, batch_size=1):
+    """Return a connected PSQLManager on the --psql-dbname scratch database."""
+    manager = PSQLManager(batch_size=batch_size)
+    manager.dbname = args.psql_dbname
+    if not manager.connect():
+        sys.exit(1)
+    return manager
+
+
+def ingest_suite(args):
+    """Return events/sec records for single-event vs batched writes into each sink."""
+    results = []
+
+    def record(sink, name, count, elapsed):
+        print(f"ingest {sink} {name:<24} {count / elapsed:>10,.0f} events/sec")
+        results.append(
+            {
+                "suite": "ingest",
+                "name": f"{sink} {name}",
+                "params": {"events": count},
+                "events_per_sec": round(count / elapsed),
+            }
+        )
+
+    if args.redis_target:
+        for write_mode in ("pipeline", "lua"):
+            manager = redis_manager_for(args, write_mode)
+            manager.client.flushdb()
+
+            # one event per call pays a round trip each, so it gets a smaller sample
+            events = fresh_events(min(args.events, 5000))
+            start = time.perf_counter()
+            for event in events:
+                manager.process_event(event)
+            record("redis", f"{write_mode} process_event", len(events), time.perf_counter() - start)
+
+            events = fresh_events(args.events)
+            start = time.perf_counter()
+            for i in range(0, len(events), args.batch_size):
+                manager.process_events(events[i : i + args.batch_size])
+            record("redis", f"{write_mode} batch={args.batch_size}", len(events), time.perf_counter() - start)
+            manager.client.close()
+
+    if args.psql_dbname:
+        for batch_size in (1, args.batch_size):
+            manager = psql_manager_for(args, batch_size)
+            events = fresh_events(min(args.events, 2000) if batch_size == 1 else args.events)
+            start = time.perf_counter()
+            if batch_size == 1:
+                for event in events:
+                    manager.process_event(event)
+            else:
+                for i in range(0, len(events), batch_size):
+                    manager.process_events(events[i : i + batch_size])
+            manager.flush()
+            name = "process_event" if batch_size == 1 else f"batch={batch_size}"
+            record("psql", name, len(events), time.perf_counter() - start)
+            manager.conn.close()
+
+    return results
+
+
+def seed_redis(manager, total_keys, events_per_minute):
+    """Fill the last hour of minute buckets through process_events, then pad the keyspace to total_keys.
+
+    Returns {minute bucket: Counter of user -> events} tallied before any top-user set was trimmed.
+    """
+    manager.client.flushdb()
+    current_minute = manager.get_minute_bucket()
+    exact = {}
+
+    def write(minute, events):
+        # attribute the batch to that minute bucket as if it had been ingested then
+        manager.get_minute_bucket = lambda: minute
+        manager.process_events(events)
+        del manager.get_minute_bucket
+        exact.setdefault(minute, Counter()).update(event.user for event in events if event.user)
+
+    for minute in range(current_minute - 59, current_minute + 1):
+        write(minute, fresh_events(events_per_minute))
+    manager.roll_windows()
+    # a batch that read the clock before its minute closed but landed after that minute was trimmed
+    write(current_minute - 1, fresh_events(events_per_minute))
+    manager.roll_windows()
+
+    # unrelated keys stand in for everything else living in a shared redis
+    existing = manager.client.dbsize()
+    pipe = manager.client.pipeline(transaction=False)
+    for start in range(existing, total_keys, 10000):
+        pipe.mset({f"bench:filler:{i}": "1" for i in range(start, min(start + 10000, total_keys))})
+        pipe.execute()
+    return exact
+
+
+def check_top_users(analytics, exact, windows=(5, 60)):
+    """Fail if the trimmed top-user sketch disagrees with the exact seeded tallies beyond its error bound."""
+    current_minute = analytics.redis.get_minute_bucket()
+    for window in windows:
+        counts = Counter()
+        for minute in range(current_minute - window + 1, current_minute + 1):
+            counts.update(exact.get(minute, {}))
+        violations = analytics.check_top_users(window, counts)
+        if violations:
+            raise RuntimeError(f"{window}m top users outside the error bound (user, exact, low, high): {violations}")
+
+
+def redis_suite(args):
+    """Return latency records for the dashboard/console redis reads at each keyspace size."""
+    manager = redis_manager_for(args)
+    analytics = RedisAnalytics(manager)
+    reads = {
+        "aggregate_windows [5, 60]": lambda: analytics.aggregate_windows([5, 60]),
+        "rolling_totals [5, 60]": lambda: analytics.rolling_totals([5, 60]),
+        "top_users_window 5m": lambda: analytics.top_users_window(5),
+        "top_users_window 1h": lambda: analytics.top_users_window(60),
+        "top_users_window_exact 1h": lambda: analytics.top_users_window_exact(60),
+        "distinct_counts [5, 60]": lambda: analytics.distinct_counts([5, 60]),
+        "print_metrics 5m": lambda: manager.print_metrics("5m"),
+        "print_metrics 1h": lambda: manager.print_metrics("1h"),
+    }
+
+    # the error bound only matters once minute sets overflow, so it is checked at a capacity they exceed
+    bounded = redis_manager_for(args)
+    bounded.top_users_capacity = 5
+    check_top_users(RedisAnalytics(bounded), seed_redis(bounded, 0, args.events_per_minute))
+
+    results = []
+    for total_keys in args.redis_keys:
+        seed_redis(manager, total_keys, args.events_per_minute)
+        for name, read in reads.items():
+            with contextlib.redirect_stdout(io.StringIO()):
+                stats = measure(read, args.runs)
+            print(f"redis {total_keys:>9} keys  {name:<28} p50 {stats['p50_ms']:>9.3f} ms  p95 {stats['p95_ms']:>9.3f} ms")
+            results.append({"suite": "redis", "name": name, "params": {"keys": total_keys}, **stats})
+
+    manager.client.flushdb()
+    manager.client.close()
+    return results
+
+
+def seed_psql(manager, rows, hours=6):
+    """Grow raw_events to rows synthetic events over the last hours, then rebuild rollups and analyze."""
+    cur = manager.conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM raw_events")
+    existing = cur.fetchone()[0]
+    manager.conn.commit()
+    manager.ensure_partitions(hours_ahead=3, hours_back=hours + 1)
+
+    # generated server-side in 1M-row statements; user activity is skewed toward low user numbers
+    for start in range(existing, rows, 1000000):
+        end = min(start + 1000000, rows)
+        cur.execute(
+            """
+            INSERT INTO raw_events
+                (id, domain, dt, type, namespace, title, comment, "user", wiki, minor, patrolled, log_type, length, bot)
+            SELECT
+                'bench-' || g,
+                w.wiki || '.org',
+                now() - random() * (%s * interval '1 hour'),
+                t.type,
+                (ARRAY[0, 0, 0, 1, 2, 4, 6, 14])[1 + floor(random() * 8)::int],
+                'Page ' || floor(random() * 50000)::int,
+                'bench',
+                'user' || floor(5000 * power(random(), 3))::int,
+                w.wiki,
+                CASE WHEN t.type = 'edit' THEN random() < 0.4 END,
+                CASE WHEN t.type = 'edit' THEN random() < 0.6 END,
+                CASE WHEN t.type = 'log' THEN 'upload' END,
+                CASE WHEN t.type IN ('edit', 'new') THEN floor(random() * 2500)::int - 500 END,
+                random() < 0.3
+            FROM generate_series(%s, %s) AS g
+            CROSS JOIN LATERAL (
+                SELECT (ARRAY['enwiki', 'dewiki', 'wikidatawiki', 'commonswiki', 'frwiki'])[1 + floor(random() * 5)::int] AS wiki
+                WHERE g IS NOT NULL
+            ) AS w
+            CROSS JOIN LATERAL (
+                SELECT (ARRAY['edit', 'edit', 'edit', 'categorize', 'log', 'new'])[1 + floor(random() * 6)::int] AS type
+                WHERE g IS NOT NULL
+            ) AS t
+            ON CONFLICT DO NOTHING
+            """,
+            (hours, start, end - 1),
+        )
+        manager.conn.commit()
+        print(f"seeded raw_events to {end} rows")
+    cur.close()
+
+    manager.rebuild_rollups(since_hours=hours + 1)
+    manager.connect()
+    manager.conn.autocommit = True
+    manager.conn.cursor().execute("VACUUM ANALYZE raw_events, minute_rollups")
+    manager.conn.autocommit = False
+
+
+def psql_suite(args):
+    """Return latency records for every PSQLAnalytics query at each seeded row count."""
+    manager = psql_manager_for(args)
+    results = []
+    for rows in args.psql_rows:
+        seed_psql(manager, rows)
+        for use_rollups in (True, False):
+            analytics = PSQLAnalytics(manager, use_rollups)
+            source = "rollups" if use_rollups else "raw"
+            queries = {
+                "top_users_per_minute_today": analytics.top_users_per_minute_today,
+                "top_users_today": analytics.top_users_today,
+                "top_wikis_today": analytics.top_wikis_today,
+                "gap_filled_time_series 1h": analytics.gap_filled_time_series,
+                "event_size_distribution": analytics.event_size_distribution,
+                "event_type_distribution_today": analytics.event_type_distribution_today,
+                "wiki_event_type_distribution_today": analytics.wiki_event_type_distribution_today,
+                "patrolled_bot_distribution_today": analytics.patrolled_bot_distribution_today,
+                "snapshot": analytics.snapshot,
+            }
+            for name, query in queries.items():
+                stats = measure(query, args.runs)
+                print(f"psql {rows:>9} rows  {source:<7} {name:<36} p50 {stats['p50_ms']:>9.3f} ms")
+                results.append({"suite": "psql", "name": f"{source} {name}", "params": {"rows": rows}, **stats})
+
+    manager.conn.close()
+    return results
+
+
+def int_list(value):
+    """Parse a comma-separated list of ints (e.g. 10000,100000)."""
+    return [int(part) for part in value.split(",") if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the ingest and dashboard query paths")
+    parser.add_argument("suite", nargs="?", default="decode", choices=["decode", "ingest", "redis", "psql", "all"])
+    parser.add_argument("--json", help="write results to this file as json")
+    parser.add_argument("--label", default="", help="free-form label stored with the results (e.g. a release)")
+    parser.add_argument("--payloads", help="decode: recorded SSE data lines or JSON lines (default: synthetic)")
+    parser.add_argument("--count", type=int, default=20000, help="decode: synthetic payloads to generate")
+    parser.add_argument("--repeat", type=int, default=5, help="decode: passes per variant, best one is reported")
+    parser.add_argument("--events", type=int, default=20000, help="ingest: events per batched run")
+    parser.add_argument("--batch-size", type=int, default=500, help="ingest: events per batched call")
+    parser.add_argument("--runs", type=int, default=20, help="redis/psql: timed calls per read")
+    parser.add_argument("--redis-keys", type=int_list, default=[10000, 100000, 1000000], help="redis: total key counts")
+    parser.add_argument("--events-per-minute", type=int, default=300, help="redis: seeded events per minute bucket")
+    parser.add_argument("--psql-rows", type=int_list, default=[1000000, 10000000], help="psql: seeded row counts")
+    parser.add_argument("--fakeredis", action="store_true", help="run redis benchmarks in-process on fakeredis")
+    parser.add_argument("--redis-db", type=int, help="scratch redis database index (flushed by the benchmark)")
+    parser.add_argument("--psql-dbname", help="scratch postgres database (seeded by the benchmark)")
+    args = parser.parse_args()
+
+    args.redis_target = args.fakeredis or args.redis_db is not None
+    if args.fakeredis:
+        import fakeredis
+
+        args.fakeredis_server = fakeredis.FakeServer()
+    if args.redis_db == 0:
+        parser.error("--redis-db 0 is the pipeline's database; pick a scratch index")
+    # PSQLManager reads PSQL_DBNAME (from the environment or .env) as the pipeline's database
+    if args.psql_dbname and args.psql_dbname == PSQLManager().dbname:
+        parser.error(f"--psql-dbname {args.psql_dbname} is the pipeline's database (PSQL_DBNAME); pick a scratch one")
+
+    suites = ["decode", "ingest", "redis", "psql"] if args.suite == "all" else [args.suite]
+    if "redis" in suites and not args.redis_target:
+        if args.suite != "all":
+            parser.error("the redis suite needs --fakeredis or --redis-db")
+        suites.remove("redis")
+    if "psql" in suites and not args.psql_dbname:
+        if args.suite != "all":
+            parser.error("the psql suite needs --psql-dbname")
+        suites.remove("psql")
+    if "ingest" in suites and not (args.redis_target or args.psql_dbname):
+        if args.suite != "all":
+            parser.error("the ingest suite needs --fakeredis/--redis-db and/or --psql-dbname")
+        suites.remove("ingest")
+
+    results = []
+    if "decode" in suites:
+        lines = load_payloads(args.payloads) if args.payloads else synthetic_payloads(args.count)
+        avg_bytes = sum(len(line) for line in lines) / max(1, len(lines))
+        print(f"{len(lines)} payloads, {avg_bytes:.0f} bytes avg")
+        decode_results = decode_suite(lines, args.repeat)
+        baseline = decode_results[0]["events_per_sec"]
+        for result in decode_results:
+            rate = result["events_per_sec"]
+            print(f"{result['name']:<22} {rate:>12,.0f} events/sec  {rate / baseline:5.2f}x")
+        results.extend(decode_results)
+    if "ingest" in suites:
+        results.extend(ingest_suite(args))
+    if "redis" in suites:
+        results.extend(redis_suite(args))
+    if "psql" in suites:
+        results.extend(psql_suite(args))
+
+    if args.json:
+        report = {
+            "meta": {
+                "label": args.label,
+                "started": datetime.now(timezone.utc).isoformat(),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "redis": "fakeredis" if args.fakeredis else args.redis_db,
+                "decoders": list(DECODERS),
+            },
+            "results": results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"wrote {len(results)} results to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+"""
+In-process pipeline metrics with a Prometheus text exposition endpoint.
+
+Counters, gauges and fixed-bucket histograms live in a module-level REGISTRY,
+are updated from the event loop and the sink worker threads, and are rendered
+on demand by the aiohttp /metrics handler started with serve(). Updates are a
+lock acquire plus an add (histograms add a bisect), so they stay cheap enough
+to call once per event on the hot path.
+"""
+
+# seconds; covers sub-millisecond batch writes up to multi-second stalls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# seconds; a single payload decode takes microseconds
+PARSE_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005)
+# seconds between an event's meta.dt and the moment a sink finished it
+LAG_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+class CounterValue:
+    """One monotonically increasing series."""
+
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        return [(name, labels, self.value)]
+
+
+class GaugeValue:
+    """One series that can go up and down, or be read from a callback at scrape time."""
+
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Report function() at scrape time instead of the stored value (e.g. a queue's qsize)."""
+        self.function = function
+
+    def samples(self, name, labels):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                return []
+        return [(name, labels, value)]
+
+
+class HistogramValue:
+    """One fixed-bucket distribution of observed values."""
+
+    __slots__ = ("bounds", "counts", "sum", "lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # last slot is the +Inf bucket
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        """Observe the wall time spent inside the with block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self, name, labels):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.bounds, counts):
+            cumulative += count
+            samples.append((f"{name}_bucket", labels + (("le", format_value(bound)),), cumulative))
+        cumulative += counts[-1]
+        samples.append((f"{name}_bucket", labels + (("le", "+Inf"),), cumulative))
+        samples.append((f"{name}_sum", labels, total))
+        samples.append((f"{name}_count", labels, cumulative))
+        return samples
+
+
+class Metric:
+    """A named metric family; labels(...) returns (and caches) the series for one label set."""
+
+    KINDS = {"counter": CounterValue, "gauge": GaugeValue, "histogram": HistogramValue}
+
+    def __init__(self, name, help, kind, labelnames=(), buckets=LATENCY_BUCKETS):
+        if kind not in self.KINDS:
+            raise ValueError(f"unknown metric type: {kind}")
+
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        """Return the series for these label values, in labelnames order."""
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self.lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = HistogramValue(self.buckets) if self.kind == "histogram" else self.KINDS[self.kind]()
+                    self.children[values] = child
+        return child
+
+    # unlabeled metrics are used directly
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def render(self):
+        """Return this family in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self.children.items()):
+            labels = tuple(zip(self.labelnames, values))
+            for name, sample_labels, value in child.samples(self.name, labels):
+                lines.append(f"{name}{format_labels(sample_labels)} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Registry:
+    """Collection of metric families, created once by name and rendered together."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get_or_create(self, name, help, kind, labelnames, buckets=LATENCY_BUCKETS):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = Metric(name, help, kind, labelnames, buckets)
+                self.metrics[name] = metric
+            elif metric.kind != kind or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"metric {name} already registered as a different {metric.kind}")
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get_or_create(name, help, "counter", labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._get_or_create(name, help, "gauge", labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get_or_create(name, help, "histogram", labelnames, buckets)
+
+    def render(self):
+        """Return every family in the Prometheus text format."""
+        return "\n".join(metric.render() for metric in list(self.metrics.values()) if metric.children) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def format_value(value):
+    """Format a sample value the way Prometheus parses it."""
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def format_labels(labels):
+    """Format (name, value) pairs as a {name="value"} label block, escaping values."""
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Throughput:
+    """Turns a counter series into an events/sec gauge, updated by calling update() periodically."""
+
+    def __init__(self, counter, gauge):
+        self.counter = counter
+        self.gauge = gauge
+        self.last_value = counter.value
+        self.last_time = time.monotonic()
+
+    def update(self):
+        now = time.monotonic()
+        value = self.counter.value
+        elapsed = now - self.last_time
+        if elapsed > 0:
+            self.gauge.set((value - self.last_value) / elapsed)
+        self.last_value = value
+        self.last_time = now
+
+
+async def serve(port, host="0.0.0.0", registry=REGISTRY):
+    """Start the /metrics endpoint on the running event loop; return the runner to clean up, or None."""
+
+    async def handle_metrics(request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        print(f"metrics endpoint error: {e}")
+        await runner.cleanup()
+        return None
+
+    print(f"serving metrics on http://{host}:{port}/metrics")
+    return runner
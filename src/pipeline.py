@@ -1,111 +1,682 @@
 from redis_manager import RedisManager
-from psql_manager import PSQLManager
+from psql_manager import FLUSHED_ROWS, PSQLManager
+from archive_manager import ArchiveManager
+from wiki_event import decode_event, get_stream_decoder
+from sse import SSEParser
+from metrics import LAG_BUCKETS, PARSE_BUCKETS, REGISTRY, Throughput, serve
+from spool import Spool
+from collections import deque
+from datetime import datetime
 import aiohttp
 import asyncio
-import json
+import itertools
+import os
+import threading
 import time
 import random
+import zlib
 
 """
 Main Wikimedia stream ingestion pipeline.
 
 This module ingests recent-change events, updates Redis real-time counters,
 stores raw events in PostgreSQL, and enforces a time-bounded run window.
+
+The stream reader only parses SSE frames and hands events to bounded queues,
+one per storage sink. Redis and PostgreSQL workers drain their queue in
+batches on worker threads, so a slow round trip never stalls the socket read.
+
+The reader tracks SSE event ids. The newest id every sink has finished is
+checkpointed in Redis and sent as Last-Event-ID on reconnect or restart, and
+Redis skips events it already counted, so a dropped connection doesn't lose
+or double-count events.
+
+With a spool directory, a batch a sink can't store because Redis or
+PostgreSQL is unreachable goes to that sink's disk spool (spool.py) instead of
+being dropped, and a drain task replays it once the sink is back; the
+"spool" backpressure policy also spills a full queue to disk rather than
+slowing the reader.
+
+Several pipelines can split one stream between them by shard (see
+supervisor.py); each reads the whole stream but keeps only its own events.
+
+Per-stage latency, queue depth, throughput, drops/failures and event lag are
+recorded in metrics.REGISTRY and served on /metrics when a metrics port is set.
 """
 
 
-async def wiki_connect(run_seconds, retention_hours):
-    """Stream events for run_seconds while keeping only retention_hours of raw rows."""
+# wikimedia SSE endpoint and required user-agent policy header
+STREAM_URI = "https://stream.wikimedia.org/v2/stream/{stream}"
+HEADERS = {
+    "User-Agent": "WikipediaEditPipeline/1.0 (https://github.com/eswenke; swenke.ethan.us@gmail.com) aiohttp/3.13.3",
+}
 
-    # wikimedia SSE endpoint and required user-agent policy header
-    uri = "https://stream.wikimedia.org/v2/stream/recentchange"
-    headers = {
-        "User-Agent": "WikipediaEditPipeline/1.0 (https://github.com/eswenke; swenke.ethan.us@gmail.com) aiohttp/3.13.3",
-    }
+# instrumentation, served on /metrics
+EVENTS_READ = REGISTRY.counter("wiki_pipeline_events_read_total", "change events decoded from the stream")
+EVENTS_PER_SECOND = REGISTRY.gauge("wiki_pipeline_events_per_second", "change events read per second, recent average")
+INVALID_EVENTS = REGISTRY.counter("wiki_pipeline_invalid_events_total", "stream payloads that failed to decode")
+PARSE_SECONDS = REGISTRY.histogram(
+    "wiki_pipeline_parse_seconds", "time to decode one payload into a WikiEvent, sampled", buckets=PARSE_BUCKETS
+)
+SHARD_SKIPPED = REGISTRY.counter("wiki_pipeline_shard_skipped_events_total", "events left to other shards")
+STREAM_RECONNECTS = REGISTRY.counter("wiki_pipeline_stream_reconnects_total", "stream connections retried after a drop")
+QUEUE_DEPTH = REGISTRY.gauge("wiki_pipeline_queue_depth", "events waiting in a sink queue", ("sink",))
+DROPPED_EVENTS = REGISTRY.counter(
+    "wiki_pipeline_dropped_events_total", "events evicted from a full sink queue under drop_oldest", ("sink",)
+)
+SPILLED_EVENTS = REGISTRY.counter(
+    "wiki_pipeline_spilled_events_total", "events written to the spool because a sink queue was full", ("sink",)
+)
+SINK_EVENTS = REGISTRY.counter("wiki_pipeline_sink_events_total", "events handed to a sink", ("sink",))
+FAILED_EVENTS = REGISTRY.counter(
+    "wiki_pipeline_failed_events_total", "events in batches a sink failed to process", ("sink",)
+)
+SINK_BATCH_SECONDS = REGISTRY.histogram(
+    "wiki_pipeline_sink_batch_seconds", "time for a sink to process one batch, worker thread hop included", ("sink",)
+)
+EVENT_LAG = REGISTRY.histogram(
+    "wiki_pipeline_event_lag_seconds", "event meta.dt to sink finished, per batch", ("sink",), buckets=LAG_BUCKETS
+)
+LAST_EVENT_LAG = REGISTRY.gauge(
+    "wiki_pipeline_last_event_lag_seconds", "lag of the newest event a sink finished", ("sink",)
+)
+# per-event series are bound once; decode latency is timed on one event in PARSE_SAMPLE_EVERY
+EVENTS_READ_SERIES = EVENTS_READ.labels()
+PARSE_SECONDS_SERIES = PARSE_SECONDS.labels()
+PARSE_SAMPLE_EVERY = 8
+# numbers every payload handed to decode, including ones later left to another shard
+DECODE_SEQUENCE = itertools.count()
 
-    # connect analytics/cache service
-    redis_manager = RedisManager()
-    redis_manager.connect()
-
-    # connect durable raw-event storage
-    psql_manager = PSQLManager()
-    psql_manager.connect()
-
-    # one-time prune at startup to keep table bounded for local runs
-    if not psql_manager.prune_old_raw_events(retention_hours):
-        print("failed to prune old raw events")
-        redis_manager.client.close()
-        psql_manager.conn.close()
-        return
 
-    # stop processing once the requested runtime window has passed
-    deadline = time.monotonic() + run_seconds
+def event_lag_seconds(event):
+    """Return seconds between an event's meta.dt and now, or None if dt is missing or malformed."""
+    try:
+        return time.time() - datetime.fromisoformat(event.dt).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def shard_filter(index, count, key="wiki"):
+    """Return a WikiEvent predicate keeping shard index of count, split on the wiki or the event id.
+
+    crc32 keeps the split stable across processes and restarts. Sharding on wiki keeps each
+    wiki's postgres rollup rows on one writer, but a few large wikis dominate the stream;
+    sharding on id balances load evenly.
+    """
+    if key not in ("wiki", "id"):
+        raise ValueError(f"unknown shard key: {key}")
+    if not 0 <= index < count:
+        raise ValueError(f"shard index {index} out of range for {count} shards")
+
+    def accept(event):
+        value = event.wiki if key == "wiki" else event.id
+        return zlib.crc32((value or "").encode()) % count == index
+
+    return accept
+
+
+class EventQueue:
+    """Bounded asyncio queue with a block, drop-oldest or spool backpressure policy."""
+
+    POLICIES = {"block", "drop_oldest", "spool"}
+
+    def __init__(self, maxsize, policy="block", name=None, spool=None):
+        """Create the queue; drop_oldest evicts the oldest event instead of waiting.
+
+        spool appends events that don't fit to that Spool for its drain task to replay; they are
+        collected and written in batches on a worker thread, so the event loop never waits on disk.
+        A named queue reports its depth and drops as that sink's metrics.
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"unknown backpressure policy: {policy}")
+        if policy == "spool" and spool is None:
+            raise ValueError("the spool backpressure policy needs a spool")
+
+        self.queue = asyncio.Queue(maxsize)
+        self.policy = policy
+        self.spool = spool
+        # spilled events waiting for the spill writer, and the task writing the previous batch
+        self.spill = []
+        self.spill_task = None
+        self.dropped = 0
+        self.spilled = 0
+        self.closed = False
+        self.dropped_metric = None
+        self.spilled_metric = None
+        if name is not None:
+            QUEUE_DEPTH.labels(name).set_function(self.queue.qsize)
+            self.dropped_metric = DROPPED_EVENTS.labels(name)
+            self.spilled_metric = SPILLED_EVENTS.labels(name)
+
+    async def put(self, event):
+        """Enqueue one event according to the backpressure policy."""
+        if self.policy == "drop_oldest":
+            # make room by discarding the oldest queued events, never the newest
+            while self.queue.full():
+                self.queue.get_nowait()
+                self.dropped += 1
+                if self.dropped_metric is not None:
+                    self.dropped_metric.inc()
+            self.queue.put_nowait(event)
+        elif self.policy == "spool" and self.queue.full():
+            # the sink is behind: keep the event on disk instead of making the reader wait
+            self.spill.append(event)
+            self.spilled += 1
+            if self.spilled_metric is not None:
+                self.spilled_metric.inc()
+            if self.spill_task is None or self.spill_task.done():
+                self.spill_task = asyncio.ensure_future(self._write_spill())
+            elif len(self.spill) >= self.queue.maxsize:
+                # the disk is slower than the stream too: wait for the writer rather than buffer without bound
+                await asyncio.shield(self.spill_task)
+        else:
+            await self.queue.put(event)
+
+    async def _write_spill(self):
+        """Append spilled events to the spool on a worker thread, a batch at a time, until none are left."""
+        while self.spill:
+            batch, self.spill = self.spill, []
+            await asyncio.to_thread(self.spool.append, batch)
+
+    async def close(self):
+        """Write out any spilled events, then signal consumers that no more events will arrive."""
+        if self.spill_task is not None:
+            await self.spill_task
+        # sentinel always waits for room so a drain can't lose it
+        await self.queue.put(None)
+
+    async def get_batch(self, max_items, timeout):
+        """Return up to max_items events, or an empty list if none arrive within timeout."""
+        batch = []
+        if self.closed:
+            return batch
+
+        try:
+            event = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return batch
+
+        # take whatever else is already queued without waiting
+        while True:
+            if event is None:
+                self.closed = True
+                break
+            batch.append(event)
+            if len(batch) >= max_items or self.queue.empty():
+                break
+            event = self.queue.get_nowait()
+
+        return batch
+
+    def qsize(self):
+        """Return the number of queued events."""
+        return self.queue.qsize()
+
+
+class StreamCheckpoint:
+    """Tracks the newest stream event id that every sink has finished with."""
+
+    def __init__(self, sinks, last_event_id=None):
+        """Start from a previously persisted id, if any."""
+        # (offset, event id) for events read but not yet finished by every sink, in read order
+        self.pending = deque()
+        self.finished = {sink: 0 for sink in sinks}
+        self.offset = 0
+        # newest id read from the stream (resume point for reconnects within this run)
+        self.read_id = last_event_id
+        # newest id every sink has finished (resume point after a restart)
+        self.last_event_id = last_event_id
+        self.lock = threading.Lock()
+
+    def read(self, event, event_id):
+        """Number a freshly read event and remember its stream id."""
+        self.offset += 1
+        event.offset = self.offset
+        if event_id is not None:
+            self.pending.append((self.offset, event_id))
+            self.read_id = event_id
+
+    def skip(self, event_id):
+        """Remember the id of an event this reader filtered out, so resume points move past it."""
+        if event_id is None:
+            return
+        self.read_id = event_id
+        with self.lock:
+            # nothing read before it is still in flight, so it is a safe resume point already
+            if not self.pending and min(self.finished.values()) >= self.offset:
+                self.last_event_id = event_id
+            else:
+                # released together with the last kept event read before it
+                self.pending.append((self.offset, event_id))
+
+    def processed(self, sink, offset):
+        """Mark a sink as finished through offset and advance past ids every sink has finished."""
+        with self.lock:
+            self.finished[sink] = max(self.finished[sink], offset or 0)
+
+            floor = min(self.finished.values())
+            while self.pending and self.pending[0][0] <= floor:
+                self.last_event_id = self.pending.popleft()[1]
+
+
+class IngestWatermark:
+    """Publishes the ingest watermark that invalidates cached analytics queries (see query_cache.py)."""
+
+    def __init__(self, redis_manager, flushed_rows):
+        """Watch flushed_rows, a counter of rows sent to postgres by every manager in this process."""
+        self.redis_manager = redis_manager
+        self.flushed_rows = flushed_rows
+        self.published = flushed_rows.value
+
+    def update(self, force=False):
+        """Bump the watermark if postgres has received rows since the last bump (or always, with force)."""
+        rows = self.flushed_rows.value
+        if (force or rows != self.published) and self.redis_manager.publish_ingest_watermark():
+            self.published = rows
+
+
+async def sink_worker(name, event_queue, process_batch, batch_size, idle_seconds, on_idle=None, on_batch=None):
+    """Drain event_queue in batches into a blocking sink until the queue is closed."""
+    batch_seconds = SINK_BATCH_SECONDS.labels(name)
+    sink_events = SINK_EVENTS.labels(name)
+    failed_events = FAILED_EVENTS.labels(name)
+    event_lag = EVENT_LAG.labels(name)
+    last_event_lag = LAST_EVENT_LAG.labels(name)
+
+    while not event_queue.closed:
+        batch = await event_queue.get_batch(batch_size, idle_seconds)
+
+        if batch:
+            # blocking client calls run on a worker thread to keep the event loop free
+            start = time.perf_counter()
+            processed = await asyncio.to_thread(process_batch, batch)
+            batch_seconds.observe(time.perf_counter() - start)
+            sink_events.inc(len(batch))
+            if not processed:
+                failed_events.inc(len(batch))
+                print(f"failed to process {len(batch)} events with {name}")
+
+            # the newest event of the batch stands in for the whole batch's lag
+            lag = event_lag_seconds(batch[-1])
+            if lag is not None:
+                event_lag.observe(lag)
+                last_event_lag.set(lag)
+            # failed batches are dropped, so they still move the checkpoint forward
+            if on_batch is not None:
+                on_batch(batch)
+        elif on_idle is not None:
+            await asyncio.to_thread(on_idle)
+
+
+def spool_drainer(manager, flush=False):
+    """Return a drain_worker callable storing a batch with manager (flushing it if flush is set).
+
+    It returns False only if the sink was unreachable, so the batch is retried; a batch the sink
+    rejected for its data is dropped like it would be on the live path.
+    """
+    unavailable = []
+    manager.on_drop = unavailable.extend
+
+    def process_batch(events):
+        unavailable.clear()
+        manager.process_events(events)
+        if flush:
+            manager.flush()
+        return not unavailable
+
+    return process_batch
+
+
+async def drain_worker(name, spool, process_batch, batch_size, stop, idle_seconds=1.0, max_backoff_seconds=30.0):
+    """Replay a sink's spooled events through process_batch, oldest first, until stop is set.
+
+    A batch is committed (removed from the spool) only after process_batch returns True, so a
+    crash or an outage replays it rather than losing it; failures back off exponentially.
+    """
+    failures = 0
+    while not stop.is_set():
+        batch = await asyncio.to_thread(spool.read, batch_size)
+        if batch and await asyncio.to_thread(process_batch, batch):
+            await asyncio.to_thread(spool.commit)
+            failures = 0
+            continue
+
+        delay = idle_seconds
+        if batch:
+            failures += 1
+            delay = min(max_backoff_seconds, idle_seconds * 2**failures)
+            print(f"{name} still unavailable, retrying {spool.pending} spooled events in {delay:.0f}s")
+        try:
+            await asyncio.wait_for(stop.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def periodic_worker(task, interval_seconds):
+    """Run a blocking maintenance task on a worker thread every interval_seconds, until cancelled.
+
+    A run in progress when the worker is cancelled finishes first, so once the cancelled worker
+    has been awaited nothing is still using its connections.
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        run = asyncio.ensure_future(asyncio.to_thread(task))
+        try:
+            await asyncio.shield(run)
+        except asyncio.CancelledError:
+            await run
+            raise
+
+
+async def publish(sse_event, queues, checkpoint=None, pace=None, accept=None, decode=decode_event):
+    """Decode one parsed SSE event and hand it to every sink queue; return the WikiEvent or None.
+
+    accept filters decoded events (e.g. a shard_filter); decode maps the payload bytes for the stream.
+    """
+    # decode the JSON bytes straight into a WikiEvent, skipping unstored fields
+    sampled = next(DECODE_SEQUENCE) % PARSE_SAMPLE_EVERY == 0
+    start = time.perf_counter() if sampled else 0.0
+    try:
+        event = decode(sse_event.data)
+    except ValueError:
+        INVALID_EVENTS.inc()
+        print(f"invalid JSON for event: {sse_event.data.decode(errors='replace')}")
+        return None
+    if sampled:
+        PARSE_SECONDS_SERIES.observe(time.perf_counter() - start)
+
+    # edge case change events that don't match expected format
+    if event is None:
+        return None
+
+    # another shard's event: only its id matters, as a resume point
+    if accept is not None and not accept(event):
+        SHARD_SKIPPED.inc()
+        if checkpoint is not None:
+            checkpoint.skip(sse_event.id)
+        return None
+    EVENTS_READ_SERIES.inc()
+
+    # replay sources hold each event back until its (scaled) timestamp comes around
+    if pace is not None:
+        await pace(event)
+
+    if checkpoint is not None:
+        checkpoint.read(event, sse_event.id)
+    for event_queue in queues:
+        await event_queue.put(event)
+    return event
+
+
+async def read_stream(uri, headers, queues, deadline, checkpoint=None, accept=None, decode=decode_event):
+    """Parse SSE frames from the Wikimedia stream into the sink queues, resuming after drops."""
     i = 0
+    # reconnection time the server last asked for in a retry: field (kept across connections)
+    retry_ms = None
 
     while time.monotonic() < deadline:
+        # resume from the last event read instead of "now" so a drop doesn't lose events
+        request_headers = {}
+        if checkpoint is not None and checkpoint.read_id:
+            request_headers["Last-Event-ID"] = checkpoint.read_id
+        parser = SSEParser(checkpoint.read_id if checkpoint is not None else None)
+
         try:
             async with aiohttp.ClientSession(headers=headers) as session:
-                async with session.get(uri) as resp:
+                async with session.get(uri, headers=request_headers) as resp:
                     # raise on non-200 response codes
                     resp.raise_for_status()
 
-                    # consume SSE lines and parse payloads from `data: ...` records
-                    async for line in resp.content:
-                        now = time.monotonic()
-                        if now >= deadline:
-                            print("run window reached. stopping stream processing.")
-                            break
-
-                        if line:
-                            # decode bytes from the stream and remove trailing whitespace
-                            clean_line = line.decode().strip()
-
-                            # parse JSON payload from SSE data lines
-                            if clean_line.startswith("data: "):
-                                try:
-                                    i += 1
-                                    json_data = json.loads(clean_line[6:])
-
-                                    # edge case change events that don't match expected format
-                                    if "type" not in json_data or "meta" not in json_data:
-                                        continue
-
-                                    # update Redis real-time analytics
-                                    if not redis_manager.process_event(json_data):
-                                        print(f"failed to process event with redis: \n{json_data}")
-                                        continue
-
-                                    # persist raw event for deeper historical analysis
-                                    if not psql_manager.process_event(json_data):
-                                        print(f"failed to process event with psql: \n{json_data}")
-                                        continue
-
-                                    # lightweight throughput heartbeat
-                                    if i % 1000 == 0:
-                                        print(f"processed events: {i}")
-
-                                except json.JSONDecodeError:
-                                    print(f"invalid JSON for line: {clean_line}")
-                                    continue
+                    # feed raw chunks to the parser; frames can span chunks and span several data lines
+                    async for chunk in resp.content.iter_any():
+                        for sse_event in parser.feed(chunk):
+                            if await publish(sse_event, queues, checkpoint, accept=accept, decode=decode) is None:
+                                continue
+
+                            # lightweight throughput heartbeat
+                            i += 1
+                            if i % 1000 == 0:
+                                depths = ", ".join(f"{q.qsize()} queued/{q.dropped} dropped" for q in queues)
+                                print(f"processed events: {i} ({depths})")
 
         # sse connection drop, happens every so often. reconnect to continue event parsing
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             if time.monotonic() >= deadline:
                 break
 
-            reconnect_delay_seconds = random.randint(2, 10)
+            if parser.retry_ms is not None:
+                retry_ms = parser.retry_ms
+            reconnect_delay_seconds = retry_ms / 1000 if retry_ms is not None else random.randint(2, 10)
             # in case of rate limiting / backoff, per wiki sse stream policy
             if getattr(e, "status", None) == 429:
                 retry_after = e.headers.get("Retry-After") if hasattr(e, "headers") else None
                 reconnect_delay_seconds = int(retry_after) if retry_after else reconnect_delay_seconds
 
-            print(f"connection issue: {e}. reconnecting in {reconnect_delay_seconds}s...")
+            STREAM_RECONNECTS.inc()
+            print(f"connection issue: {e}. reconnecting in {reconnect_delay_seconds:g}s...")
             await asyncio.sleep(reconnect_delay_seconds)
             continue
 
-        except Exception as e:
-            print(f"unexpected error: {e}")
-            break
+
+async def wiki_connect(
+    run_seconds,
+    retention_hours,
+    psql_batch_size=500,
+    psql_flush_seconds=2.0,
+    queue_size=10000,
+    backpressure="block",
+    sink_batch_size=500,
+    redis_write_mode="pipeline",
+    rollup_windows=(5, 15, 60),
+    rollover_seconds=5.0,
+    partition_maintenance_seconds=600,
+    stream="recentchange",
+    checkpoint_seconds=5.0,
+    source=None,
+    metrics_port=None,
+    shard=None,
+    partition_maintenance=True,
+    spool_dir=None,
+    archive_dir=None,
+):
+    """Stream events for run_seconds while keeping only retention_hours of raw rows.
+
+    source is an async callable (queues, deadline, checkpoint) that feeds events into the
+    sink queues, e.g. a replay from replay.py; by default the live Wikimedia stream is read.
+    metrics_port serves Prometheus metrics on /metrics for the length of the run.
+    shard is (index, count, key) to keep only that slice of the stream (see shard_filter), with its
+    own checkpoint. partition_maintenance=False leaves partition pruning/creation to another process.
+    spool_dir keeps batches for an unreachable sink on disk until it is back (needed by the "spool"
+    backpressure policy); without it they are dropped and the run doesn't start with a sink down.
+    archive_dir exports raw rows to parquet (archive_manager.py) before retention drops them.
+    Returns {"events": events read, "seconds": read-to-drained time, "dropped"/"spooled": per sink}.
+    """
+
+    uri = STREAM_URI.format(stream=stream)
+    headers = HEADERS
+
+    # connect analytics/cache service
+    redis_manager = RedisManager(write_mode=redis_write_mode, rollup_windows=rollup_windows)
+    redis_ready = redis_manager.connect()
+
+    # connect durable raw-event storage, buffering rows into multi-row inserts
+    psql_manager = PSQLManager(batch_size=psql_batch_size, flush_interval_seconds=psql_flush_seconds)
+    psql_ready = psql_manager.connect()
+
+    # separate connection for retention/partition upkeep so it never interleaves with sink transactions
+    maintenance_manager = PSQLManager()
+    maintenance_manager.connect()
+    if archive_dir is not None:
+        maintenance_manager.archive = ArchiveManager(archive_dir)
+
+    # separate clients replay spooled batches, so they don't share a transaction or buffer with the live sinks
+    redis_drain_manager = RedisManager(write_mode=redis_write_mode, rollup_windows=rollup_windows)
+    psql_drain_manager = PSQLManager(batch_size=sink_batch_size)
+    managers = [redis_manager, psql_manager, maintenance_manager]
+    if spool_dir is not None:
+        redis_drain_manager.connect()
+        psql_drain_manager.connect()
+        managers += [redis_drain_manager, psql_drain_manager]
+
+    def close_connections():
+        for manager in managers:
+            if isinstance(manager, RedisManager) and manager.client:
+                manager.client.close()
+            elif isinstance(manager, PSQLManager) and manager.conn:
+                manager.conn.close()
+
+    # with nowhere to keep their events, a run doesn't start against a sink that is down
+    if spool_dir is None and not (redis_ready and psql_ready):
+        print("redis or postgres unavailable and no spool directory. not starting.")
+        close_connections()
+        return
+
+    # prune at startup (and periodically below) to keep table bounded for local runs;
+    # a postgres that is down is left to the periodic pass while its rows spool
+    if partition_maintenance and maintenance_manager.conn is not None:
+        # a failed pass leaves rows in the default partition or past retention; the periodic pass retries it
+        if not maintenance_manager.prune_old_raw_events(retention_hours):
+            print("failed to prune old raw events, retrying on the next maintenance pass")
+
+    def psql_flush_if_due():
+        if psql_manager.flush_due() and not psql_manager.flush():
+            print("failed to flush buffered raw events")
+
+    # each shard keeps its own resume point, since each has finished a different subset of events
+    accept = None
+    checkpoint_name = stream
+    if shard is not None:
+        shard_index, shard_count, shard_key = shard
+        accept = shard_filter(shard_index, shard_count, shard_key)
+        checkpoint_name = f"{stream}:{shard_key}-shard-{shard_index}-of-{shard_count}"
+
+    # resume where the last run's sinks stopped; without a checkpoint the stream starts at "now"
+    checkpoint = StreamCheckpoint(("redis", "psql"), redis_manager.load_checkpoint(checkpoint_name))
+    if checkpoint.last_event_id:
+        print(f"resuming {checkpoint_name} from last event id {checkpoint.last_event_id}")
+
+    def save_checkpoint():
+        # postgres has only finished the rows it has flushed, not everything it buffered
+        checkpoint.processed("psql", psql_manager.flushed_offset)
+        redis_manager.save_checkpoint(checkpoint_name, checkpoint.last_event_id)
+
+    # one spool per sink and checkpoint, so shards and streams never replay each other's events
+    spools = {}
+    if spool_dir is not None:
+        for sink, manager in (("redis", redis_manager), ("psql", psql_manager)):
+            spools[sink] = Spool(os.path.join(spool_dir, checkpoint_name.replace(":", "_"), sink), sink)
+            manager.on_drop = spools[sink].append
+
+    # one bounded queue per sink so a slow store only backs up its own stage
+    redis_queue = EventQueue(queue_size, backpressure, "redis", spools.get("redis"))
+    psql_queue = EventQueue(queue_size, backpressure, "psql", spools.get("psql"))
+
+    metrics_runner = await serve(metrics_port) if metrics_port is not None else None
+    # cached dashboard queries stay valid while no new rows reach postgres
+    watermark = IngestWatermark(redis_manager, FLUSHED_ROWS.labels())
+    if partition_maintenance:
+        # the startup prune may have removed rows
+        watermark.update(force=True)
+    throughput = Throughput(EVENTS_READ_SERIES, EVENTS_PER_SECOND.labels())
+    workers = [
+        asyncio.create_task(
+            sink_worker(
+                "redis",
+                redis_queue,
+                redis_manager.process_events,
+                sink_batch_size,
+                idle_seconds=1.0,
+                on_batch=lambda batch: checkpoint.processed("redis", batch[-1].offset),
+            )
+        ),
+        asyncio.create_task(
+            sink_worker(
+                "psql",
+                psql_queue,
+                psql_manager.process_events,
+                sink_batch_size,
+                idle_seconds=psql_flush_seconds,
+                on_idle=psql_flush_if_due,
+            )
+        ),
+    ]
+    drain_stop = asyncio.Event()
+    drainers = []
+    if spools:
+        # the drain managers have their own connections; postgres rows are flushed per replayed batch
+        for sink, process_batch in (
+            ("redis", spool_drainer(redis_drain_manager)),
+            ("psql", spool_drainer(psql_drain_manager, flush=True)),
+        ):
+            drainers.append(
+                asyncio.create_task(drain_worker(sink, spools[sink], process_batch, sink_batch_size, drain_stop))
+            )
+    maintenance = [
+        asyncio.create_task(periodic_worker(save_checkpoint, checkpoint_seconds)),
+        asyncio.create_task(periodic_worker(watermark.update, checkpoint_seconds)),
+        asyncio.create_task(periodic_worker(throughput.update, 5.0)),
+        # rollover is an atomic, idempotent script, so every process can run it
+        asyncio.create_task(periodic_worker(redis_manager.roll_windows, rollover_seconds)),
+    ]
+    if partition_maintenance:
+        maintenance.append(
+            asyncio.create_task(
+                periodic_worker(
+                    # pruned rows also leave cached results stale
+                    lambda: maintenance_manager.prune_old_raw_events(retention_hours) and watermark.update(force=True),
+                    partition_maintenance_seconds,
+                )
+            )
+        )
+
+    if source is None:
+
+        decode = get_stream_decoder(stream)
+
+        def source(queues, deadline, checkpoint):
+            return read_stream(uri, headers, queues, deadline, checkpoint, accept, decode)
+
+    # stop reading once the requested runtime window has passed (or the source runs out)
+    started = time.monotonic()
+    deadline = started + run_seconds
+    try:
+        await asyncio.wait_for(source([redis_queue, psql_queue], deadline, checkpoint), run_seconds)
+    except asyncio.TimeoutError:
+        print("run window reached. stopping stream processing.")
+    except Exception as e:
+        print(f"unexpected error: {e}")
+
+    # drain whatever is still queued, then write any rows still buffered
+    for event_queue in (redis_queue, psql_queue):
+        await event_queue.close()
+    await asyncio.gather(*workers)
+    for task in maintenance:
+        task.cancel()
+    # whatever is still spooled stays on disk for the next run
+    drain_stop.set()
+    # nothing may still be using a connection when they are closed below
+    await asyncio.gather(*maintenance, *drainers, return_exceptions=True)
+
+    if redis_queue.dropped or psql_queue.dropped:
+        print(f"dropped events under backpressure: redis={redis_queue.dropped}, psql={psql_queue.dropped}")
+
+    if psql_manager.conn and not psql_manager.flush():
+        print("failed to flush buffered raw events")
+    save_checkpoint()
+    watermark.update()
+    stats = {
+        "events": checkpoint.offset,
+        "seconds": time.monotonic() - started,
+        "dropped": {"redis": redis_queue.dropped, "psql": psql_queue.dropped},
+        "spooled": {sink: spools[sink].pending if sink in spools else 0 for sink in ("redis", "psql")},
+    }
+    for sink, spool in spools.items():
+        if spool.pending:
+            print(f"{spool.pending} {sink} events left in {spool.directory} for the next run")
+        spool.close()
+
+    if redis_manager.duplicates:
+        print(f"skipped replayed events already counted in redis: {redis_manager.duplicates}")
 
     # print end-of-run metrics and close resources
     try:
@@ -117,13 +688,31 @@ async def wiki_connect(run_seconds, retention_hours):
     except Exception as e:
         print(f"error printing final metrics: {e}")
 
-    if redis_manager.client:
-        redis_manager.client.close()
-    if psql_manager.conn:
-        psql_manager.conn.close()
+    close_connections()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+    return stats
 
 
 if __name__ == "__main__":
     RUN_SECONDS = 360
     RETENTION_HOURS = 6  # keep raw events for 6 hours
-    asyncio.run(wiki_connect(RUN_SECONDS, RETENTION_HOURS))
+    QUEUE_SIZE = 10000  # events buffered per sink before backpressure applies
+    BACKPRESSURE = "block"  # or "drop_oldest" to shed load instead of slowing the reader
+    REDIS_WRITE_MODE = "pipeline"  # or "lua" for atomic server-side accounting per batch
+    METRICS_PORT = 9108  # prometheus scrape target at http://localhost:9108/metrics, None to disable
+    SPOOL_DIR = "spool"  # keeps events for an unreachable redis/postgres on disk, None to drop them
+    ARCHIVE_DIR = "archive"  # parquet copies of raw events past retention, None to just delete them
+    asyncio.run(
+        wiki_connect(
+            RUN_SECONDS,
+            RETENTION_HOURS,
+            queue_size=QUEUE_SIZE,
+            backpressure=BACKPRESSURE,
+            redis_write_mode=REDIS_WRITE_MODE,
+            metrics_port=METRICS_PORT,
+            spool_dir=SPOOL_DIR,
+            archive_dir=ARCHIVE_DIR,
+        )
+    )
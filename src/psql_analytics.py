@@ -1,4 +1,13 @@
+import threading
+import time as clock
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime, time, timedelta
+
 import pandas as pd
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extensions import QueryCanceledError
 
 # metrics:
 #   - event type counts per minute
@@ -16,26 +25,143 @@ import pandas as pd
 
 # can do many version of all these queries regarding time bounds / bot vs. human / etc.
 
+# time filters are half-open [start, end) ranges on the bare dt / minute columns, computed once
+# in python per request, so the planner can use the dt indexes and prune hourly partitions
+
+
+def today_range(now=None):
+    """Return the [start, end) range of the current local calendar day as aware datetimes."""
+    day = (now or datetime.now().astimezone()).date()
+    # combine with local midnight separately so a DST change can't shift the end bound
+    start = datetime.combine(day, time()).astimezone()
+    end = datetime.combine(day + timedelta(days=1), time()).astimezone()
+    return start, end
+
+
+def minute_range(window_hours, now=None):
+    """Return the [start, end) range of whole minutes covering the last window_hours, including this one."""
+    now = now or datetime.now().astimezone()
+    end = now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    start = (now - timedelta(hours=window_hours)).replace(second=0, microsecond=0)
+    return start, end
+
+
+def type_mix_frame(counts):
+    """Turn (type, event_count) counts into the type-mix frame: the four change types with percentages."""
+    frame = counts[counts["type"].isin(["edit", "categorize", "log", "new"])].copy()
+    frame["pct"] = (100.0 * frame["event_count"] / frame["event_count"].sum()).round(2)
+    return frame.sort_values("event_count", ascending=False, ignore_index=True)
+
+
+def patrolled_frame(counts):
+    """Turn (bot, patrolled, event_count) counts into per bot/human patrolled and unpatrolled totals."""
+    rows = []
+    for bot, group in counts.groupby("bot"):
+        rows.append(
+            {
+                "user_type": "bot" if bot else "human",
+                "event_count": int(group["event_count"].sum()),
+                "patrolled_count": int(group.loc[group["patrolled"].eq(True), "event_count"].sum()),
+                "unpatrolled_count": int(group.loc[group["patrolled"].eq(False), "event_count"].sum()),
+            }
+        )
+    frame = pd.DataFrame(rows, columns=["user_type", "event_count", "patrolled_count", "unpatrolled_count"])
+    return frame.sort_values("event_count", ascending=False, ignore_index=True)
+
+
+@dataclass
+class PostgresSnapshot:
+    """Dashboard datasets from one snapshot() call; a failed, timed-out or unrequested query leaves an empty frame."""
+
+    events: pd.DataFrame = field(default_factory=pd.DataFrame)
+    top_users: pd.DataFrame = field(default_factory=pd.DataFrame)
+    top_wikis: pd.DataFrame = field(default_factory=pd.DataFrame)
+    type_mix: pd.DataFrame = field(default_factory=pd.DataFrame)
+    event_size: pd.DataFrame = field(default_factory=pd.DataFrame)
+    patrolled: pd.DataFrame = field(default_factory=pd.DataFrame)
+    errors: dict = field(default_factory=dict)
+
+    @property
+    def complete(self):
+        """Return True when every query returned."""
+        return not self.errors
+
 
 class PSQLAnalytics:
-    def __init__(self, psql_manager):
-        """Store a connected PSQLManager used to execute analytics queries."""
+    def __init__(self, psql_manager, use_rollups=True, cache=None):
+        """Store a connected (or pooled) PSQLManager used to execute analytics queries.
+
+        With use_rollups, queries that only group by rollup dimensions read minute_rollups
+        instead of re-aggregating raw_events. With a QueryCache, results are shared through
+        Redis with every other process reading the same database.
+        """
         self.psql = psql_manager
+        self.use_rollups = use_rollups
+        self.cache = cache
+        # set by explain_index_usage so queries return their plans instead of rows
+        self.explain = False
+        # per-thread statement_timeout, so concurrent snapshot queries don't affect other callers
+        self.local = threading.local()
+        self.executor = None
 
     def _run_query(self, query, params=None):
-        """Execute a SQL query and return results as a pandas DataFrame."""
-        if not self.psql.conn:
+        """Return a SQL query's results as a pandas DataFrame, from the cache when one is set."""
+        if self.cache is None or self.explain:
+            return self._execute_query(query, params)
+
+        # don't wait on another caller's copy of the query for longer than this caller would run it
+        timeout_ms = getattr(self.local, "statement_timeout_ms", None)
+        return self.cache.get_or_compute(
+            (self.psql.host, self.psql.port, self.psql.dbname),
+            query,
+            params,
+            lambda: self._execute_query(query, params),
+            wait_seconds=timeout_ms / 1000 if timeout_ms else None,
+        )
+
+    def _execute_query(self, query, params=None):
+        """Execute a SQL query on a borrowed connection and return results as a pandas DataFrame."""
+        if not self.psql.conn and self.psql.pool is None:
             raise RuntimeError("psql connection is not initialized")
 
-        cur = self.psql.conn.cursor()
-        cur.execute(query, params or ())
-        rows = cur.fetchall()
-        columns = [desc[0] for desc in cur.description]
-        cur.close()
-        return pd.DataFrame(rows, columns=columns)
+        # a connection dropped server-side fails once, is discarded, and the query is retried
+        for attempt in range(2):
+            try:
+                with self.psql.connection() as conn:
+                    cur = conn.cursor()
+                    timeout_ms = getattr(self.local, "statement_timeout_ms", None)
+                    if timeout_ms:
+                        # scoped to this transaction, which connection() always ends
+                        cur.execute("SET LOCAL statement_timeout = %s", (timeout_ms,))
+                    if self.explain:
+                        return self._explain_query(cur, query, params)
 
-    def top_users_per_minute_today(self):
+                    cur.execute(query, params or ())
+                    rows = cur.fetchall()
+                    columns = [desc[0] for desc in cur.description]
+                    cur.close()
+                    return pd.DataFrame(rows, columns=columns)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                # a statement timeout is a slow query, not a dead connection, so don't rerun it
+                if attempt or isinstance(e, QueryCanceledError):
+                    raise
+
+    def _explain_query(self, cur, query, params):
+        """Return the JSON plan for a query, planned with sequential scans disabled."""
+        # with seq scans priced out, any Seq Scan left in the plan means no index could serve the filter
+        # (the caller's connection() rolls back, so the SET LOCAL never outlives this plan)
+        try:
+            cur.execute("SET LOCAL enable_seqscan = off")
+            if isinstance(query, sql.Composable):
+                query = query.as_string(cur)
+            cur.execute("EXPLAIN (FORMAT JSON) " + query, params or ())
+            return cur.fetchone()[0][0]["Plan"]
+        finally:
+            cur.close()
+
+    def top_users_per_minute_today(self, time_range=None):
         """Return per-minute event counts by user for the current day."""
+        start, end = time_range or today_range()
         query = """
             SELECT
                 date_trunc('minute', dt) AS minute_ts,
@@ -43,14 +169,15 @@ class PSQLAnalytics:
                 COUNT(*) AS event_count
             FROM raw_events
             WHERE "user" IS NOT NULL
-              AND dt::date = CURRENT_DATE
+              AND dt >= %s AND dt < %s
             GROUP BY minute_ts, "user"
             ORDER BY minute_ts DESC, event_count DESC;
         """
-        return self._run_query(query)
+        return self._run_query(query, (start, end))
 
-    def top_users_today(self, limit=10, user_type="all"):
+    def top_users_today(self, limit=10, user_type="all", time_range=None):
         """Return top users for today, optionally filtered by bot/human segment."""
+        start, end = time_range or today_range()
         user_type = (user_type or "all").lower()
         if user_type not in {"all", "bot", "human"}:
             user_type = "all"
@@ -61,7 +188,7 @@ class PSQLAnalytics:
                 COUNT(*) AS event_count
             FROM raw_events
             WHERE "user" IS NOT NULL
-              AND dt::date = CURRENT_DATE
+              AND dt >= %s AND dt < %s
               AND (
                     %s = 'all'
                     OR (%s = 'bot' AND bot IS TRUE)
@@ -71,43 +198,82 @@ class PSQLAnalytics:
             ORDER BY event_count DESC
             LIMIT %s;
         """
-        return self._run_query(query, (user_type, user_type, user_type, limit))
+        return self._run_query(query, (start, end, user_type, user_type, user_type, limit))
 
-    def top_wikis_today(self, limit=10):
+    def top_wikis_today(self, limit=10, time_range=None):
         """Return top wikis by event volume for the current day."""
+        start, end = time_range or today_range()
+        if self.use_rollups:
+            query = """
+                SELECT
+                    wiki,
+                    SUM(event_count)::bigint AS event_count
+                FROM minute_rollups
+                WHERE wiki IS NOT NULL
+                  AND minute >= %s AND minute < %s
+                GROUP BY wiki
+                ORDER BY event_count DESC
+                LIMIT %s;
+            """
+            return self._run_query(query, (start, end, limit))
+
         query = """
             SELECT
                 wiki,
                 COUNT(*) AS event_count
             FROM raw_events
             WHERE wiki IS NOT NULL
-              AND dt::date = CURRENT_DATE
+              AND dt >= %s AND dt < %s
             GROUP BY wiki
             ORDER BY event_count DESC
             LIMIT %s;
         """
-        return self._run_query(query, (limit,))
+        return self._run_query(query, (start, end, limit))
 
-    def gap_filled_time_series(self, window_hours=1):
+    def gap_filled_time_series(self, window_hours=1, time_range=None):
         """Return a gap-filled minute time series for the requested hour window."""
+        start, end = time_range or minute_range(window_hours)
+        if self.use_rollups:
+            query = """
+                WITH minutes AS (
+                    SELECT generate_series(%s::timestamptz, %s::timestamptz - interval '1 minute', interval '1 minute') AS minutes_ts
+                ), per_minute AS (
+                    SELECT
+                        minute,
+                        SUM(event_count)::bigint AS events
+                    FROM minute_rollups
+                    WHERE minute >= %s AND minute < %s
+                    GROUP BY minute
+                )
+                SELECT
+                    m.minutes_ts,
+                    COALESCE(p.events, 0) AS events
+                FROM minutes m
+                LEFT JOIN per_minute p ON p.minute = m.minutes_ts
+                ORDER BY m.minutes_ts;
+            """
+            return self._run_query(query, (start, end, start, end))
+
+        # aggregate only the bounded dt range first, then join the (small) per-minute result
         query = """
             WITH minutes AS (
-                SELECT generate_series(
-                    date_trunc('minute', now() - (%s * interval '1 hour')),
-                    date_trunc('minute', now()),
-                    interval '1 minute'
-                ) AS minutes_ts
+                SELECT generate_series(%s::timestamptz, %s::timestamptz - interval '1 minute', interval '1 minute') AS minutes_ts
+            ), per_minute AS (
+                SELECT
+                    date_trunc('minute', dt) AS minute,
+                    COUNT(*) AS events
+                FROM raw_events
+                WHERE dt >= %s AND dt < %s
+                GROUP BY 1
             )
             SELECT
                 m.minutes_ts,
-                COALESCE(count(r.id), 0) AS events
+                COALESCE(p.events, 0) AS events
             FROM minutes m
-            LEFT JOIN raw_events r
-                ON date_trunc('minute', r.dt) = m.minutes_ts
-            GROUP BY m.minutes_ts
+            LEFT JOIN per_minute p ON p.minute = m.minutes_ts
             ORDER BY m.minutes_ts;
         """
-        return self._run_query(query, (window_hours,))
+        return self._run_query(query, (start, end, start, end))
 
     def event_size_distribution(self):
         """Return average event size for all, bot, and human edits."""
@@ -121,8 +287,23 @@ class PSQLAnalytics:
         """
         return self._run_query(query)
 
-    def event_type_distribution_today(self):
+    def event_type_distribution_today(self, time_range=None):
         """Return today's event-type counts and percentages."""
+        start, end = time_range or today_range()
+        if self.use_rollups:
+            query = """
+                SELECT
+                    "type",
+                    SUM(event_count)::bigint AS event_count,
+                    ROUND(100.0 * SUM(event_count) / SUM(SUM(event_count)) OVER (), 2) AS pct
+                FROM minute_rollups
+                WHERE "type" IN ('edit', 'categorize', 'log', 'new')
+                  AND minute >= %s AND minute < %s
+                GROUP BY "type"
+                ORDER BY event_count DESC;
+            """
+            return self._run_query(query, (start, end))
+
         query = """
             SELECT
                 "type",
@@ -130,14 +311,32 @@ class PSQLAnalytics:
                 ROUND(100.0 * COUNT(*) / SUM(COUNT(*)) OVER (), 2) AS pct
             FROM raw_events
             WHERE "type" IN ('edit', 'categorize', 'log', 'new')
-              AND dt::date = CURRENT_DATE
+              AND dt >= %s AND dt < %s
             GROUP BY "type"
             ORDER BY event_count DESC;
         """
-        return self._run_query(query)
+        return self._run_query(query, (start, end))
 
-    def wiki_event_type_distribution_today(self):
+    def wiki_event_type_distribution_today(self, time_range=None):
         """Return per-wiki totals with type-specific counts for today."""
+        start, end = time_range or today_range()
+        if self.use_rollups:
+            query = """
+                SELECT
+                    wiki,
+                    SUM(event_count)::bigint AS total_count,
+                    COALESCE(SUM(event_count) FILTER (WHERE "type" = 'edit'), 0)::bigint AS edit_count,
+                    COALESCE(SUM(event_count) FILTER (WHERE "type" = 'new'), 0)::bigint AS new_count,
+                    COALESCE(SUM(event_count) FILTER (WHERE "type" = 'log'), 0)::bigint AS log_count,
+                    COALESCE(SUM(event_count) FILTER (WHERE "type" = 'categorize'), 0)::bigint AS categorize_count
+                FROM minute_rollups
+                WHERE wiki IS NOT NULL
+                  AND minute >= %s AND minute < %s
+                GROUP BY wiki
+                ORDER BY total_count DESC;
+            """
+            return self._run_query(query, (start, end))
+
         query = """
             SELECT
                 wiki,
@@ -148,14 +347,34 @@ class PSQLAnalytics:
                 COUNT(*) FILTER (WHERE "type" = 'categorize') AS categorize_count
             FROM raw_events
             WHERE wiki IS NOT NULL
-              AND dt::date = CURRENT_DATE
+              AND dt >= %s AND dt < %s
             GROUP BY wiki
             ORDER BY total_count DESC;
         """
-        return self._run_query(query)
+        return self._run_query(query, (start, end))
 
-    def patrolled_bot_distribution_today(self):
+    def patrolled_bot_distribution_today(self, time_range=None):
         """Return patrolled vs unpatrolled counts split by bot/human for today."""
+        start, end = time_range or today_range()
+        if self.use_rollups:
+            query = """
+                SELECT
+                    CASE
+                        WHEN bot = TRUE THEN 'bot'
+                        WHEN bot = FALSE THEN 'human'
+                    END AS user_type,
+                    SUM(event_count)::bigint AS event_count,
+                    COALESCE(SUM(event_count) FILTER (WHERE patrolled = 'true'), 0)::bigint AS patrolled_count,
+                    COALESCE(SUM(event_count) FILTER (WHERE patrolled = 'false'), 0)::bigint AS unpatrolled_count
+                FROM minute_rollups
+                WHERE patrolled IS NOT NULL
+                  AND bot IS NOT NULL
+                  AND minute >= %s AND minute < %s
+                GROUP BY bot
+                ORDER BY event_count DESC;
+            """
+            return self._run_query(query, (start, end))
+
         query = """
             SELECT
                 CASE
@@ -168,24 +387,167 @@ class PSQLAnalytics:
             FROM raw_events
             WHERE patrolled IS NOT NULL
               AND bot IS NOT NULL
-              AND dt::date = CURRENT_DATE
+              AND dt >= %s AND dt < %s
             GROUP BY bot
             ORDER BY event_count DESC;
         """
-        return self._run_query(query)
+        return self._run_query(query, (start, end))
+
+    # dimensions counts_since can group on, and which of them minute_rollups carries
+    COUNT_DIMENSIONS = ("wiki", "type", "user", "bot", "patrolled")
+    ROLLUP_DIMENSIONS = ("wiki", "type", "bot", "patrolled")
+
+    def counts_since(self, dimensions, since, until=None, user_type="all", by_minute=False):
+        """Return event counts grouped by dimensions for [since, until), per minute when by_minute.
+
+        This is the delta query behind LiveSnapshot: with since at a watermark it reads only the
+        minutes after it. Rows with a NULL dimension are left out, as in the dashboard queries;
+        until=None reads up to the newest event.
+        """
+        dimensions = tuple(dimensions)
+        unknown = set(dimensions) - set(self.COUNT_DIMENSIONS)
+        if unknown:
+            raise ValueError(f"unknown count dimensions: {sorted(unknown)}")
+        user_type = (user_type or "all").lower()
+
+        use_rollups = self.use_rollups and set(dimensions) <= set(self.ROLLUP_DIMENSIONS)
+        if use_rollups:
+            table, time_column, count = "minute_rollups", sql.Identifier("minute"), sql.SQL("SUM(event_count)::bigint")
+        else:
+            table, time_column, count = "raw_events", sql.Identifier("dt"), sql.SQL("COUNT(*)")
+
+        columns = [sql.Identifier(dimension) for dimension in dimensions]
+        if by_minute:
+            minute = sql.SQL("date_trunc('minute', {})").format(time_column) if not use_rollups else time_column
+            columns.insert(0, sql.SQL("{} AS minute").format(minute))
+
+        conditions = [sql.SQL("{} >= %s").format(time_column)]
+        params = [since]
+        if until is not None:
+            conditions.append(sql.SQL("{} < %s").format(time_column))
+            params.append(until)
+        conditions += [sql.SQL("{} IS NOT NULL").format(sql.Identifier(dimension)) for dimension in dimensions]
+        if user_type in ("bot", "human"):
+            conditions.append(sql.SQL("bot IS TRUE" if user_type == "bot" else "bot IS FALSE"))
+
+        query = sql.SQL("SELECT {select} FROM {table} WHERE {conditions}").format(
+            select=sql.SQL(", ").join(columns + [sql.SQL("{} AS event_count").format(count)]),
+            table=sql.Identifier(table),
+            conditions=sql.SQL(" AND ").join(conditions),
+        )
+        if columns:
+            query += sql.SQL(" GROUP BY {}").format(sql.SQL(", ").join(sql.Literal(i + 1) for i in range(len(columns))))
+        return self._run_query(query, params)
+
+    def _timed_query(self, timeout_seconds, query, *args, **kwargs):
+        """Run one analytics method on the calling thread under a statement_timeout."""
+        self.local.statement_timeout_ms = int(timeout_seconds * 1000)
+        try:
+            return query(*args, **kwargs)
+        finally:
+            self.local.statement_timeout_ms = None
+
+    def snapshot(self, window_hours=1, top_limit=10, top_users_type="all", timeout_seconds=5.0):
+        """Run the dashboard's queries concurrently and return a PostgresSnapshot.
+
+        Each query gets its own (pooled) connection and a statement_timeout of timeout_seconds;
+        a query that fails or runs over is reported in errors while the rest are still returned.
+        """
+        # every "today" query shares one range so the frames describe the same day
+        day = today_range()
+        queries = {
+            "events": (self.gap_filled_time_series, (window_hours,), {}),
+            "top_users": (self.top_users_today, (), {"limit": top_limit, "user_type": top_users_type, "time_range": day}),
+            "top_wikis": (self.top_wikis_today, (), {"limit": top_limit, "time_range": day}),
+            "type_mix": (self.event_type_distribution_today, (), {"time_range": day}),
+            "event_size": (self.event_size_distribution, (), {}),
+            "patrolled": (self.patrolled_bot_distribution_today, (), {"time_range": day}),
+        }
+        return self._gather(
+            {
+                name: (self._timed_query, (timeout_seconds, query, *args), kwargs)
+                for name, (query, args, kwargs) in queries.items()
+            },
+            timeout_seconds,
+        )
+
+    def _gather(self, queries, timeout_seconds):
+        """Run {name: (callable, args, kwargs)} concurrently on the snapshot executor into a PostgresSnapshot.
+
+        Each callable is expected to bound its own statements to timeout_seconds.
+        """
+        if self.executor is None:
+            # without a pool every query shares one connection, so they have to take turns
+            workers = 6 if self.psql.pool is not None else 1
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="psql-snapshot")
 
-    def print_sql_analytics(self):
-        """Print a sample of each analytics DataFrame for local verification."""
+        futures = {
+            name: self.executor.submit(query, *args, **kwargs) for name, (query, args, kwargs) in queries.items()
+        }
+
+        # the server cancels slow statements, the wait bound covers pool waits and network stalls
+        wait(futures.values(), timeout=timeout_seconds + 1.0)
+
+        snapshot = PostgresSnapshot()
+        for name, future in futures.items():
+            if not future.done():
+                snapshot.errors[name] = f"no result within {timeout_seconds}s"
+            elif isinstance(future.exception(), QueryCanceledError):
+                snapshot.errors[name] = f"timed out after {timeout_seconds}s"
+            elif future.exception() is not None:
+                snapshot.errors[name] = str(future.exception()).strip()
+            else:
+                setattr(snapshot, name, future.result())
+        return snapshot
+
+    def explain_index_usage(self):
+        """Return {query name: relations scanned without an index condition} for every time-bounded query."""
+        day = today_range()
+        queries = {
+            "top_users_per_minute": lambda: self.top_users_per_minute_today(time_range=day),
+            "top_users_today": lambda: self.top_users_today(time_range=day),
+            "top_wikis_today": lambda: self.top_wikis_today(time_range=day),
+            "gap_filled_time_series": lambda: self.gap_filled_time_series(),
+            "event_type_distribution": lambda: self.event_type_distribution_today(time_range=day),
+            "wiki_event_type_distribution": lambda: self.wiki_event_type_distribution_today(time_range=day),
+            "patrolled_bot_distribution": lambda: self.patrolled_bot_distribution_today(time_range=day),
+            # the dashboard's watermark deltas
+            "counts_since_by_minute": lambda: self.counts_since((), minute_range(1)[0], by_minute=True),
+            "counts_since_users": lambda: self.counts_since(("user",), minute_range(1)[0]),
+            "counts_since_wikis": lambda: self.counts_since(("wiki",), minute_range(1)[0]),
+        }
+
+        self.explain = True
+        try:
+            plans = {name: query() for name, query in queries.items()}
+        finally:
+            self.explain = False
+
+        # a non-sargable filter still shows up as a full index scan with only a Filter, so every
+        # scan of a table must carry the range as an index condition
+        def unindexed_scans(node):
+            found = []
+            if "Relation Name" in node and "Index Cond" not in node and "Recheck Cond" not in node:
+                found.append(node["Relation Name"])
+            for child in node.get("Plans", []):
+                found.extend(unindexed_scans(child))
+            return found
+
+        return {name: unindexed_scans(plan) for name, plan in plans.items()}
+
+    def print_sql_analytics(self, time_range=None):
+        """Print a sample of each analytics DataFrame for local verification (today unless time_range is given)."""
         # master print function to test in pipeline.py with
+        day = time_range or today_range()
         metric_frames = {
-            "top_users_per_minute": self.top_users_per_minute_today(),
-            "top_users_today": self.top_users_today(),
-            "top_wikis_today": self.top_wikis_today(),
-            "gap_filled_time_series": self.gap_filled_time_series(),
+            "top_users_per_minute": self.top_users_per_minute_today(time_range=day),
+            "top_users_today": self.top_users_today(time_range=day),
+            "top_wikis_today": self.top_wikis_today(time_range=day),
+            "gap_filled_time_series": self.gap_filled_time_series(time_range=time_range),
             "event_size_distribution": self.event_size_distribution(),
-            "event_type_distribution": self.event_type_distribution_today(),
-            "wiki_event_type_distribution": self.wiki_event_type_distribution_today(),
-            "patrolled_bot_distribution": self.patrolled_bot_distribution_today(),
+            "event_type_distribution": self.event_type_distribution_today(time_range=day),
+            "wiki_event_type_distribution": self.wiki_event_type_distribution_today(time_range=day),
+            "patrolled_bot_distribution": self.patrolled_bot_distribution_today(time_range=day),
         }
 
         for name, df in metric_frames.items():
@@ -195,3 +557,189 @@ class PSQLAnalytics:
             else:
                 # print 20 rows without 0,1,2... index column
                 print(df.head(20).to_string(index=False))
+
+
+class MinuteCounts:
+    """Event counts by dimensions from a fixed start up to now, kept current from watermark deltas.
+
+    Minutes more than settle_minutes old are treated as final: they are added to a running total
+    once, and each refresh only re-reads the minutes after that watermark.
+    """
+
+    def __init__(self, analytics, dimensions, user_type="all", settle_minutes=2):
+        self.analytics = analytics
+        self.dimensions = list(dimensions)
+        self.user_type = user_type
+        self.settle = timedelta(minutes=settle_minutes)
+        self.start = None
+        self.watermark = None
+        self.settled = None
+
+    def reset(self):
+        """Reload everything on the next refresh (e.g. to pick up rows that arrived late)."""
+        self.start = None
+
+    def _counts(self, since, until):
+        frame = self.analytics.counts_since(self.dimensions, since, until, self.user_type)
+        return frame.set_index(self.dimensions)["event_count"]
+
+    def refresh(self, start, now):
+        """Return counts for [start, now) as a frame of the dimensions plus event_count."""
+        watermark = max(start, now.replace(second=0, microsecond=0) - self.settle)
+        if start != self.start:
+            # first load, a new day or a resync: everything before the watermark in one grouped query
+            self.settled = self._counts(start, watermark)
+            self.start = start
+        elif watermark > self.watermark:
+            self.settled = self.settled.add(self._counts(self.watermark, watermark), fill_value=0)
+        self.watermark = watermark
+
+        totals = self.settled.add(self._counts(watermark, None), fill_value=0)
+        return totals.astype("int64").rename("event_count").reset_index()
+
+
+class MinuteSeries:
+    """Gap-filled events-per-minute series over a sliding window, re-reading only the minutes since a watermark."""
+
+    def __init__(self, analytics, settle_minutes=2):
+        self.analytics = analytics
+        self.settle = timedelta(minutes=settle_minutes)
+        self.per_minute = None
+        self.watermark = None
+
+    def reset(self):
+        """Reload the whole window on the next refresh."""
+        self.per_minute = None
+
+    def refresh(self, start, end, now):
+        """Return the minutes_ts/events frame for [start, end)."""
+        since = start if self.per_minute is None else max(start, self.watermark)
+        delta = self.analytics.counts_since((), since, end, by_minute=True)
+        fresh = delta.set_index("minute")["event_count"]
+        fresh.index = pd.to_datetime(fresh.index, utc=True).tz_convert(start.tzinfo)
+
+        # settled minutes still in the window are kept, everything from the watermark on is replaced
+        kept = pd.Series(dtype="int64")
+        if self.per_minute is not None:
+            kept = self.per_minute[(self.per_minute.index >= start) & (self.per_minute.index < since)]
+        self.per_minute = pd.concat([kept, fresh]) if not kept.empty else fresh
+        self.watermark = max(start, now.replace(second=0, microsecond=0) - self.settle)
+
+        minutes = pd.date_range(start, end, freq="min", inclusive="left")
+        events = self.per_minute.reindex(minutes, fill_value=0).astype("int64")
+        return pd.DataFrame({"minutes_ts": minutes, "events": events.to_numpy()})
+
+
+class LiveSnapshot:
+    """Dashboard frames shared by every viewer and refreshed incrementally (see MinuteCounts / MinuteSeries).
+
+    Panels ask for their frame on their own cadence; a frame refreshed less than min_refresh_seconds
+    ago is returned as is, so any number of viewers costs one small delta query per panel. Every
+    resync_seconds a frame is rebuilt from scratch to pick up events that arrived after settling.
+    """
+
+    def __init__(
+        self, analytics, settle_minutes=2, min_refresh_seconds=5.0, resync_seconds=600.0, timeout_seconds=5.0
+    ):
+        self.analytics = analytics
+        self.settle_minutes = settle_minutes
+        self.min_refresh_seconds = min_refresh_seconds
+        self.resync_seconds = resync_seconds
+        self.timeout_seconds = timeout_seconds
+        # per frame key: its incremental state, lock, (refreshed at, frame) and last full load
+        self.states = {}
+        self.locks = {}
+        self.frames = {}
+        self.synced_at = {}
+        self.lock = threading.Lock()
+
+    def expire(self):
+        """Make every frame re-read the minutes since its watermark on its next call."""
+        with self.lock:
+            self.frames.clear()
+
+    def _refresh(self, key, new_state, build):
+        """Return the frame for key, refreshing its state with build(state, now) when it is due."""
+        with self.lock:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+                self.states[key] = new_state()
+
+        with self.locks[key]:
+            cached = self.frames.get(key)
+            if cached is not None and clock.monotonic() - cached[0] < self.min_refresh_seconds:
+                return cached[1]
+
+            state = self.states[key]
+            if clock.monotonic() - self.synced_at.get(key, float("-inf")) >= self.resync_seconds:
+                state.reset()
+                self.synced_at[key] = clock.monotonic()
+
+            now = datetime.now().astimezone()
+            frame = self.analytics._timed_query(self.timeout_seconds, build, state, now)
+            self.frames[key] = (clock.monotonic(), frame)
+            return frame
+
+    def snapshot(self, panels, window_hours=1, top_limit=10, top_users_type="all"):
+        """Refresh the named panels concurrently on the analytics snapshot executor; return a PostgresSnapshot.
+
+        A dashboard fragment asks for all of its panels at once, so they cost one round of
+        queries instead of one after another; a panel that fails or runs over is reported in errors.
+        """
+        queries = {
+            "events": (self.events, (window_hours,), {}),
+            "top_users": (self.top_users, (top_limit, top_users_type), {}),
+            "top_wikis": (self.top_wikis, (top_limit,), {}),
+            "type_mix": (self.type_mix, (), {}),
+            "event_size": (self.event_size, (), {}),
+            "patrolled": (self.patrolled, (), {}),
+        }
+        unknown = set(panels) - set(queries)
+        if unknown:
+            raise ValueError(f"unknown panels: {sorted(unknown)}")
+        return self.analytics._gather({name: queries[name] for name in panels}, self.timeout_seconds)
+
+    def _counts(self, dimensions, user_type="all"):
+        """Return today's counts by dimensions, refreshed from the minutes since the watermark."""
+        return self._refresh(
+            ("counts", tuple(dimensions), user_type),
+            lambda: MinuteCounts(self.analytics, dimensions, user_type, self.settle_minutes),
+            lambda state, now: state.refresh(today_range(now)[0], now),
+        )
+
+    def events(self, window_hours=1):
+        """Return the gap-filled minutes_ts/events series for the last window_hours."""
+        return self._refresh(
+            ("events", window_hours),
+            lambda: MinuteSeries(self.analytics, self.settle_minutes),
+            lambda state, now: state.refresh(*minute_range(window_hours, now), now),
+        )
+
+    def top_users(self, limit=10, user_type="all"):
+        """Return today's top users, like PSQLAnalytics.top_users_today."""
+        counts = self._counts(("user",), (user_type or "all").lower())
+        return counts.sort_values("event_count", ascending=False, ignore_index=True).head(limit)
+
+    def top_wikis(self, limit=10):
+        """Return today's top wikis, like PSQLAnalytics.top_wikis_today."""
+        counts = self._counts(("wiki",))
+        return counts.sort_values("event_count", ascending=False, ignore_index=True).head(limit)
+
+    def type_mix(self):
+        """Return today's event-type counts and percentages."""
+        return type_mix_frame(self._counts(("type",)))
+
+    def patrolled(self):
+        """Return today's patrolled vs unpatrolled counts split by bot/human."""
+        return patrolled_frame(self._counts(("bot", "patrolled")))
+
+    def event_size(self, max_age_seconds=300.0):
+        """Return the all-time average event sizes, re-queried at most every max_age_seconds."""
+        with self.lock:
+            cached = self.frames.get("event_size")
+            if cached is not None and clock.monotonic() - cached[0] < max_age_seconds:
+                return cached[1]
+        frame = self.analytics._timed_query(self.timeout_seconds, self.analytics.event_size_distribution)
+        with self.lock:
+            self.frames["event_size"] = (clock.monotonic(), frame)
+        return frame
@@ -1,14 +1,34 @@
 import os
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import time
+import threading
+from contextlib import contextmanager
 import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+from metrics import REGISTRY
+
+# instrumentation, served on the pipeline's /metrics endpoint
+FLUSH_SECONDS = REGISTRY.histogram("wiki_psql_flush_seconds", "time to insert one buffered batch of raw events")
+FLUSHED_ROWS = REGISTRY.counter("wiki_psql_flushed_rows_total", "raw event rows sent to postgres in successful flushes")
+DROPPED_ROWS = REGISTRY.counter("wiki_psql_dropped_rows_total", "buffered raw event rows dropped by a failed flush")
+UNAVAILABLE_ROWS = REGISTRY.counter(
+    "wiki_psql_unavailable_rows_total", "buffered raw event rows handed to on_drop because postgres was unreachable"
+)
+RECONNECTS = REGISTRY.counter("wiki_psql_reconnects_total", "postgres connections reopened after a drop")
 
 
 class PSQLManager:
     """Manages PostgreSQL connection, raw-event persistence, and retention tasks."""
 
-    def __init__(self):
-        """Load PostgreSQL connection settings from environment variables."""
+    def __init__(self, batch_size=1, flush_interval_seconds=2.0):
+        """Load PostgreSQL connection settings and raw-event buffering limits.
+
+        batch_size=1 writes every event immediately; larger values buffer rows
+        and flush them in one multi-row insert by size or by age.
+        """
         load_dotenv()
         self.dbname = os.getenv("PSQL_DBNAME")
         self.user = os.getenv("PSQL_USER")
@@ -18,76 +38,330 @@ class PSQLManager:
         self.today = datetime.now().strftime("%m-%d-%Y")
         self.conn = None
 
+        # pooled mode state (see connect_pool), used by concurrent readers such as the dashboard
+        self.pool = None
+        self.pool_slots = None
+        self.pool_timeout_seconds = 10.0
+        self.health_check_seconds = 30.0
+        self.last_used = {}
+        self.pool_lock = threading.Lock()
+
+        # buffered writer state
+        self.batch_size = max(1, batch_size)
+        self.flush_interval_seconds = flush_interval_seconds
+        self.buffer = []
+        # the WikiEvents behind self.buffer, handed to on_drop if postgres is unreachable
+        self.buffer_events = []
+        self.last_flush = time.monotonic()
+        # called with those events instead of dropping them (e.g. Spool.append); None drops them
+        self.on_drop = None
+        # stream offsets (WikiEvent.offset) of the newest buffered / newest flushed event
+        self.buffer_offset = None
+        self.flushed_offset = 0
+
+        # set to an ArchiveManager to export raw rows to parquet before retention removes them
+        self.archive = None
+
     def connect(self):
-        """Open a PostgreSQL connection using configured credentials."""
+        """Open a PostgreSQL connection using configured credentials; return False if that fails."""
         try:
             self.conn = psycopg2.connect(
                 dbname=self.dbname, user=self.user, port=self.port, password=self.password, host=self.host
             )
+            return True
         except psycopg2.Error as e:
             print(f"psql connection error: {e}")
-            exit(1)
+            self.conn = None
+            return False
+
+    def reconnect(self):
+        """Reopen the single connection if it is missing or closed; return False if that fails."""
+        if self.conn is not None and not self.conn.closed:
+            return True
+
+        try:
+            self.conn = psycopg2.connect(
+                dbname=self.dbname, user=self.user, port=self.port, password=self.password, host=self.host
+            )
+            RECONNECTS.inc()
+            return True
+        except psycopg2.Error as e:
+            print(f"psql reconnect error: {e}")
+            self.conn = None
+            return False
+
+    def connect_pool(self, minconn=1, maxconn=10, health_check_seconds=30.0):
+        """Open a thread-safe connection pool so concurrent readers don't share one connection."""
+        try:
+            self.pool = ThreadedConnectionPool(
+                minconn,
+                maxconn,
+                dbname=self.dbname,
+                user=self.user,
+                port=self.port,
+                password=self.password,
+                host=self.host,
+            )
+            # psycopg2 pools raise when exhausted, so borrowers wait on a slot instead
+            self.pool_slots = threading.BoundedSemaphore(maxconn)
+            self.health_check_seconds = health_check_seconds
+            return True
+        except psycopg2.Error as e:
+            print(f"psql pool connection error: {e}")
+            return False
+
+    def _healthy(self, conn):
+        """Return True if a pooled connection is open and, when idle for a while, still answers."""
+        if conn.closed:
+            return False
+
+        # only ping connections that sat idle long enough to have been dropped server-side
+        if time.monotonic() - self.last_used.get(id(conn), 0) < self.health_check_seconds:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _borrow(self):
+        """Take a healthy connection from the pool, replacing any that went bad."""
+        if not self.pool_slots.acquire(timeout=self.pool_timeout_seconds):
+            raise PoolError("timed out waiting for a pooled psql connection")
+
+        try:
+            return self._getconn_healthy()
+        except Exception:
+            self.pool_slots.release()
+            raise
+
+    def _getconn_healthy(self):
+        """Return a pooled connection that passes the health check."""
+        while True:
+            with self.pool_lock:
+                conn = self.pool.getconn()
+            if self._healthy(conn):
+                return conn
+            # discard the dead connection; the pool opens a fresh one on the next getconn
+            with self.pool_lock:
+                self.last_used.pop(id(conn), None)
+                self.pool.putconn(conn, close=True)
+
+    @contextmanager
+    def connection(self):
+        """Yield a connection for one unit of read work, then end its transaction.
+
+        In pooled mode the connection is borrowed and returned to the pool; otherwise the
+        single connection is reused and reopened if it was closed. Either way the
+        transaction is rolled back afterwards so no session is left idle in transaction.
+        """
+        if self.pool is None:
+            if not self.reconnect():
+                raise psycopg2.OperationalError("psql connection is not available")
+            try:
+                yield self.conn
+            finally:
+                if not self.conn.closed:
+                    self.conn.rollback()
+            return
+
+        conn = self._borrow()
+        try:
+            yield conn
+        finally:
+            broken = bool(conn.closed)
+            if not broken:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            with self.pool_lock:
+                if broken:
+                    self.last_used.pop(id(conn), None)
+                else:
+                    self.last_used[id(conn)] = time.monotonic()
+                self.pool.putconn(conn, close=broken)
+            self.pool_slots.release()
+
+    def close(self):
+        """Close the single connection and every pooled connection."""
+        if self.conn and not self.conn.closed:
+            self.conn.close()
+        if self.pool is not None and not self.pool.closed:
+            self.pool.closeall()
+
+    def _event_row(self, event):
+        """Map one WikiEvent onto the raw_events column order."""
+        return (
+            event.id,
+            event.domain,
+            event.dt,
+            event.type,
+            event.namespace,
+            event.title,
+            event.comment,
+            event.user,
+            event.wiki,
+            event.minor,
+            event.patrolled,
+            event.log_type,
+            event.length,
+            event.bot,
+        )
+
+    def process_event(self, event):
+        """Buffer one WikiEvent for raw_events, flushing when the batch is due."""
+        return self.process_events([event])
 
-    def process_event(self, json_data):
-        """Insert one Wikimedia event into raw_events."""
+    def process_events(self, events):
+        """Buffer a batch of WikiEvents, flushing by batch size or buffer age."""
+        try:
+            self.buffer.extend(self._event_row(event) for event in events)
+        except Exception as e:
+            print(f"error processing event JSON: {e}")
+            return False
+        self.buffer_events.extend(events)
+
+        if events and events[-1].offset is not None:
+            self.buffer_offset = events[-1].offset
+
+        if len(self.buffer) >= self.batch_size or self.flush_due():
+            return self.flush()
+        return True
+
+    def flush_due(self):
+        """Return True when buffered rows are older than flush_interval_seconds."""
+        return bool(self.buffer) and time.monotonic() - self.last_flush >= self.flush_interval_seconds
+
+    def flush(self, retry=True):
+        """Write buffered rows in one multi-row insert (skipping stored ids) and upsert their rollups."""
+        if not self.buffer:
+            self.last_flush = time.monotonic()
+            return True
+
+        # a dropped server connection is reopened here instead of failing every later flush
+        if not self.reconnect():
+            self._unavailable()
+            return False
+
+        cur = None
+        start = time.perf_counter()
         try:
             cur = self.conn.cursor()
-            cur.execute(
+            # duplicate ids (e.g. replayed events) are skipped instead of failing the whole batch,
+            # and only rows actually inserted are folded into minute_rollups in the same statement
+            execute_values(
+                cur,
                 """
-                INSERT INTO raw_events 
-                    (id, 
-                    domain, 
-                    dt, 
-                    type, 
-                    namespace, 
-                    title, 
-                    comment, 
-                    "user", 
-                    wiki, 
-                    minor, 
-                    patrolled, 
-                    log_type,
-                    length,
-                    bot)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                WITH inserted AS (
+                    INSERT INTO raw_events
+                        (id,
+                        domain,
+                        dt,
+                        type,
+                        namespace,
+                        title,
+                        comment,
+                        "user",
+                        wiki,
+                        minor,
+                        patrolled,
+                        log_type,
+                        length,
+                        bot)
+                    VALUES %s
+                    ON CONFLICT DO NOTHING
+                    RETURNING dt, wiki, type, bot, minor, patrolled, namespace, length
+                )
+                INSERT INTO minute_rollups AS r
+                    (minute, wiki, type, bot, minor, patrolled, namespace, event_count, length_sum, length_count)
+                SELECT
+                    date_trunc('minute', dt),
+                    wiki,
+                    type,
+                    bot,
+                    minor,
+                    patrolled,
+                    namespace,
+                    COUNT(*),
+                    COALESCE(SUM(length), 0),
+                    COUNT(length)
+                FROM inserted
+                GROUP BY 1, 2, 3, 4, 5, 6, 7
+                -- concurrent writers lock shared rollup rows in the same order, so they can't deadlock
+                ORDER BY 1, 2, 3, 4, 5, 6, 7
+                ON CONFLICT ON CONSTRAINT minute_rollups_key DO UPDATE SET
+                    event_count = r.event_count + EXCLUDED.event_count,
+                    length_sum = r.length_sum + EXCLUDED.length_sum,
+                    length_count = r.length_count + EXCLUDED.length_count
                 """,
-                (
-                    json_data.get("meta", {}).get("id"),
-                    json_data.get("meta", {}).get("domain"),
-                    json_data.get("meta", {}).get("dt"),
-                    json_data.get("type"),
-                    json_data.get("namespace"),
-                    json_data.get("title"),
-                    json_data.get("comment"),
-                    json_data.get("user"),
-                    json_data.get("wiki"),
-                    json_data.get("minor"),
-                    json_data.get("patrolled"),
-                    json_data.get("log_type"),
-                    (  # store edit size delta when length object is present
-                        json_data.get("length").get("new") - json_data.get("length").get("old", 0)
-                        if "length" in json_data
-                        else None
-                    ),
-                    json_data.get("bot"),
-                ),
+                self.buffer,
+                page_size=len(self.buffer),
             )
+            self.conn.commit()
 
-        except psycopg2.IntegrityError as e:
-            print(f"integrity error: {e}")
-            self.conn.rollback()
-            return False
         except Exception as e:
-            print(f"error processing event JSON: {e}")
-            self.conn.rollback()
+            # a failed statement leaves an open connection in an aborted transaction, which would
+            # fail every later batch; a rollback that fails too means the connection is gone
+            if not self.conn.closed:
+                try:
+                    self.conn.rollback()
+                except psycopg2.Error:
+                    pass
+
+            # a connection that died since the last flush only shows up here; retry once on a new one
+            if self.conn.closed and retry:
+                return self.flush(retry=False)
+            if self.conn.closed:
+                self._unavailable()
+                return False
+
+            # deadlocks, serialization failures and cancelled statements on a live connection are
+            # transient: retry once, then keep the batch for the spool rather than dropping it
+            if isinstance(e, psycopg2.OperationalError):
+                if retry:
+                    print(f"retrying {len(self.buffer)} raw events after: {str(e).strip()}")
+                    return self.flush(retry=False)
+                self._unavailable()
+                return False
+
+            print(f"error flushing {len(self.buffer)} raw events: {e}")
+            # drop the failed batch so one bad row can't wedge every later flush
+            DROPPED_ROWS.inc(len(self.buffer))
+            self._clear_buffer()
             return False
 
         finally:
-            self.conn.commit()
-            cur.close()
+            if cur:
+                cur.close()
 
+        FLUSH_SECONDS.observe(time.perf_counter() - start)
+        FLUSHED_ROWS.inc(len(self.buffer))
+        self._clear_buffer()
         return True
 
+    def _unavailable(self):
+        """Hand the buffered events to on_drop (or drop them) when postgres can't be reached."""
+        if self.on_drop is not None:
+            print(f"psql unavailable, spooling {len(self.buffer)} raw events")
+            UNAVAILABLE_ROWS.inc(len(self.buffer))
+            self.on_drop(self.buffer_events)
+        else:
+            print(f"dropping {len(self.buffer)} raw events, psql unavailable")
+            DROPPED_ROWS.inc(len(self.buffer))
+        self._clear_buffer()
+
+    def _clear_buffer(self):
+        """Empty the buffer after a flush (or a dropped batch) and advance the flushed offset."""
+        self.buffer = []
+        self.buffer_events = []
+        self.last_flush = time.monotonic()
+        if self.buffer_offset is not None:
+            self.flushed_offset = self.buffer_offset
+
     def print_events(self):
         """Print total count of rows currently stored in raw_events."""
         try:
@@ -107,22 +381,268 @@ class PSQLManager:
             if self.conn:
                 self.conn.close()
 
-    def prune_old_raw_events(self, retention_hours):
-        """Delete raw_events rows older than retention_hours."""
+    def _is_partitioned(self, cur):
+        """Return True when raw_events is a partitioned table."""
+        cur.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'raw_events'::regclass")
+        return cur.fetchone() is not None
+
+    def _partition_name(self, hour_start):
+        """Return the name of the hourly raw_events partition starting at hour_start (UTC)."""
+        return f"raw_events_p{hour_start:%Y%m%d%H}"
+
+    def ensure_partitions(self, hours_ahead=3, hours_back=0):
+        """Create any missing hourly raw_events partitions around the current hour.
+
+        Each hour is created in its own transaction, so one that fails is logged and skipped
+        (its rows keep landing in the default partition) without losing the others.
+        Returns True only if every hour has its partition.
+        """
+        current_hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        created = 0
+        failed = 0
+
+        for offset in range(-hours_back, hours_ahead + 1):
+            hour_start = current_hour + timedelta(hours=offset)
+            cur = None
+            try:
+                cur = self.conn.cursor()
+                if self._create_partition(cur, hour_start):
+                    created += 1
+                self.conn.commit()
+            except Exception as e:
+                print(f"error creating raw_events partition for {hour_start:%Y-%m-%d %H}:00 UTC: {e}")
+                self.conn.rollback()
+                failed += 1
+            finally:
+                if cur:
+                    cur.close()
+
+        if created:
+            print(f"created {created} raw_events partitions")
+        return failed == 0
+
+    def _create_partition(self, cur, hour_start):
+        """Create the partition for one hour in the current transaction; return False if it already exists.
+
+        Rows for that hour already in the default partition (e.g. events timestamped ahead of the
+        pre-created hours) would make a plain CREATE ... PARTITION OF fail, so they are moved into
+        a new table that is then attached in their place.
+        """
+        name = self._partition_name(hour_start)
+        cur.execute("SELECT to_regclass(%s)", (name,))
+        if cur.fetchone()[0] is not None:
+            return False
+
+        hour_end = hour_start + timedelta(hours=1)
+        cur.execute("SELECT 1 FROM raw_events_default WHERE dt >= %s AND dt < %s LIMIT 1", (hour_start, hour_end))
+        if cur.fetchone() is None:
+            cur.execute(
+                sql.SQL("CREATE TABLE {} PARTITION OF raw_events FOR VALUES FROM (%s) TO (%s)").format(
+                    sql.Identifier(name)
+                ),
+                (hour_start, hour_end),
+            )
+            return True
+
+        # block inserts into the default partition until the hour's rows have moved out and it is attached
+        cur.execute("SET LOCAL lock_timeout = '5s'")
+        cur.execute("LOCK TABLE raw_events_default IN SHARE ROW EXCLUSIVE MODE")
+        cur.execute(
+            sql.SQL("CREATE TABLE {} (LIKE raw_events INCLUDING DEFAULTS INCLUDING CONSTRAINTS)").format(
+                sql.Identifier(name)
+            )
+        )
+        cur.execute(
+            sql.SQL(
+                "WITH moved AS (DELETE FROM raw_events_default WHERE dt >= %s AND dt < %s RETURNING *) "
+                "INSERT INTO {} SELECT * FROM moved"
+            ).format(sql.Identifier(name)),
+            (hour_start, hour_end),
+        )
+        moved = cur.rowcount
+        cur.execute(
+            sql.SQL("ALTER TABLE raw_events ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)").format(
+                sql.Identifier(name)
+            ),
+            (hour_start, hour_end),
+        )
+        print(f"moved {moved} default-partition rows into new partition {name}")
+        return True
+
+    def drop_expired_partitions(self, retention_hours):
+        """Detach and drop hourly partitions whose whole range is older than retention_hours."""
+        cur = None
         try:
-            if not self.conn:
-                print("error: not connected to psql db")
-                return False
+            cur = self.conn.cursor()
+            cutoff = datetime.now(timezone.utc) - timedelta(hours=retention_hours)
+            cur.execute(
+                """
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'raw_events'::regclass
+                  AND c.relname LIKE 'raw\\_events\\_p%'
+                ORDER BY c.relname
+                """
+            )
+            partitions = [row[0] for row in cur.fetchall()]
 
-            # to prevent local psql storage blow up accidentally
+            dropped = 0
+            archived_rows = 0
+            archived_paths = []
+            for name in partitions:
+                hour_start = datetime.strptime(name[len("raw_events_p") :], "%Y%m%d%H").replace(tzinfo=timezone.utc)
+                if hour_start + timedelta(hours=1) > cutoff:
+                    continue
+
+                # avoid hanging indefinitely if a long query holds the partition
+                cur.execute("SET LOCAL lock_timeout = '5s'")
+                if self.archive is not None:
+                    # block late inserts until the drop, so nothing lands between the export and it;
+                    # a failed export raises and keeps the partition for the next pass
+                    cur.execute(sql.SQL("LOCK TABLE {} IN SHARE MODE").format(sql.Identifier(name)))
+                    archived_rows += self.archive.export_partition(self.conn, name)
+                cur.execute(sql.SQL("ALTER TABLE raw_events DETACH PARTITION {}").format(sql.Identifier(name)))
+                cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+                self.conn.commit()
+                dropped += 1
+
+            # stragglers in the default partition are few, so a plain delete is fine there
+            if self.archive is not None:
+                cur.execute("SET LOCAL lock_timeout = '5s'")
+                cur.execute("LOCK TABLE raw_events_default IN SHARE MODE")
+                rows, archived_paths = self.archive.export_before(self.conn, "raw_events_default", cutoff)
+                archived_rows += rows
+            cur.execute("DELETE FROM raw_events_default WHERE dt < %s", (cutoff,))
+            deleted_rows = cur.rowcount
+            self.conn.commit()
+
+            print(f"pruned old raw events: {dropped} partitions dropped, {deleted_rows} default-partition rows removed")
+            if self.archive is not None:
+                print(f"archived {archived_rows} raw events to {self.archive.directory}")
+            return True
+
+        except Exception as e:
+            print(f"error dropping expired raw_events partitions: {e}")
+            self.conn.rollback()
+            # those rows are still in postgres, so their copies would be archived twice
+            if archived_paths:
+                self.archive.remove(archived_paths)
+            return False
+        finally:
+            if cur:
+                cur.close()
+
+    def maintain_partitions(self, retention_hours, hours_ahead=3):
+        """Pre-create upcoming hourly partitions, then drop the ones past retention."""
+        # an hour still missing its partition only means its rows sit in the default one until the next pass
+        self.ensure_partitions(hours_ahead)
+        return self.drop_expired_partitions(retention_hours)
+
+    def prune_old_rollups(self, rollup_retention_hours):
+        """Delete minute_rollups rows older than rollup_retention_hours."""
+        try:
             cur = self.conn.cursor()
+            cur.execute(
+                "DELETE FROM minute_rollups WHERE minute < NOW() - (%s * INTERVAL '1 hour')",
+                (rollup_retention_hours,),
+            )
+            deleted_rows = cur.rowcount
+            self.conn.commit()
+            cur.close()
+            print(f"pruned old minute rollups: {deleted_rows} rows removed")
+            return True
+
+        except Exception as e:
+            print(f"error pruning old minute rollups: {e}")
+            self.conn.rollback()
+            return False
+
+    def rebuild_rollups(self, since_hours):
+        """Recompute minute_rollups from raw_events for the last since_hours (e.g. after a backfill)."""
+        try:
+            if not self.connect():
+                return False
+            cur = self.conn.cursor()
+            cutoff = datetime.now(timezone.utc).replace(second=0, microsecond=0) - timedelta(hours=since_hours)
+
+            # never reach back past the oldest retained raw row, or older rollups would be lost
+            cur.execute("SELECT date_trunc('minute', MIN(dt)) + INTERVAL '1 minute' FROM raw_events")
+            oldest_full_minute = cur.fetchone()[0]
+            if oldest_full_minute is None:
+                print("no raw events to rebuild minute rollups from")
+                cur.close()
+                self.conn.close()
+                return True
+            cutoff = max(cutoff, oldest_full_minute)
+
+            # replace the window wholesale in one transaction so readers never see it half rebuilt
+            cur.execute("DELETE FROM minute_rollups WHERE minute >= %s", (cutoff,))
             cur.execute(
                 """
-                DELETE FROM raw_events
-                WHERE dt < NOW() - (%s * INTERVAL '1 hour')
+                INSERT INTO minute_rollups
+                    (minute, wiki, type, bot, minor, patrolled, namespace, event_count, length_sum, length_count)
+                SELECT
+                    date_trunc('minute', dt),
+                    wiki,
+                    type,
+                    bot,
+                    minor,
+                    patrolled,
+                    namespace,
+                    COUNT(*),
+                    COALESCE(SUM(length), 0),
+                    COUNT(length)
+                FROM raw_events
+                WHERE dt >= %s
+                GROUP BY 1, 2, 3, 4, 5, 6, 7
                 """,
-                (retention_hours,),
+                (cutoff,),
             )
+            rebuilt_rows = cur.rowcount
+            self.conn.commit()
+            cur.close()
+            print(f"rebuilt minute rollups: {rebuilt_rows} rows")
+            self.conn.close()
+            return True
+
+        except Exception as e:
+            print(f"error rebuilding minute rollups: {e}")
+            self.conn.rollback()
+            self.conn.close()
+            return False
+
+    def prune_old_raw_events(self, retention_hours, rollup_retention_hours=48):
+        """Remove raw_events rows older than retention_hours and rollups older than rollup_retention_hours.
+
+        With an archive set, the raw rows are exported to parquet first and kept if that fails.
+        """
+        archived_paths = []
+        try:
+            # a connection lost since the last run is reopened, so pruning resumes once postgres is back
+            if not self.reconnect():
+                print("error: not connected to psql db")
+                return False
+
+            # rollups are tiny, so they outlive raw rows and keep whole-day queries complete
+            if not self.prune_old_rollups(max(retention_hours, rollup_retention_hours)):
+                return False
+
+            # partitioned tables prune by dropping whole partitions, no row deletes or bloat
+            cur = self.conn.cursor()
+            partitioned = self._is_partitioned(cur)
+            self.conn.commit()
+            if partitioned:
+                cur.close()
+                return self.maintain_partitions(retention_hours)
+
+            # to prevent local psql storage blow up accidentally
+            cutoff = datetime.now(timezone.utc) - timedelta(hours=retention_hours)
+            if self.archive is not None:
+                cur.execute("LOCK TABLE raw_events IN SHARE MODE")
+                rows, archived_paths = self.archive.export_before(self.conn, "raw_events", cutoff)
+                print(f"archived {rows} raw events to {self.archive.directory}")
+            cur.execute("DELETE FROM raw_events WHERE dt < %s", (cutoff,))
             deleted_rows = cur.rowcount
             self.conn.commit()
             cur.close()
@@ -132,21 +652,30 @@ class PSQLManager:
         except Exception as e:
             print(f"error pruning old raw events: {e}")
             self.conn.rollback()
+            if archived_paths:
+                self.archive.remove(archived_paths)
             return False
 
-    def setup_db(self):
-        """Placeholder for database bootstrap workflow."""
-        return
-
+    def setup_db(self, schema_path=None):
+        """Create raw_events, minute_rollups, and indexes from psql_schema.sql, then the first partitions."""
         try:
-            self.connect()
+            if not self.connect():
+                exit(1)
             cur = self.conn.cursor()
 
             # Execute schema script against the currently connected database.
-            with open("psql_setup.sql", "r") as f:
+            schema_path = schema_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), "psql_schema.sql")
+            with open(schema_path, "r") as f:
                 cur.execute(f.read())
             self.conn.commit()
             cur.close()
+
+            cur = self.conn.cursor()
+            partitioned = self._is_partitioned(cur)
+            cur.close()
+            if partitioned and not self.ensure_partitions():
+                exit(1)
+            print("psql schema set up successfully")
             self.conn.close()
 
         except Exception as e:
@@ -159,13 +688,14 @@ class PSQLManager:
         """Remove all rows from raw_events."""
         cur = None
         try:
-            self.connect()
+            if not self.connect():
+                return False
             cur = self.conn.cursor()
             # avoid hanging indefinitely if another session is using raw_events
             cur.execute("SET lock_timeout = '5s'")
-            cur.execute("TRUNCATE TABLE raw_events")
+            cur.execute("TRUNCATE TABLE raw_events, minute_rollups")
             self.conn.commit()
-            print("raw_events table truncated successfully")
+            print("raw_events and minute_rollups tables truncated successfully")
             return True
 
         except Exception as e:
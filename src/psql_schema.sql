@@ -0,0 +1,67 @@
+-- schema objects for the wikipedia_events database
+-- run via `python src/utilities.py setup` (PSQLManager.setup_db) or `\i psql_schema.sql` from psql.
+--
+-- raw_events is range-partitioned by hour on dt so retention drops whole partitions
+-- (a metadata operation) instead of DELETE-ing rows. PSQLManager.ensure_partitions
+-- pre-creates upcoming hourly partitions named raw_events_pYYYYMMDDHH (UTC hours).
+--
+-- migrating an existing unpartitioned raw_events table:
+--   ALTER TABLE raw_events RENAME TO raw_events_legacy;
+--   (run this script, then PSQLManager.ensure_partitions covering the legacy time range)
+--   INSERT INTO raw_events SELECT * FROM raw_events_legacy ON CONFLICT DO NOTHING;
+--   DROP TABLE raw_events_legacy;
+
+-- store raw Wikimedia events used by pipeline and analytics
+-- the partition key has to be part of the primary key, so ids are unique per (id, dt)
+CREATE TABLE IF NOT EXISTS raw_events (
+    id TEXT NOT NULL,
+    domain TEXT,
+    dt TIMESTAMP WITH TIME ZONE NOT NULL,
+    type TEXT,
+    namespace INTEGER,
+    title TEXT,
+    comment TEXT,
+    "user" TEXT,
+    bot BOOLEAN,
+    wiki TEXT,
+    minor BOOLEAN,
+    patrolled BOOLEAN,
+    log_type TEXT,
+    length INTEGER,
+    PRIMARY KEY (id, dt)
+) PARTITION BY RANGE (dt);
+
+-- catches late or clock-skewed events that fall outside the pre-created hourly partitions
+-- (skipped for a legacy unpartitioned raw_events so the rest of this script still applies)
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'raw_events'::regclass) THEN
+        CREATE TABLE IF NOT EXISTS raw_events_default PARTITION OF raw_events DEFAULT;
+    END IF;
+END $$;
+
+-- indexes for common time-bounded and grouped analytics queries (created on every partition).
+-- the dt index covers the columns the "today" queries group and filter on, so a [start, end)
+-- dt range can be answered by an index-only scan; it replaces the plain idx_raw_events_dt.
+DROP INDEX IF EXISTS idx_raw_events_dt;
+CREATE INDEX IF NOT EXISTS idx_raw_events_dt_covering ON raw_events (dt) INCLUDE (wiki, "user", type, bot);
+CREATE INDEX IF NOT EXISTS idx_raw_events_user_dt ON raw_events ("user", dt);
+CREATE INDEX IF NOT EXISTS idx_raw_events_type_dt ON raw_events (type, dt);
+CREATE INDEX IF NOT EXISTS idx_raw_events_wiki_dt ON raw_events (wiki, dt);
+
+-- per-minute counts and length sums by dimension, upserted by the pipeline in the same
+-- statement that inserts the raw rows, so dashboard "today" queries scan minutes x dimensions
+-- instead of raw events. NULLS NOT DISTINCT (PostgreSQL 15+) lets NULL flags share one row.
+CREATE TABLE IF NOT EXISTS minute_rollups (
+    minute TIMESTAMP WITH TIME ZONE NOT NULL,
+    wiki TEXT,
+    type TEXT,
+    bot BOOLEAN,
+    minor BOOLEAN,
+    patrolled BOOLEAN,
+    namespace INTEGER,
+    event_count BIGINT NOT NULL DEFAULT 0,
+    length_sum BIGINT NOT NULL DEFAULT 0,
+    length_count BIGINT NOT NULL DEFAULT 0,
+    CONSTRAINT minute_rollups_key UNIQUE NULLS NOT DISTINCT (minute, wiki, type, bot, minor, patrolled, namespace)
+);
@@ -9,30 +9,8 @@ CREATE DATABASE wikipedia_events
 -- connect to the target database before creating schema objects
 \c wikipedia_events
 
--- store raw Wikimedia events used by pipeline and analytics
-CREATE TABLE IF NOT EXISTS raw_events (
-    id TEXT PRIMARY KEY,
-    domain TEXT,
-    dt TIMESTAMP WITH TIME ZONE NOT NULL,
-    type TEXT,
-    namespace INTEGER,
-    title TEXT,
-    comment TEXT,
-    "user" TEXT,
-    bot BOOLEAN,
-    wiki TEXT,
-    minor BOOLEAN,
-    patrolled BOOLEAN,
-    log_type TEXT,
-    length INTEGER
-);
-
--- indexes for common time-bounded and grouped analytics queries
--- run explain to analyze index speedups TBD
-CREATE INDEX IF NOT EXISTS idx_raw_events_dt ON raw_events (dt);
-CREATE INDEX IF NOT EXISTS idx_raw_events_user_dt ON raw_events ("user", dt);
-CREATE INDEX IF NOT EXISTS idx_raw_events_type_dt ON raw_events (type, dt);
-CREATE INDEX IF NOT EXISTS idx_raw_events_wiki_dt ON raw_events (wiki, dt);
+-- create raw_events (hourly range partitions on dt) and its indexes
+\ir psql_schema.sql
 
 -- views can be added here as needed
 
@@ -0,0 +1,157 @@
+import hashlib
+import time
+import uuid
+
+import pyarrow as pa
+import redis
+from psycopg2 import sql
+
+from metrics import REGISTRY
+
+"""
+Shared result cache for PSQLAnalytics queries.
+
+Every dashboard, CLI and API process that shares a Redis instance also
+shares cached query results. A query result is stored as an Arrow IPC stream
+(zstd-compressed) under a key built from the ingest watermark and a hash of
+the database, the query text and its parameters:
+
+    analytics:cache:<watermark>:<sha1>
+
+Instead of expiring after a fixed TTL, results go stale when the pipeline
+bumps the watermark (RedisManager.publish_ingest_watermark), which it does
+once rows have actually reached postgres or retention removed some. New
+lookups then build keys for the new generation, and the old ones are left to
+expire on their own. While nothing is ingesting, results stay cached.
+
+When many viewers miss on the same key at once, only one of them runs the
+query. It holds a short lock while doing so, and the others poll for its
+result instead of sending the same query to postgres.
+"""
+
+# hit: served from redis, miss: ran the query and stored it, coalesced: waited for another caller's result,
+# timeout: gave up waiting and ran it anyway, error: redis was unavailable or the frame could not be encoded
+LOOKUPS = REGISTRY.counter("wiki_query_cache_lookups_total", "analytics query result cache lookups", ("result",))
+
+# KEYS[1]: lock key, ARGV[1]: the holder's token; deletes the lock only if that holder still owns it
+RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+def encode_frame(frame):
+    """Serialize a DataFrame as a compressed Arrow IPC stream."""
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression="zstd")
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def decode_frame(payload):
+    """Read a DataFrame back from encode_frame() bytes."""
+    return pa.ipc.open_stream(payload).read_all().to_pandas()
+
+
+class QueryCache:
+    """Redis-backed, watermark-invalidated cache of analytics query results."""
+
+    def __init__(self, redis_manager, ttl_seconds=900, lock_seconds=30, poll_seconds=0.05):
+        """Cache through redis_manager's Redis instance, on a separate client that returns bytes.
+
+        ttl_seconds only bounds how long superseded generations take up memory.
+        lock_seconds is how long callers wait for another caller's query before running it themselves.
+        """
+        self.watermark_key = redis_manager.ingest_watermark_key()
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self.poll_seconds = poll_seconds
+        # the manager's client decodes responses, which would mangle arrow payloads
+        self.client = redis.Redis(
+            host=redis_manager.host,
+            port=redis_manager.port,
+            username=redis_manager.user,
+            password=redis_manager.password,
+            db=redis_manager.db,
+        )
+
+    def key(self, namespace, query, params):
+        """Return the cache key for a query in the current watermark generation."""
+        # a Composed query's repr spells out every fragment and identifier, so it identifies the query
+        text = repr(query) if isinstance(query, sql.Composable) else " ".join(query.split())
+        digest = hashlib.sha1(repr((namespace, text, params)).encode()).hexdigest()
+        watermark = self.client.get(self.watermark_key) or b"0"
+        return f"analytics:cache:{watermark.decode()}:{digest}"
+
+    def get_or_compute(self, namespace, query, params, compute, wait_seconds=None):
+        """Return the cached DataFrame for a query, running compute() only if no caller has it yet.
+
+        A caller waits at most wait_seconds (default lock_seconds) for another caller's result.
+        """
+        try:
+            key = self.key(namespace, query, params)
+            payload = self.client.get(key)
+        except redis.RedisError:
+            LOOKUPS.labels("error").inc()
+            return compute()
+        if payload is not None:
+            LOOKUPS.labels("hit").inc()
+            return decode_frame(payload)
+
+        lock_key = f"{key}:lock"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + (self.lock_seconds if wait_seconds is None else wait_seconds)
+        waited = False
+        while True:
+            try:
+                if self.client.set(lock_key, token, nx=True, px=int(self.lock_seconds * 1000)):
+                    break
+            except redis.RedisError:
+                LOOKUPS.labels("error").inc()
+                return compute()
+
+            # another caller is running this query; its result lands under the same key
+            waited = True
+            if time.monotonic() >= deadline:
+                LOOKUPS.labels("timeout").inc()
+                return compute()
+            time.sleep(self.poll_seconds)
+            try:
+                payload = self.client.get(key)
+            except redis.RedisError:
+                LOOKUPS.labels("error").inc()
+                return compute()
+            if payload is not None:
+                LOOKUPS.labels("coalesced").inc()
+                return decode_frame(payload)
+
+        try:
+            # the previous holder may have stored it between our last look and taking the lock
+            try:
+                payload = self.client.get(key) if waited else None
+            except redis.RedisError:
+                payload = None
+            if payload is not None:
+                LOOKUPS.labels("coalesced").inc()
+                return decode_frame(payload)
+
+            frame = compute()
+            try:
+                self.client.set(key, encode_frame(frame), ex=self.ttl_seconds)
+                LOOKUPS.labels("miss").inc()
+            except (redis.RedisError, pa.ArrowException, TypeError, ValueError):
+                LOOKUPS.labels("error").inc()
+            return frame
+        finally:
+            self._release(lock_key, token)
+
+    def _release(self, lock_key, token):
+        """Drop the lock if this caller still holds it (it may have expired and been taken over)."""
+        try:
+            self.client.eval(RELEASE_SCRIPT, 1, lock_key, token)
+        except redis.RedisError:
+            pass
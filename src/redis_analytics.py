@@ -0,0 +1,231 @@
+from collections import defaultdict
+
+import redis
+
+# metrics:
+#   - day / all-time counter totals
+#   - rolling-window counter aggregates (5m / 1h), from running rollups or minute buckets
+#   - day / all-time / rolling-window top users (bounded top-k with an error bound)
+#   - spike score (5m vs 1h baseline)
+#   - distinct users / pages / wikis per rolling window (HyperLogLog)
+
+# read-side counterpart to redis_manager.py, shared by the console report and the dashboard
+
+
+class RedisAnalytics:
+    def __init__(self, redis_manager):
+        """Store a connected RedisManager used to read real-time metrics."""
+        self.redis = redis_manager
+
+    def aggregate_windows(self, window_minutes_list):
+        """Aggregate minute-bucket hashes for multiple windows with one pipelined read."""
+        current_minute = self.redis.get_minute_bucket()
+        windows = sorted(set(window_minutes_list))  # [5, 60] for example (5 minute, 1 hr windows)
+        starts = {w: current_minute - w + 1 for w in windows}  # grabs the unix minute that is 'w' minutes prior
+        aggregates = {w: defaultdict(int) for w in windows}  # {5: defaultdict(int), 60: defaultdict(int)}
+
+        # one HGETALL per minute of the largest window, all in one pipeline (no keyspace scan)
+        minutes = range(starts[windows[-1]], current_minute + 1)
+        pipe = self.redis.client.pipeline()
+        for minute in minutes:
+            pipe.hgetall(self.redis.minute_key(minute))
+        results = pipe.execute()
+
+        # minute hash fields are already in <metric_group>:<metric_name> form
+        for minute, fields in zip(minutes, results):
+            for agg_key, raw_val in fields.items():
+                value = int(raw_val or 0)
+
+                # for each window, add the value to the aggregate
+                for window in windows:
+                    if minute >= starts[window]:
+                        aggregates[window][agg_key] += value
+
+        return {w: dict(aggregates[w]) for w in windows}
+
+    def rolling_totals(self, window_minutes_list):
+        """Return rolling-window counters from the ingest-maintained rollups, one read per window."""
+        current_minute = self.redis.get_minute_bucket()
+        windows = sorted(set(window_minutes_list))
+        maintained = [w for w in windows if w in self.redis.rollup_windows]
+
+        pipe = self.redis.client.pipeline()
+        for window in maintained:
+            pipe.get(f"{self.redis.rollup_key(window)}:rolled")
+            pipe.hgetall(self.redis.rollup_key(window))
+        results = pipe.execute()
+
+        totals = {}
+        fallback = [w for w in windows if w not in self.redis.rollup_windows]
+        for window, marker, fields in zip(maintained, results[::2], results[1::2]):
+            # a rollup is only trusted while the pipeline keeps rolling it forward (one minute of slack)
+            if marker is None or int(marker) < current_minute - window - 1:
+                fallback.append(window)
+                continue
+            totals[window] = {agg_key: int(raw_val) for agg_key, raw_val in fields.items()}
+
+        # windows without a fresh rollup are summed from the minute buckets instead
+        if fallback:
+            totals.update(self.aggregate_windows(fallback))
+        return totals
+
+    def check_rollups(self):
+        """Compare each rollup with the sum of the minute buckets it covers; return any mismatches."""
+        current_minute = self.redis.get_minute_bucket()
+        mismatches = {}
+
+        for window in self.redis.rollup_windows:
+            rollup_key = self.redis.rollup_key(window)
+            marker_key = f"{rollup_key}:rolled"
+
+            # read the rollup and every bucket newer than its marker as one consistent snapshot,
+            # retrying if a rollover moves the marker in between
+            with self.redis.client.pipeline() as pipe:
+                while True:
+                    try:
+                        pipe.watch(marker_key)
+                        marker = pipe.get(marker_key)
+                        if marker is None:
+                            break
+
+                        minutes = range(int(marker) + 1, current_minute + 1)
+                        pipe.multi()
+                        pipe.hgetall(rollup_key)
+                        for minute in minutes:
+                            pipe.hgetall(self.redis.minute_key(minute))
+                        rollup, *buckets = pipe.execute()
+                        break
+                    except redis.WatchError:
+                        continue
+
+            # never rolled yet, nothing to compare against
+            if marker is None:
+                continue
+
+            expected = defaultdict(int)
+            for fields in buckets:
+                for agg_key, raw_val in fields.items():
+                    expected[agg_key] += int(raw_val)
+
+            actual = {agg_key: int(raw_val) for agg_key, raw_val in rollup.items()}
+            diff = {
+                agg_key: (actual.get(agg_key, 0), expected.get(agg_key, 0))
+                for agg_key in set(actual) | set(expected)
+                if actual.get(agg_key, 0) != expected.get(agg_key, 0)
+            }
+            if diff:
+                mismatches[window] = diff
+
+        return mismatches
+
+    def distinct_counts(self, window_minutes_list, kinds=("users", "pages", "wikis")):
+        """Return approximate distinct users/pages/wikis per window by merging minute HyperLogLogs."""
+        current_minute = self.redis.get_minute_bucket()
+        windows = sorted(set(window_minutes_list))
+
+        # one transaction: per window and kind, rebuild a scratch HLL from the minute HLLs and count it
+        pipe = self.redis.client.pipeline()
+        for window in windows:
+            minutes = range(current_minute - window + 1, current_minute + 1)
+            for kind in kinds:
+                window_key = f"hll:window:{window}:{kind}"
+                pipe.delete(window_key)
+                pipe.pfmerge(window_key, *(self.redis.hll_key(minute, kind) for minute in minutes))
+                pipe.pfcount(window_key)
+                pipe.expire(window_key, 60)
+        results = pipe.execute()
+
+        # every window/kind queued 4 commands; the count is the third
+        counts = iter(results[2::4])
+        return {window: {kind: int(next(counts)) for kind in kinds} for window in windows}
+
+    def scope_totals(self, scope):
+        """Return every counter for 'today' or 'all' from its scope hash in one read."""
+        key = self.redis.ALL_KEY if scope == "all" else self.redis.day_key(self.redis.get_today())
+        return {agg_key: int(raw_val or 0) for agg_key, raw_val in self.redis.client.hgetall(key).items()}
+
+    def top_users_scope(self, scope, limit=10):
+        """Return the top users for 'today' or 'all' as (user, score) pairs."""
+        key = "all:top_users" if scope == "all" else f"{self.redis.get_today()}:top_users"
+        return [(user, int(score)) for user, score in self.redis.client.zrevrange(key, 0, limit - 1, withscores=True)]
+
+    def top_users_window(self, window_minutes, limit=10):
+        """Return the top users for a rolling window as (user, score) pairs, in O(limit) transfer."""
+        return self.top_users_window_bounded(window_minutes, limit)[0]
+
+    def top_users_window_bounded(self, window_minutes, limit=10):
+        """Return (top users, error bound) for a rolling window from the capacity-trimmed sets.
+
+        Scores are lower bounds; a user's true count is at most score + error bound.
+        """
+        cache_ttl_seconds = 120
+        current_minute = self.redis.get_minute_bucket()
+        cached_key = f"top_users:window:{window_minutes}:{current_minute}"
+        keys = [cached_key, f"{cached_key}:bound", f"{cached_key}:live", f"top_users:minute:{current_minute}"]
+        for minute in range(current_minute - window_minutes + 1, current_minute):
+            keys.extend((f"top_users:minute:{minute}", f"top_users:floor:{minute}"))
+        result = self.redis._eval_script(
+            "top_users_window",
+            keys,
+            window_minutes,
+            self.redis.top_users_capacity,
+            limit,
+            cache_ttl_seconds,
+        )
+        bound, entries = int(result[0]), result[1:]
+        return [(user, int(float(score))) for user, score in zip(entries[::2], entries[1::2])], bound
+
+    def top_users_window_exact(self, window_minutes, limit=10):
+        """Aggregate top-user scores by merging every minute sorted set client-side.
+
+        Only exact while no minute in the window has been trimmed (see TOP_USERS_TRIM_SCRIPT).
+        """
+        # initialize defaultdict to prep minute keys by user for aggregation
+        top_users = defaultdict(int)
+        current_minute = self.redis.get_minute_bucket()
+
+        # pipeline fetch all values for each user for each minute key
+        pipe = self.redis.client.pipeline()
+        for minute in range(current_minute - window_minutes + 1, current_minute + 1):
+            pipe.zrevrange(f"top_users:minute:{minute}", 0, -1, withscores=True)
+        results = pipe.execute()
+
+        # loop over each entry, summing each user's score across all minutes to get top users in this window
+        for entries in results:
+            for user, score in entries:
+                top_users[user] += int(score)
+
+        # sort by score and take the top entries
+        return sorted(top_users.items(), key=lambda x: x[1], reverse=True)[:limit]
+
+    def check_top_users(self, window_minutes, exact_counts, limit=10):
+        """Return users whose true count falls outside the sketch's [score, score + bound] range.
+
+        exact_counts maps user -> true event count for the window and has to come from an untrimmed
+        source (e.g. a tally kept while writing the events); the minute sets are trimmed themselves.
+        """
+        entries, bound = self.top_users_window_bounded(window_minutes, limit)
+        reported = dict(entries)
+        cutoff = entries[-1][1] if len(entries) >= limit else 0
+
+        top_exact = sorted(exact_counts.items(), key=lambda x: x[1], reverse=True)[:limit]
+        violations = []
+        for user in {user for user, _ in top_exact} | set(reported):
+            exact = exact_counts.get(user, 0)
+            # a user missing from the reported top-k may only be there if the bound allows it
+            low = reported.get(user, 0)
+            high = low + bound if user in reported else cutoff + bound
+            if not low <= exact <= high:
+                violations.append((user, exact, low, high))
+        return sorted(violations)
+
+    def spike_score(self, aggregates_5m, aggregates_1h):
+        """Return the 5m event volume relative to the average 5m window of the last hour."""
+        one_hour_total = aggregates_1h.get("events:total", 0)
+        five_min_total = aggregates_5m.get("events:total", 0)
+        if one_hour_total <= 0:
+            return 0.0
+
+        # baseline is the average number of events per 5 minute window in the last hour
+        baseline_five_min = one_hour_total / 12
+        return five_min_total / baseline_five_min if baseline_five_min > 0 else 0.0
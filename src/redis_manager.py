@@ -1,7 +1,12 @@
 from dotenv import load_dotenv
 import redis
 import os
+import re
+import time
+from collections import Counter
 from datetime import datetime
+from metrics import REGISTRY
+from redis_analytics import RedisAnalytics
 
 
 # metrics:
@@ -13,127 +18,701 @@ from datetime import datetime
 #   - namespace occurances
 #   - top 10 editors or so
 
+# instrumentation, served on the pipeline's /metrics endpoint
+WRITE_SECONDS = REGISTRY.histogram("wiki_redis_write_seconds", "time to apply one event batch to redis", ("mode",))
+DUPLICATE_EVENTS = REGISTRY.counter("wiki_redis_duplicate_events_total", "replayed events skipped by redis dedup")
+FAILED_BATCHES = REGISTRY.counter("wiki_redis_failed_batches_total", "redis event batches that raised an error")
+
+
+# server-side accounting for a batch of compact event tuples, applied atomically per call.
+# every key it touches is passed in KEYS, so cluster/proxy routing can see them:
+# KEYS: day metrics, all-time metrics, minute hash, day top users, all-time top users, minute top users,
+#   minute users/pages/wikis HyperLogLogs, then the rollup hashes, then the dedup sets the batch uses
+# ARGV: minute ttl, top-users ttl, number of rollup hashes, dedup ttl,
+#   then 11 fields per event: type, namespace, log_type, user, bot, minor, patrolled, wiki, title,
+#   KEYS index of the dedup set, event id (booleans as "1"/"0", "" for missing; an empty index skips the check)
+# returns {applied events, duplicates skipped}
+EVENT_SCRIPT = """
+local minute_ttl = tonumber(ARGV[1])
+local users_ttl = tonumber(ARGV[2])
+local rollup_keys = {}
+for i = 1, tonumber(ARGV[3]) do
+    table.insert(rollup_keys, KEYS[9 + i])
+end
+local dedup_ttl = tonumber(ARGV[4])
+
+local metrics = {}
+local users = {}
+local applied = 0
+local duplicates = 0
+local dedup_keys = {}
+
+local function count(metric)
+    metrics[metric] = (metrics[metric] or 0) + 1
+end
+
+local distinct = {users = {}, pages = {}, wikis = {}}
+local hll_keys = {users = KEYS[7], pages = KEYS[8], wikis = KEYS[9]}
+
+for i = 5, #ARGV, 11 do
+    local event_type = ARGV[i]
+    local namespace = ARGV[i + 1]
+    local log_type = ARGV[i + 2]
+    local user = ARGV[i + 3]
+    local bot = ARGV[i + 4]
+    local minor = ARGV[i + 5]
+    local patrolled = ARGV[i + 6]
+    local wiki = ARGV[i + 7]
+    local title = ARGV[i + 8]
+    local dedup_index = ARGV[i + 9]
+
+    -- events replayed after a reconnect were already counted the first time
+    local fresh = true
+    if event_type ~= "" and dedup_index ~= "" then
+        local dedup_key = KEYS[tonumber(dedup_index)]
+        fresh = redis.call("SADD", dedup_key, ARGV[i + 10]) == 1
+        dedup_keys[dedup_key] = true
+        if not fresh then
+            duplicates = duplicates + 1
+        end
+    end
+
+    if event_type ~= "" and fresh then
+        applied = applied + 1
+        count("events:total")
+        count("type:" .. event_type)
+
+        if namespace ~= "" then
+            count("namespace:" .. namespace)
+        end
+        if event_type == "log" and log_type ~= "" then
+            count("log_type:" .. log_type)
+        end
+
+        if event_type == "edit" then
+            if bot == "1" then count("edits:bot") elseif bot == "0" then count("edits:human") end
+            if minor == "1" then count("edits:minor") elseif minor == "0" then count("edits:major") end
+        end
+        if bot == "1" then
+            if patrolled == "1" then
+                count("patrolled:patrolled_bot")
+            elseif patrolled == "0" then
+                count("patrolled:unpatrolled_bot")
+            end
+        end
+
+        if user ~= "" then
+            users[user] = (users[user] or 0) + 1
+            table.insert(distinct.users, user)
+        end
+        if wiki ~= "" then
+            table.insert(distinct.wikis, wiki)
+            if title ~= "" then
+                table.insert(distinct.pages, wiki .. ":" .. title)
+            end
+        end
+    end
+end
+
+local minute_key = KEYS[3]
+for metric, n in pairs(metrics) do
+    redis.call("HINCRBY", KEYS[1], metric, n)
+    redis.call("HINCRBY", KEYS[2], metric, n)
+    redis.call("HINCRBY", minute_key, metric, n)
+    for _, rollup_key in ipairs(rollup_keys) do
+        redis.call("HINCRBY", rollup_key, metric, n)
+    end
+end
+-- the minute hash only needs its ttl set once, when the bucket is first written
+if next(metrics) ~= nil and redis.call("TTL", minute_key) < 0 then
+    redis.call("EXPIRE", minute_key, minute_ttl)
+end
+
+local users_key = KEYS[6]
+for user, n in pairs(users) do
+    redis.call("ZINCRBY", KEYS[4], n, user)
+    redis.call("ZINCRBY", KEYS[5], n, user)
+    redis.call("ZINCRBY", users_key, n, user)
+end
+if next(users) ~= nil and redis.call("TTL", users_key) < 0 then
+    redis.call("EXPIRE", users_key, users_ttl)
+end
+
+for kind, values in pairs(distinct) do
+    if #values > 0 then
+        local hll_key = hll_keys[kind]
+        -- chunked so large batches stay under lua's unpack limit
+        for first = 1, #values, 1000 do
+            redis.call("PFADD", hll_key, unpack(values, first, math.min(first + 999, #values)))
+        end
+        if redis.call("TTL", hll_key) < 0 then
+            redis.call("EXPIRE", hll_key, minute_ttl)
+        end
+    end
+end
+
+for dedup_key in pairs(dedup_keys) do
+    if redis.call("TTL", dedup_key) < 0 then
+        redis.call("EXPIRE", dedup_key, dedup_ttl)
+    end
+end
+
+return {applied, duplicates}
+"""
+
+# slide one rolling-window rollup forward, atomically so concurrent writers/rollers can't double count.
+# invariant: rollup:{w}m holds the sum of every minute hash newer than its :rolled marker.
+# KEYS: rollup hash, its :rolled marker, then the minute hashes for the last 2 * window minutes, oldest first
+#   (every bucket a rebuild or a subtraction can read)
+# ARGV: window minutes, current minute bucket
+ROLLOVER_SCRIPT = """
+local window = tonumber(ARGV[1])
+local current = tonumber(ARGV[2])
+local rollup_key = KEYS[1]
+local marker_key = KEYS[2]
+local first = current - 2 * window + 1
+
+local function minute_key(bucket)
+    return KEYS[3 + bucket - first]
+end
+
+-- newest minute bucket that has fallen out of the window
+local target = current - window
+local last = tonumber(redis.call("GET", marker_key))
+if last ~= nil and target <= last then
+    return 0
+end
+
+if last == nil or target - last >= window then
+    -- first run or a long gap: rebuilding from the in-window buckets is cheaper than subtracting
+    redis.call("DEL", rollup_key)
+    for bucket = target + 1, current do
+        local fields = redis.call("HGETALL", minute_key(bucket))
+        for i = 1, #fields, 2 do
+            redis.call("HINCRBY", rollup_key, fields[i], fields[i + 1])
+        end
+    end
+else
+    -- subtract only the buckets that expired since the last rollover
+    for bucket = last + 1, target do
+        local fields = redis.call("HGETALL", minute_key(bucket))
+        for i = 1, #fields, 2 do
+            if redis.call("HINCRBY", rollup_key, fields[i], -tonumber(fields[i + 1])) == 0 then
+                redis.call("HDEL", rollup_key, fields[i])
+            end
+        end
+    end
+end
+
+redis.call("SET", marker_key, target)
+return 1
+"""
+
+# cap closed top-user minute sets at a fixed capacity to bound memory, recording for each trimmed
+# minute the highest score that was dropped (no evicted user had more events in that minute).
+# a batch that read the clock before the minute closed can still land after its trim, so the newest
+# trimmed minute is checked again; a second cut adds to its floor, since an evicted user's true count
+# may be split across both cuts.
+# KEYS: the top_users:trimmed marker, then for every minute from oldest to current - 1 its top-user set
+#   followed by its floor key
+# ARGV: current minute bucket, capacity, oldest minute to look back to, key ttl
+TOP_USERS_TRIM_SCRIPT = """
+local current = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local oldest = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[4])
+local marker_key = KEYS[1]
+
+local last = tonumber(redis.call("GET", marker_key))
+if last == nil or last < oldest - 1 then
+    last = oldest - 1
+end
+
+-- only minutes that are fully closed are trimmed
+for bucket = math.max(last, oldest), current - 1 do
+    local key = KEYS[2 + 2 * (bucket - oldest)]
+    if redis.call("ZCARD", key) > capacity then
+        local floor_key = KEYS[3 + 2 * (bucket - oldest)]
+        local cut = redis.call("ZREVRANGE", key, capacity, capacity, "WITHSCORES")
+        redis.call("ZREMRANGEBYRANK", key, 0, -(capacity + 1))
+        local floor = (tonumber(redis.call("GET", floor_key)) or 0) + tonumber(cut[2])
+        redis.call("SET", floor_key, floor, "EX", ttl)
+    end
+end
+
+if current - 1 > last then
+    redis.call("SET", marker_key, current - 1)
+end
+return 1
+"""
+
+# top-k users for a rolling window: the closed minutes are unioned once per minute into a cached,
+# capacity-trimmed set, then merged with the live minute on every read. returns the error bound
+# (sum of minute and window trim floors) followed by the top k (user, score) pairs.
+# KEYS: cached window set, its :bound key, a scratch :live set, the live minute's top-user set, then for every
+#   closed minute in the window (oldest first) its top-user set followed by its floor key
+# ARGV: window minutes, capacity, k, cache ttl
+TOP_USERS_WINDOW_SCRIPT = """
+local window = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local k = tonumber(ARGV[3])
+local cache_ttl = tonumber(ARGV[4])
+local cached_key = KEYS[1]
+local bound_key = KEYS[2]
+
+local bound = tonumber(redis.call("GET", bound_key))
+if bound == nil then
+    bound = 0
+    local keys = {}
+    for i = 5, #KEYS, 2 do
+        table.insert(keys, KEYS[i])
+        bound = bound + (tonumber(redis.call("GET", KEYS[i + 1])) or 0)
+    end
+
+    if #keys > 0 then
+        redis.call("ZUNIONSTORE", cached_key, #keys, unpack(keys))
+        local cut = redis.call("ZREVRANGE", cached_key, capacity, capacity, "WITHSCORES")
+        if #cut > 0 then
+            bound = bound + tonumber(cut[2])
+            redis.call("ZREMRANGEBYRANK", cached_key, 0, -(capacity + 1))
+        end
+        redis.call("EXPIRE", cached_key, cache_ttl)
+    end
+    redis.call("SET", bound_key, bound, "EX", cache_ttl)
+end
+
+local live_key = KEYS[3]
+redis.call("ZUNIONSTORE", live_key, 2, cached_key, KEYS[4])
+local top = redis.call("ZREVRANGE", live_key, 0, k - 1, "WITHSCORES")
+redis.call("DEL", live_key)
+
+table.insert(top, 1, bound)
+return top
+"""
+
 
 class RedisManager:
     """Manages Redis counters used for real-time pipeline analytics."""
 
-    def __init__(self):
-        """Load connection settings and initialize Redis client state."""
+    WRITE_MODES = {"pipeline", "lua"}
+    ALL_KEY = "all:metrics"
+
+    def __init__(self, write_mode="pipeline", rollup_windows=(5, 15, 60), top_users_capacity=100, dedup_seconds=3600):
+        """Load connection settings and initialize Redis client state.
+
+        write_mode="pipeline" sends coalesced commands from the client;
+        write_mode="lua" applies each batch server-side through EVENT_SCRIPT.
+        rollup_windows are the rolling windows (in minutes) kept as running totals.
+        top_users_capacity caps how many users each closed minute / window top-user set keeps.
+        dedup_seconds is how long event ids are remembered so replayed events aren't counted twice
+        (0 disables the check).
+        """
+        if write_mode not in self.WRITE_MODES:
+            raise ValueError(f"unknown redis write mode: {write_mode}")
+
         load_dotenv()
         self.host = os.getenv("REDIS_HOST", "localhost")
         self.port = int(os.getenv("REDIS_PORT", 6379))
         self.user = os.getenv("REDIS_USER", "default")
         self.password = os.getenv("REDIS_PASSWORD", None)
+        self.db = int(os.getenv("REDIS_DB", 0))
         self.minute_ttl_seconds = 7200
         self.top_users_minute_ttl_seconds = 7200
+        self.top_users_capacity = top_users_capacity
+        self.write_mode = write_mode
+        self.rollup_windows = tuple(sorted(set(rollup_windows)))
+        self.dedup_seconds = dedup_seconds
+        self.duplicates = 0
+        # called with a batch that failed because Redis was unreachable (e.g. Spool.append); None drops it
+        self.on_drop = None
         self.client = None
+        self.script_shas = {}
 
-    def _get_today(self):
+        # minute-bucket keys that already had their TTL set this minute
+        self.expired_minute = None
+        self.expired_keys = set()
+
+    def get_today(self):
         """Return current date string used for day-scoped keys."""
         return datetime.now().strftime("%m-%d-%Y")
 
-    def _get_minute_bucket(self):
+    def get_minute_bucket(self):
         """Return current unix-minute bucket for rolling-window metrics."""
         return int(datetime.now().timestamp() // 60)
 
-    def _increment_metric(self, metric_group, metric_name):
-        """Increment day, all-time, and minute-bucket counters atomically."""
-        if metric_name is None:
-            return
+    def day_key(self, today):
+        """Return the hash holding every metric counter for one day."""
+        return f"{today}:metrics"
 
-        # gather necessary key info
-        today = self._get_today()
-        minute_bucket = self._get_minute_bucket()
-        minute_key = f"minute:{minute_bucket}:{metric_group}:{metric_name}"
-
-        # set up pipeline to reduce network travelling
-        pipe = self.client.pipeline()
-        pipe.incr(f"{today}:{metric_group}:{metric_name}")  # day level metrics
-        pipe.incr(
-            f"all:{metric_group}:{metric_name}"
-        )  # all time metrics, not necesary with limited local storage atm
-        pipe.incr(minute_key)  # rolling window metrics via minute key
-        pipe.expire(minute_key, self.minute_ttl_seconds)  # set expiration for rolling window metrics
-        pipe.execute()
-
-    def _increment_top_user(self, username):
-        """Increment top-user sorted sets for minute/day/all scopes."""
-        if not username:
-            return
+    def minute_key(self, minute_bucket):
+        """Return the hash holding every metric counter for one minute bucket."""
+        return f"minute:{minute_bucket}"
+
+    def hll_key(self, minute_bucket, kind):
+        """Return the HyperLogLog of distinct users/pages/wikis seen in one minute bucket."""
+        return f"hll:minute:{minute_bucket}:{kind}"
+
+    def dedup_key(self, event):
+        """Return the set of ids seen for the event's own minute, or None if it can't be deduplicated."""
+        # keyed by the event timestamp (not arrival time) so a replay lands in the same set
+        if not self.dedup_seconds or not event.id or not event.dt:
+            return None
+        return f"dedup:{event.dt[:16]}"
+
+    def checkpoint_key(self, stream):
+        """Return the key holding the last fully processed SSE event id for a stream."""
+        return f"stream:{stream}:last_event_id"
+
+    def load_checkpoint(self, stream):
+        """Return the persisted last event id for a stream, or None."""
+        try:
+            return self.client.get(self.checkpoint_key(stream))
+        except Exception as e:
+            print(f"error loading stream checkpoint: {e}")
+            return None
+
+    def save_checkpoint(self, stream, event_id):
+        """Persist the last fully processed SSE event id for a stream."""
+        if event_id is None:
+            return True
+        try:
+            self.client.set(self.checkpoint_key(stream), event_id)
+        except Exception as e:
+            print(f"error saving stream checkpoint: {e}")
+            return False
+        return True
+
+    def ingest_watermark_key(self):
+        """Return the key holding the generation of postgres data that cached query results belong to."""
+        return "analytics:ingest_watermark"
+
+    def publish_ingest_watermark(self):
+        """Bump the ingest watermark after postgres gained or lost rows, so cached query results go stale."""
+        try:
+            self.client.incr(self.ingest_watermark_key())
+        except Exception as e:
+            print(f"error publishing ingest watermark: {e}")
+            return False
+        return True
 
+    def _drop_duplicates(self, events):
+        """Return the events whose ids aren't in their dedup set yet, and the (key, id) marks to add.
+
+        The check is read-only; the marks are written in the same transaction as the counters,
+        so a batch that fails is not remembered as seen and can be retried (e.g. from the spool).
+        """
+        keyed = [(event, self.dedup_key(event)) for event in events]
+        checked = [(event, key) for event, key in keyed if key]
+        if not checked:
+            return events, []
+
+        # one round trip for the whole batch
+        pipe = self.client.pipeline(transaction=False)
+        for event, key in checked:
+            pipe.sismember(key, event.id)
+        seen = pipe.execute()
+
+        marks = {}
+        duplicate_ids = set()
+        for (event, key), already in zip(checked, seen):
+            # a replay, or the same id twice within this batch
+            if already or (key, event.id) in marks:
+                duplicate_ids.add(id(event))
+            else:
+                marks[(key, event.id)] = True
+
+        self.duplicates += len(duplicate_ids)
+        DUPLICATE_EVENTS.inc(len(duplicate_ids))
+        return [event for event in events if id(event) not in duplicate_ids], list(marks)
+
+    def rollup_key(self, window_minutes):
+        """Return the hash holding running totals for one rolling window."""
+        return f"rollup:{window_minutes}m"
+
+    def _event_metrics(self, event):
+        """Return the (metric_group, metric_name) counters one WikiEvent contributes to."""
+        event_type = event.type
+
+        # events and type counters
+        metrics = [("events", "total"), ("type", event_type)]
+
+        # namespace counter
+        namespace = event.namespace
+        if namespace is not None:
+            metrics.append(("namespace", str(namespace)))
+
+        # log type counter
+        if event_type == "log" and event.log_type:
+            metrics.append(("log_type", event.log_type))
+
+        # edit events include additional bot/human and minor/major slices
+        if event_type == "edit":
+            if event.bot is True:
+                metrics.append(("edits", "bot"))
+            elif event.bot is False:
+                metrics.append(("edits", "human"))
+
+            if event.minor is True:
+                metrics.append(("edits", "minor"))
+            elif event.minor is False:
+                metrics.append(("edits", "major"))
+
+        # patrolled counter
+        if event.bot is True:
+            if event.patrolled is True:
+                metrics.append(("patrolled", "patrolled_bot"))
+            elif event.patrolled is False:
+                metrics.append(("patrolled", "unpatrolled_bot"))
+
+        return metrics
+
+    def _expire_once(self, pipe, key, ttl, minute_bucket, pending):
+        """Queue an EXPIRE for a minute-bucket key only the first time it is touched."""
+        # the set of already-expired keys only needs to cover the current minute
+        if minute_bucket != self.expired_minute:
+            self.expired_minute = minute_bucket
+            self.expired_keys = set()
+
+        if key not in self.expired_keys and key not in pending:
+            pipe.expire(key, ttl)
+            pending.add(key)
+
+    def _queue_updates(self, pipe, metric_counts, user_counts, distinct):
+        """Queue coalesced day, all-time, and minute-bucket updates onto one pipeline."""
         # gather necessary key info
-        today = self._get_today()
-        minute_bucket = self._get_minute_bucket()
-        minute_key = f"top_users:minute:{minute_bucket}"
+        today = self.get_today()
+        minute_bucket = self.get_minute_bucket()
+        pending_expires = set()
+
+        minute_key = self.minute_key(minute_bucket)
+        for (metric_group, metric_name), count in metric_counts.items():
+            metric = f"{metric_group}:{metric_name}"
+            pipe.hincrby(self.day_key(today), metric, count)  # day level metrics
+            pipe.hincrby(self.ALL_KEY, metric, count)  # all time metrics
+            pipe.hincrby(minute_key, metric, count)  # rolling window metrics via minute hash
+            for window in self.rollup_windows:
+                pipe.hincrby(self.rollup_key(window), metric, count)  # running rolling-window totals
+        if metric_counts:
+            self._expire_once(pipe, minute_key, self.minute_ttl_seconds, minute_bucket, pending_expires)
 
-        # set up pipeline to reduce network travelling
-        pipe = self.client.pipeline()
-        pipe.zincrby(f"{today}:top_users", 1, username)  # day level metrics
-        pipe.zincrby("all:top_users", 1, username)  # all time metrics
-        pipe.zincrby(minute_key, 1, username)  # rolling window metrics via minute key
-        pipe.expire(minute_key, self.top_users_minute_ttl_seconds)  # set expiration for rolling window metrics
-        pipe.execute()
+        minute_key = f"top_users:minute:{minute_bucket}"
+        for username, count in user_counts.items():
+            pipe.zincrby(f"{today}:top_users", count, username)  # day level metrics
+            pipe.zincrby("all:top_users", count, username)  # all time metrics
+            pipe.zincrby(minute_key, count, username)  # rolling window metrics via minute key
+        if user_counts:
+            self._expire_once(pipe, minute_key, self.top_users_minute_ttl_seconds, minute_bucket, pending_expires)
+
+        # distinct users/pages/wikis per minute in constant memory
+        for kind, values in distinct.items():
+            if values:
+                hll_key = self.hll_key(minute_bucket, kind)
+                pipe.pfadd(hll_key, *values)
+                self._expire_once(pipe, hll_key, self.minute_ttl_seconds, minute_bucket, pending_expires)
+
+        return pending_expires
 
     def connect(self):
-        """Create and validate Redis connection."""
+        """Create and validate Redis connection; return False if the server can't be reached.
+
+        The client is kept either way and reconnects on its own once Redis is back.
+        """
         try:
             self.client = redis.Redis(
-                host=self.host, port=self.port, username=self.user, password=self.password, decode_responses=True
+                host=self.host,
+                port=self.port,
+                username=self.user,
+                password=self.password,
+                db=self.db,
+                decode_responses=True,
             )
             self.client.ping()  # sanity check
+            return True
         except redis.ConnectionError as e:
             print(f"redis connection error: {e}")
-            exit(1)
+            return False
+
+    def register_scripts(self):
+        """Load the server-side scripts and remember their SHAs for EVALSHA calls."""
+        self.script_shas = {
+            "event": self.client.script_load(EVENT_SCRIPT),
+            "rollover": self.client.script_load(ROLLOVER_SCRIPT),
+            "top_users_trim": self.client.script_load(TOP_USERS_TRIM_SCRIPT),
+            "top_users_window": self.client.script_load(TOP_USERS_WINDOW_SCRIPT),
+        }
 
-    def process_event(self, json_data):
-        """Update Redis analytics counters for one Wikimedia event."""
+    def _eval_script(self, name, keys, *args):
+        """Run a registered script by SHA on the keys it touches, reloading the scripts on NOSCRIPT."""
+        if name not in self.script_shas:
+            self.register_scripts()
 
         try:
-            # should not happen, but just in case
-            event_type = json_data.get("type")
-            if event_type is None:
+            return self.client.evalsha(self.script_shas[name], len(keys), *keys, *args)
+        except redis.exceptions.NoScriptError:
+            # script cache was flushed or the server restarted; load it again and retry once
+            self.register_scripts()
+            return self.client.evalsha(self.script_shas[name], len(keys), *keys, *args)
+
+    def _event_tuple(self, event):
+        """Encode the fields EVENT_SCRIPT needs as a compact tuple of strings."""
+
+        def flag(value):
+            return "1" if value is True else "0" if value is False else ""
+
+        namespace = event.namespace
+        return (
+            event.type or "",
+            "" if namespace is None else str(namespace),
+            event.log_type or "",
+            event.user or "",
+            flag(event.bot),
+            flag(event.minor),
+            flag(event.patrolled),
+            event.wiki or "",
+            event.title or "",
+            self.dedup_key(event) or "",
+            event.id or "",
+        )
+
+    def _process_events_lua(self, events):
+        """Apply a batch of events with one EVALSHA call, reloading the script on NOSCRIPT."""
+        today = self.get_today()
+        minute = self.get_minute_bucket()
+        keys = [
+            self.day_key(today),
+            self.ALL_KEY,
+            self.minute_key(minute),
+            f"{today}:top_users",
+            "all:top_users",
+            f"top_users:minute:{minute}",
+            *(self.hll_key(minute, kind) for kind in ("users", "pages", "wikis")),
+            *(self.rollup_key(window) for window in self.rollup_windows),
+        ]
+        args = [
+            self.minute_ttl_seconds,
+            self.top_users_minute_ttl_seconds,
+            len(self.rollup_windows),
+            self.dedup_seconds,
+        ]
+        # each dedup set is declared once; events refer to it by its (1-based) KEYS index
+        dedup_indexes = {}
+        for event in events:
+            fields = list(self._event_tuple(event))
+            dedup_key = fields[9]
+            if dedup_key:
+                if dedup_key not in dedup_indexes:
+                    keys.append(dedup_key)
+                    dedup_indexes[dedup_key] = len(keys)
+                fields[9] = str(dedup_indexes[dedup_key])
+            args.extend(fields)
+
+        # replays count as handled, they were applied when first seen
+        applied, duplicates = self._eval_script("event", keys, *args)
+        self.duplicates += duplicates
+        DUPLICATE_EVENTS.inc(duplicates)
+        return applied + duplicates
+
+    def roll_windows(self):
+        """Slide rolling-window totals forward and trim closed top-user minute sets."""
+        try:
+            current_minute = self.get_minute_bucket()
+            for window in self.rollup_windows:
+                rollup_key = self.rollup_key(window)
+                minutes = range(current_minute - 2 * window + 1, current_minute + 1)
+                keys = [rollup_key, f"{rollup_key}:rolled", *(self.minute_key(minute) for minute in minutes)]
+                self._eval_script("rollover", keys, window, current_minute)
+
+            # trimming only needs to reach back as far as a minute set can live
+            lookback_minutes = self.top_users_minute_ttl_seconds // 60
+            keys = ["top_users:trimmed"]
+            for minute in range(current_minute - lookback_minutes, current_minute):
+                keys.extend((f"top_users:minute:{minute}", f"top_users:floor:{minute}"))
+            self._eval_script(
+                "top_users_trim",
+                keys,
+                current_minute,
+                self.top_users_capacity,
+                current_minute - lookback_minutes,
+                self.top_users_minute_ttl_seconds,
+            )
+        except Exception as e:
+            print(f"error rolling over window totals: {e}")
+            return False
+
+        return True
+
+    def process_event(self, event):
+        """Update Redis analytics counters for one WikiEvent."""
+        return self.process_events([event])
+
+    def _unavailable(self, events, error):
+        """Pass a batch that failed on a connection error to on_drop; other failures are dropped."""
+        if self.on_drop is not None and isinstance(error, (redis.ConnectionError, redis.TimeoutError)):
+            self.on_drop(events)
+
+    def process_events(self, events):
+        """Update Redis analytics counters for a batch of WikiEvents in one round trip."""
+        start = time.perf_counter()
+        if self.write_mode == "lua":
+            try:
+                handled = self._process_events_lua(events)
+            except Exception as e:
+                print(f"error processing JSON: {e}")
+                FAILED_BATCHES.inc()
+                self._unavailable(events, e)
                 return False
+            WRITE_SECONDS.labels("lua").observe(time.perf_counter() - start)
+            return handled == len(events)
 
-            # events and type counters
-            self._increment_metric("events", "total")
-            self._increment_metric("type", event_type)
-
-            # namespace counter
-            namespace = json_data.get("namespace")
-            if namespace is not None:
-                self._increment_metric("namespace", str(namespace))
-
-            # log type counter
-            if event_type == "log" and json_data.get("log_type"):
-                self._increment_metric("log_type", json_data.get("log_type"))
-
-            # user counter (for top users)
-            self._increment_top_user(json_data.get("user"))
-
-            # edit events include additional bot/human and minor/major slices
-            if event_type == "edit":
-                if json_data.get("bot") is True:
-                    self._increment_metric("edits", "bot")
-                elif json_data.get("bot") is False:
-                    self._increment_metric("edits", "human")
-
-                if json_data.get("minor") is True:
-                    self._increment_metric("edits", "minor")
-                elif json_data.get("minor") is False:
-                    self._increment_metric("edits", "major")
-
-            # patrolled counter
-            if json_data.get("bot") is True:
-                if json_data.get("patrolled") is True:
-                    self._increment_metric("patrolled", "patrolled_bot")
-                elif json_data.get("patrolled") is False:
-                    self._increment_metric("patrolled", "unpatrolled_bot")
+        metric_counts = Counter()
+        user_counts = Counter()
+        distinct = {"users": set(), "pages": set(), "wikis": set()}
+        skipped = 0
+
+        try:
+            fresh, marks = self._drop_duplicates(events)
+            for event in fresh:
+                # should not happen, but just in case
+                if event.type is None:
+                    skipped += 1
+                    continue
+
+                # same-key increments across the batch collapse into one INCRBY/ZINCRBY
+                metric_counts.update(self._event_metrics(event))
+
+                # user counter (for top users)
+                username = event.user
+                if username:
+                    user_counts[username] += 1
+                    distinct["users"].add(username)
+
+                # pages are only unique within a wiki
+                wiki = event.wiki
+                if wiki:
+                    distinct["wikis"].add(wiki)
+                    if event.title:
+                        distinct["pages"].add(f"{wiki}:{event.title}")
+
+            if metric_counts:
+                # set up one pipeline per batch to reduce network travelling
+                pipe = self.client.pipeline()
+                pending_expires = self._queue_updates(pipe, metric_counts, user_counts, distinct)
+                for key, event_id in marks:
+                    pipe.sadd(key, event_id)
+                # a minute's set stops being written once the minute passes, so refreshing the ttl is harmless
+                for key in {key for key, _ in marks}:
+                    pipe.expire(key, self.dedup_seconds)
+                pipe.execute()
+                self.expired_keys.update(pending_expires)
 
         except Exception as e:
             print(f"error processing JSON: {e}")
+            FAILED_BATCHES.inc()
+            self._unavailable(events, e)
             return False
 
-        return True
+        WRITE_SECONDS.labels("pipeline").observe(time.perf_counter() - start)
+        return skipped == 0
 
     def print_metrics(self, option):
         """Print metrics for today, rolling windows (5m/1h), or all-time."""
@@ -144,36 +723,6 @@ class RedisManager:
             for key in sorted(aggregates.keys()):
                 print(f"{key}: {aggregates[key]}")
 
-        # sum minute-bucket keys over the requested rolling window
-        def aggregate_window(window_minutes):
-            aggregates = {}
-            current_minute = self._get_minute_bucket()
-
-            # iterate over the minutes in the window via the 'window_minutes' parameter
-            for minute in range(current_minute - window_minutes + 1, current_minute + 1):
-                minute_keys = self.client.keys(f"minute:{minute}:*:*")
-                for key in minute_keys:
-                    # parse the key to get the metric group and name
-                    _, _, metric_group, metric_name = key.split(":", 3)
-                    agg_key = f"{metric_group}:{metric_name}"
-                    aggregates[agg_key] = aggregates.get(agg_key, 0) + int(self.client.get(key) or 0)
-
-            return aggregates
-
-        # sum top_users keys over the requested rolling window
-        def aggregate_top_users_window(window_minutes):
-            top_users = {}
-            current_minute = self._get_minute_bucket()
-
-            # iterate over the minutes in the window via the 'window_minutes' parameter
-            for minute in range(current_minute - window_minutes + 1, current_minute + 1):
-                key = f"top_users:minute:{minute}"
-                for user, score in self.client.zrevrange(key, 0, -1, withscores=True):
-                    top_users[user] = top_users.get(user, 0) + int(score)
-
-            # sort the items returned from zrevrange by score in descending order via lambda
-            return sorted(top_users.items(), key=lambda x: x[1], reverse=True)[:10]
-
         # print top users entries
         def print_top_users(entries, title):
             print(f"\n=== {title} ===")
@@ -184,53 +733,40 @@ class RedisManager:
                 print(f"{user}: {int(score)}")
 
         if self.client:
+            # same aggregation code the dashboard uses: fixed pipelined reads, no KEYS scans
+            analytics = RedisAnalytics(self)
+
             # depending on option parameter, print the appropriate data for that time frame
             if option == "today":
                 # gather aggregates for today and print them
-                aggregates = {}
-                today = self._get_today()
-                today_keys = self.client.keys(f"{today}:*:*")
-                for key in today_keys:
-                    _, metric_group, metric_name = key.split(":", 2)
-                    aggregates[f"{metric_group}:{metric_name}"] = int(self.client.get(key) or 0)
-
-                print_aggregates(aggregates, "TODAY")
+                print_aggregates(analytics.scope_totals("today"), "TODAY")
 
             elif option == "5m":
                 # gather aggregates for the last 5 minutes and print them, including spike score
-                aggregates = aggregate_window(5)
+                windows = analytics.rolling_totals([5, 60])
+                aggregates = windows[5]
                 print_aggregates(aggregates, "LAST 5 MINUTES")
-                top_users = aggregate_top_users_window(5)
+                top_users = analytics.top_users_window(5)
                 print_top_users(top_users, "TOP USERS (LAST 5 MINUTES)")
-                one_hour_total = aggregate_window(60).get("events:total", 0)
-                five_min_total = aggregates.get("events:total", 0)
-                if one_hour_total > 0:
-                    # if there have been edits in the last hour, calculate the spike score
-                    # baseline is the average number of edits per 5 minute window in the last hour
-                    baseline_five_min = one_hour_total / 12
-
-                    # calculate the spike score as the ratio of edits in the last 5 minutes to the baselin
-                    spike_score = five_min_total / baseline_five_min if baseline_five_min > 0 else 0
+                print_aggregates(analytics.distinct_counts([5])[5], "DISTINCT (LAST 5 MINUTES)")
+                if windows[60].get("events:total", 0) > 0:
+                    # if there have been edits in the last hour, print the spike score
+                    spike_score = analytics.spike_score(aggregates, windows[60])
                     print(f"\nspike_score_5m_vs_1h_baseline: {spike_score:.2f}x\n")
 
             # print 1 hour aggregates
             elif option == "1h":
-                aggregates = aggregate_window(60)
+                aggregates = analytics.rolling_totals([60])[60]
                 print_aggregates(aggregates, "LAST 1 HOUR")
-                top_users = aggregate_top_users_window(60)
+                top_users = analytics.top_users_window(60)
                 print_top_users(top_users, "TOP USERS (LAST 1 HOUR)")
+                print_aggregates(analytics.distinct_counts([60])[60], "DISTINCT (LAST 1 HOUR)")
 
             # print all time aggregates (again, not enough storage to go multiple days with local setup)
             elif option == "all":
-                aggregates = {}
-                all_keys = self.client.keys("all:*:*")
-                for key in all_keys:
-                    _, metric_group, metric_name = key.split(":", 2)
-                    aggregates[f"{metric_group}:{metric_name}"] = int(self.client.get(key) or 0)
-
-                print_aggregates(aggregates, "ALL TIME")
+                print_aggregates(analytics.scope_totals("all"), "ALL TIME")
 
-                top_users = self.client.zrevrange("all:top_users", 0, 9, withscores=True)
+                top_users = analytics.top_users_scope("all")
                 print_top_users(top_users, "TOP USERS (ALL TIME)")
 
             else:
@@ -240,10 +776,69 @@ class RedisManager:
             print("error: not connected to redis db")
 
     # for utility purposes
+    def _legacy_hash_key(self, key):
+        """Map a legacy <scope>:<group>:<name> string key to its (hash key, field), or None."""
+        parts = key.split(":", 3)
+        if parts[0] == "minute" and len(parts) == 4:
+            return self.minute_key(parts[1]), f"{parts[2]}:{parts[3]}"
+        if parts[0] == "all" and len(parts) == 3:
+            return self.ALL_KEY, f"{parts[1]}:{parts[2]}"
+        if re.fullmatch(r"\d{2}-\d{2}-\d{4}", parts[0]) and len(parts) == 3:
+            return self.day_key(parts[0]), f"{parts[1]}:{parts[2]}"
+        return None
+
+    def migrate_legacy_keys(self, batch_size=1000):
+        """Fold legacy per-metric string counters (minute/day/all) into their scope hashes."""
+        try:
+            if not self.connect():
+                exit(1)
+            migrated = 0
+            batch = []
+
+            def migrate_batch(keys):
+                # read values and remaining ttls for the whole batch in one round trip
+                pipe = self.client.pipeline()
+                for key, _, _ in keys:
+                    pipe.get(key)
+                    pipe.ttl(key)
+                results = pipe.execute()
+
+                pipe = self.client.pipeline()
+                for (key, hash_key, field), raw_val, ttl in zip(keys, results[::2], results[1::2]):
+                    pipe.hincrby(hash_key, field, int(raw_val or 0))
+                    # only minute counters expire; day and all-time counters never did
+                    if ttl > 0:
+                        pipe.expire(hash_key, ttl)
+                    pipe.delete(key)
+                pipe.execute()
+
+            # every legacy counter is a plain string key with at least 3 colon-separated parts
+            for key in self.client.scan_iter(match="*:*:*", count=batch_size, _type="string"):
+                target = self._legacy_hash_key(key)
+                if target is None:
+                    continue
+
+                batch.append((key, *target))
+                if len(batch) >= batch_size:
+                    migrate_batch(batch)
+                    migrated += len(batch)
+                    batch = []
+            if batch:
+                migrate_batch(batch)
+                migrated += len(batch)
+
+            print(f"migrated {migrated} legacy counter keys into scope hashes")
+            self.client.close()
+        except Exception as e:
+            print(f"error migrating legacy keys: {e}")
+            self.client.close()
+            exit(1)
+
     def flush_db(self):
         """Delete all Redis keys in the current Redis database."""
         try:
-            self.connect()
+            if not self.connect():
+                exit(1)
             self.client.flushdb()
             print("redis db flushed successfully")
 
@@ -0,0 +1,279 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+from pipeline import HEADERS, STREAM_URI, publish, wiki_connect
+from sse import SSEEvent, SSEParser
+
+"""
+Offline event sources for the ingestion pipeline.
+
+Replays recorded captures (raw SSE bytes as written by `record`, or JSON lines)
+and generates synthetic recentchange events, feeding them through the same
+SSE parse -> decode -> Redis/Postgres path as the live stream. Pacing follows
+each event's meta.dt scaled by a speed factor: 1 is real time, 10 is ten times
+faster, 0 is as fast as the sinks take them.
+
+    python src/replay.py record capture.sse --seconds 300
+    python src/replay.py replay capture.sse --speed 10
+    python src/replay.py synthetic --rate 2000 --seconds 60 --speed 0 --burst 20:10:5
+"""
+
+
+class Pacer:
+    """Holds events back until their (scaled) timestamp, optionally retiming and re-keying them."""
+
+    def __init__(self, speed=1.0, retime=False, id_suffix=None):
+        """speed <= 0 disables waiting; retime stamps each event's dt with the wall-clock time it is released.
+
+        Retimed events keep their spacing scaled by speed (unpaced ones simply get "now"), so a
+        sped-up or unpaced run never writes timestamps ahead of the clock.
+        """
+        self.speed = speed
+        self.retime = retime
+        self.id_suffix = id_suffix
+        self.first_dt = None
+        self.started = None
+        self.started_at = None
+        self.count = 0
+
+    async def __call__(self, event):
+        self.count += 1
+        try:
+            event_dt = datetime.fromisoformat(event.dt)
+        except (TypeError, ValueError):
+            event_dt = None
+
+        if event_dt is not None:
+            if self.first_dt is None:
+                self.first_dt = event_dt
+                self.started = time.monotonic()
+                self.started_at = datetime.now(timezone.utc)
+
+            offset = (event_dt - self.first_dt).total_seconds()
+            if self.speed > 0:
+                due = self.started + offset / self.speed
+                delay = due - time.monotonic()
+                if delay > 0.001:
+                    await asyncio.sleep(delay)
+
+            if self.retime and self.speed > 0:
+                event.dt = (self.started_at + timedelta(seconds=offset / self.speed)).isoformat()
+            elif self.retime:
+                event.dt = datetime.now(timezone.utc).isoformat()
+
+        # a replayed capture keeps its ids unless told otherwise, so redis dedup would skip a rerun
+        if self.id_suffix and event.id:
+            event.id = f"{event.id}-{self.id_suffix}"
+
+        # unpaced runs still let the sink workers in now and then
+        if self.speed <= 0 and self.count % 256 == 0:
+            await asyncio.sleep(0)
+
+
+def read_capture(path, chunk_size=65536):
+    """Yield SSEEvents from a raw SSE capture or a JSON-lines file."""
+    with open(path, "rb") as f:
+        first = f.read(1)
+        f.seek(0)
+
+        if first == b"{":
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield SSEEvent(None, "message", line)
+            return
+
+        parser = SSEParser()
+        while chunk := f.read(chunk_size):
+            yield from parser.feed(chunk)
+
+
+def synthetic_events(count=None, rate=50.0, bot_ratio=0.3, user_skew=1.2, users=5000, bursts=(), seed=7, start=None):
+    """Yield SSE frames of recentchange-shaped events at rate events/sec of event time.
+
+    user_skew is the Pareto shape of edits per user (lower is more skewed), bursts are
+    (offset seconds, duration seconds, rate multiplier) tuples. The same seed gives the same
+    sequence; only the start time and the run-unique id prefix differ between runs.
+    """
+    rng = random.Random(seed)
+    start = start or datetime.now(timezone.utc)
+    run = uuid.uuid4().hex[:8]
+    elapsed = 0.0
+    i = 0
+
+    while count is None or i < count:
+        multiplier = 1.0
+        for burst_start, burst_seconds, burst_multiplier in bursts:
+            if burst_start <= elapsed < burst_start + burst_seconds:
+                multiplier = burst_multiplier
+        # poisson arrivals at the current rate
+        elapsed += rng.expovariate(rate * multiplier)
+
+        event_type = rng.choice(["edit", "edit", "edit", "categorize", "log", "new"])
+        wiki = rng.choice(["enwiki", "dewiki", "wikidatawiki", "commonswiki", "frwiki"])
+        title = f"Page {rng.randint(0, 50000)}"
+        comment = "/* wbsetclaim-update:2||1 */ [[Property:P%d]]: %s" % (rng.randint(1, 9000), "x" * rng.randint(0, 300))
+        dt = start + timedelta(seconds=elapsed)
+        payload = {
+            "$schema": "/mediawiki/recentchange/1.0.0",
+            "meta": {
+                "uri": f"https://{wiki}.org/wiki/{title.replace(' ', '_')}",
+                "request_id": f"{rng.getrandbits(64):016x}",
+                "id": f"syn-{run}-{i}",
+                "dt": dt.isoformat(),
+                "domain": f"{wiki}.org",
+                "stream": "mediawiki.recentchange",
+                "topic": "eqiad.mediawiki.recentchange",
+                "partition": 0,
+                "offset": 5000000000 + i,
+            },
+            "id": 1800000000 + i,
+            "type": event_type,
+            "namespace": rng.choice([0, 0, 0, 1, 2, 4, 6, 14]),
+            "title": title,
+            "title_url": f"https://{wiki}.org/wiki/{title.replace(' ', '_')}",
+            "comment": comment,
+            "timestamp": int(dt.timestamp()),
+            "user": f"user{int(rng.paretovariate(user_skew)) % users}",
+            "bot": rng.random() < bot_ratio,
+            "notify_url": f"https://{wiki}.org/w/index.php?diff={i}",
+            "server_url": f"https://{wiki}.org",
+            "server_name": f"{wiki}.org",
+            "server_script_path": "/w",
+            "wiki": wiki,
+            "parsedcomment": f'<span dir="auto"><span class="autocomment">{comment}</span></span>',
+        }
+        if event_type == "edit":
+            old = rng.randint(0, 200000)
+            payload.update(
+                minor=rng.random() < 0.4,
+                patrolled=rng.random() < 0.6,
+                length={"old": old, "new": old + rng.randint(-500, 2000)},
+                revision={"old": 2000000000 + i, "new": 2000000001 + i},
+            )
+        elif event_type == "new":
+            payload.update(minor=False, patrolled=False, length={"new": rng.randint(10, 5000)})
+        elif event_type == "log":
+            payload.update(
+                log_id=300000000 + i,
+                log_type=rng.choice(["upload", "block", "delete", "newusers"]),
+                log_action="create",
+                log_params={"img_sha1": f"{rng.getrandbits(160):040x}", "img_timestamp": "20260101000000"},
+                log_action_comment=comment,
+            )
+
+        event_id = json.dumps([{"topic": "eqiad.mediawiki.recentchange", "partition": 0, "offset": 5000000000 + i}])
+        yield SSEEvent(event_id, "message", json.dumps(payload).encode())
+        i += 1
+
+
+def synthetic_payloads(count, seed=7):
+    """Return count synthetic events as SSE `data: ...` lines (fixed start time, for benchmarks)."""
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    return [b"data: " + frame.data for frame in synthetic_events(count, seed=seed, start=start)]
+
+
+def event_source(sse_events, pacer):
+    """Wrap an iterable of SSEEvents as a wiki_connect source."""
+
+    async def source(queues, deadline, checkpoint):
+        for sse_event in sse_events:
+            if time.monotonic() >= deadline:
+                break
+            await publish(sse_event, queues, checkpoint, pace=pacer)
+
+    return source
+
+
+async def record(path, seconds, stream="recentchange"):
+    """Append the raw SSE bytes of the live stream to path for seconds."""
+    deadline = time.monotonic() + seconds
+    written = 0
+    async with aiohttp.ClientSession(headers=HEADERS) as session:
+        async with session.get(STREAM_URI.format(stream=stream)) as resp:
+            resp.raise_for_status()
+            with open(path, "ab") as f:
+                async for chunk in resp.content.iter_any():
+                    f.write(chunk)
+                    written += len(chunk)
+                    if time.monotonic() >= deadline:
+                        break
+    print(f"recorded {written} bytes of {stream} to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="replay or generate events through the ingestion pipeline")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="capture the live stream to a file")
+    record_parser.add_argument("path")
+    record_parser.add_argument("--seconds", type=float, default=300)
+    record_parser.add_argument("--stream", default="recentchange")
+
+    replay_parser = commands.add_parser("replay", help="replay a recorded SSE or JSON-lines capture")
+    replay_parser.add_argument("path")
+    replay_parser.add_argument("--no-retime", action="store_true", help="keep the recorded timestamps")
+    replay_parser.add_argument("--fresh-ids", action="store_true", help="suffix event ids so reruns are not deduplicated")
+
+    synthetic_parser = commands.add_parser("synthetic", help="generate recentchange-shaped events")
+    synthetic_parser.add_argument("--count", type=int, default=None, help="stop after this many events")
+    synthetic_parser.add_argument("--rate", type=float, default=50.0, help="events per second of event time")
+    synthetic_parser.add_argument("--bot-ratio", type=float, default=0.3)
+    synthetic_parser.add_argument("--user-skew", type=float, default=1.2, help="pareto shape, lower is more skewed")
+    synthetic_parser.add_argument("--users", type=int, default=5000)
+    synthetic_parser.add_argument("--burst", action="append", default=[], help="offset:duration:multiplier, repeatable")
+    synthetic_parser.add_argument("--seed", type=int, default=7)
+
+    for sub in (replay_parser, synthetic_parser):
+        sub.add_argument("--speed", type=float, default=1.0, help="1 = real time, N = N times faster, 0 = unpaced")
+        sub.add_argument("--seconds", type=float, default=3600, help="stop after this long")
+        sub.add_argument("--retention-hours", type=int, default=6)
+        sub.add_argument("--redis-write-mode", default="pipeline")
+        sub.add_argument("--batch-size", type=int, default=500)
+        sub.add_argument("--queue-size", type=int, default=10000)
+        sub.add_argument("--metrics-port", type=int, default=None, help="serve prometheus metrics on this port")
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        asyncio.run(record(args.path, args.seconds, args.stream))
+        return
+
+    if args.command == "replay":
+        pacer = Pacer(args.speed, retime=not args.no_retime, id_suffix=uuid.uuid4().hex[:8] if args.fresh_ids else None)
+        source = event_source(read_capture(args.path), pacer)
+    else:
+        bursts = [tuple(float(part) for part in burst.split(":")) for burst in args.burst]
+        events = synthetic_events(
+            args.count, args.rate, args.bot_ratio, args.user_skew, args.users, bursts, args.seed
+        )
+        # generated event time runs at --rate, ahead of the clock once sped up or unpaced
+        source = event_source(events, Pacer(args.speed, retime=True))
+
+    stats = asyncio.run(
+        wiki_connect(
+            args.seconds,
+            args.retention_hours,
+            psql_batch_size=args.batch_size,
+            sink_batch_size=args.batch_size,
+            queue_size=args.queue_size,
+            redis_write_mode=args.redis_write_mode,
+            # keep replay checkpoints away from the live stream's resume point
+            stream=f"replay-{args.command}",
+            source=source,
+            metrics_port=args.metrics_port,
+        )
+    )
+    if stats:
+        rate = stats["events"] / stats["seconds"] if stats["seconds"] else 0.0
+        print(f"\n{args.command}: {stats['events']} events in {stats['seconds']:.1f}s ({rate:,.0f} events/sec, read to drained)")
+
+
+if __name__ == "__main__":
+    main()
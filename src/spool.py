@@ -0,0 +1,335 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from metrics import REGISTRY
+from wiki_event import WikiEvent
+
+"""
+Append-only disk spool for events a sink could not take.
+
+Events are framed (length, crc32, write time, JSON payload) and appended to
+numbered segment files that roll at segment_bytes. One reader (the pipeline's
+drainer) reads frames from a persisted read offset and commits past them only
+after the sink has stored them, so a crash replays at most one batch instead of
+losing it; Redis dedup and Postgres ON CONFLICT absorb the replays. The offset
+file is replaced atomically, and torn frames at the end of a segment (a crash
+mid-write) are ignored. Disk use is bounded by max_bytes: past it, the oldest
+segment is dropped and its events counted as lost.
+"""
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SPOOLED_EVENTS = REGISTRY.counter("wiki_spool_written_events_total", "events written to a sink's spool", ("sink",))
+DRAINED_EVENTS = REGISTRY.counter("wiki_spool_drained_events_total", "spooled events stored by their sink", ("sink",))
+LOST_EVENTS = REGISTRY.counter(
+    "wiki_spool_lost_events_total", "undrained events dropped to keep the spool under its size bound", ("sink",)
+)
+PENDING_EVENTS = REGISTRY.gauge("wiki_spool_pending_events", "spooled events not yet drained", ("sink",))
+PENDING_BYTES = REGISTRY.gauge("wiki_spool_pending_bytes", "bytes of spooled events not yet drained", ("sink",))
+LAG_SECONDS = REGISTRY.gauge(
+    "wiki_spool_lag_seconds", "age of the oldest spooled event not yet drained (0 when empty)", ("sink",)
+)
+
+# payload length, crc32 of the payload, unix time it was spooled
+HEADER = struct.Struct("<IId")
+
+
+def encode_event(event):
+    """Serialize a WikiEvent as a compact JSON array in slot order."""
+    values = [getattr(event, slot) for slot in WikiEvent.__slots__]
+    if orjson is not None:
+        return orjson.dumps(values)
+    return json.dumps(values, separators=(",", ":")).encode()
+
+
+def decode_event(payload):
+    """Rebuild a WikiEvent from encode_event output."""
+    values = orjson.loads(payload) if orjson is not None else json.loads(payload)
+    return WikiEvent(*values)
+
+
+class Segment:
+    """One segment file: its sequence number, valid size and undrained record count."""
+
+    __slots__ = ("seq", "path", "size", "records")
+
+    def __init__(self, seq, path, size=0, records=0):
+        self.seq = seq
+        self.path = path
+        self.size = size
+        self.records = records
+
+
+class Spool:
+    """Durable FIFO of WikiEvents for one sink, shared by writer threads and a single drainer."""
+
+    OFFSET_FILE = "read.offset"
+
+    def __init__(
+        self,
+        directory,
+        sink,
+        segment_bytes=64 * 1024 * 1024,
+        max_bytes=1024 * 1024 * 1024,
+        fsync_seconds=1.0,
+        use_mmap=False,
+    ):
+        """Open (or recover) the spool in directory.
+
+        fsync_seconds bounds how much a power loss can take (a process crash loses nothing
+        already appended); use_mmap reads sealed segments through a memory map.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.sink = sink
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_seconds = fsync_seconds
+        self.use_mmap = use_mmap
+        self.lock = threading.Lock()
+        # (segment seq, byte position, records per segment) of the last read, applied by commit()
+        self.read_ahead = None
+        self.last_fsync = time.monotonic()
+
+        self.read_seq, self.read_position = self._load_offset()
+        self.segments = self._recover()
+        self._open_active()
+
+        self.spooled = SPOOLED_EVENTS.labels(sink)
+        self.drained = DRAINED_EVENTS.labels(sink)
+        self.lost = LOST_EVENTS.labels(sink)
+        PENDING_EVENTS.labels(sink).set_function(lambda: self.pending)
+        PENDING_BYTES.labels(sink).set_function(lambda: self.pending_bytes)
+        LAG_SECONDS.labels(sink).set_function(self.lag_seconds)
+
+        if self.pending:
+            print(f"recovered {self.pending} spooled {sink} events from {directory}")
+
+    def _segment_path(self, seq):
+        return os.path.join(self.directory, f"{seq:012d}.spool")
+
+    def _load_offset(self):
+        try:
+            with open(os.path.join(self.directory, self.OFFSET_FILE)) as f:
+                offset = json.load(f)
+            return offset["segment"], offset["position"]
+        except (OSError, ValueError, KeyError):
+            return 0, 0
+
+    def _save_offset(self):
+        """Persist the read offset with write-to-temp + fsync + rename, so it is never half written."""
+        path = os.path.join(self.directory, self.OFFSET_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"segment": self.read_seq, "position": self.read_position}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _scan(self, path, start):
+        """Return (valid end, complete frames) of a segment file from byte start."""
+        records = 0
+        position = start
+        with open(path, "rb") as f:
+            f.seek(start)
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                length, crc, _ = HEADER.unpack(header)
+                payload = f.read(length)
+                # a torn or corrupt frame ends the segment
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                position += HEADER.size + length
+                records += 1
+        return position, records
+
+    def _recover(self):
+        """Index existing segments from the read offset on, deleting ones already drained."""
+        segments = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".spool"):
+                continue
+            seq = int(name[: -len(".spool")])
+            path = os.path.join(self.directory, name)
+            if seq < self.read_seq:
+                os.remove(path)
+                continue
+
+            start = self.read_position if seq == self.read_seq else 0
+            size, records = self._scan(path, start)
+            segments.append(Segment(seq, path, max(size, start), records))
+
+        # the offset points at a segment that no longer exists: start from the oldest one left
+        if segments and segments[0].seq != self.read_seq:
+            self.read_seq, self.read_position = segments[0].seq, 0
+        return segments
+
+    def _open_active(self):
+        """Start a fresh segment to append to (never after a possibly torn tail)."""
+        seq = max([segment.seq for segment in self.segments] + [self.read_seq - 1]) + 1
+        if not self.segments:
+            self.read_seq, self.read_position = seq, 0
+        self.active = Segment(seq, self._segment_path(seq))
+        self.active_file = open(self.active.path, "ab")
+        self.segments.append(self.active)
+
+    @property
+    def pending(self):
+        """Number of spooled events not yet committed by the drainer."""
+        return sum(segment.records for segment in self.segments)
+
+    @property
+    def pending_bytes(self):
+        """Bytes of spooled frames not yet committed by the drainer."""
+        return sum(segment.size for segment in self.segments) - self.read_position
+
+    def lag_seconds(self):
+        """Seconds since the oldest undrained event was spooled, 0 when the spool is empty."""
+        with self.lock:
+            for segment in self.segments:
+                start = self.read_position if segment.seq == self.read_seq else 0
+                if segment.records and start < segment.size:
+                    with open(segment.path, "rb") as f:
+                        f.seek(start)
+                        _, _, written_at = HEADER.unpack(f.read(HEADER.size))
+                    return max(0.0, time.time() - written_at)
+        return 0.0
+
+    def append(self, events):
+        """Append events durably (fsynced at most fsync_seconds later); return True."""
+        if not events:
+            return True
+
+        now = time.time()
+        frames = []
+        for event in events:
+            payload = encode_event(event)
+            frames.append(HEADER.pack(len(payload), zlib.crc32(payload), now))
+            frames.append(payload)
+        data = b"".join(frames)
+
+        with self.lock:
+            self.active_file.write(data)
+            self.active_file.flush()
+            self.active.size += len(data)
+            self.active.records += len(events)
+            self.spooled.inc(len(events))
+
+            if self.active.size >= self.segment_bytes:
+                self._roll()
+            elif time.monotonic() - self.last_fsync >= self.fsync_seconds:
+                os.fsync(self.active_file.fileno())
+                self.last_fsync = time.monotonic()
+            self._enforce_bound()
+        return True
+
+    def _roll(self):
+        """Seal the active segment and start the next one."""
+        os.fsync(self.active_file.fileno())
+        self.active_file.close()
+        self.last_fsync = time.monotonic()
+
+        self.active = Segment(self.active.seq + 1, self._segment_path(self.active.seq + 1))
+        self.active_file = open(self.active.path, "ab")
+        self.segments.append(self.active)
+
+    def _enforce_bound(self):
+        """Drop the oldest sealed segments while the spool is over max_bytes."""
+        while len(self.segments) > 1 and sum(segment.size for segment in self.segments) > self.max_bytes:
+            oldest = self.segments.pop(0)
+            if oldest.records:
+                self.lost.inc(oldest.records)
+                print(f"{self.sink} spool over {self.max_bytes} bytes, dropped {oldest.records} oldest events")
+            os.remove(oldest.path)
+
+            if oldest.seq >= self.read_seq:
+                self.read_seq, self.read_position = self.segments[0].seq, 0
+                # a batch in flight from the dropped segment can no longer be committed
+                self.read_ahead = None
+                self._save_offset()
+
+    def _read_segment(self, segment, start, max_records, events):
+        """Decode frames from one segment starting at start; return the position after the last one read."""
+        position = start
+        with open(segment.path, "rb") as f:
+            # sealed segments no longer change size, so they can be mapped whole
+            if self.use_mmap and segment is not self.active and segment.size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    while len(events) < max_records and position + HEADER.size <= segment.size:
+                        length, _, _ = HEADER.unpack_from(data, position)
+                        events.append(decode_event(data[position + HEADER.size : position + HEADER.size + length]))
+                        position += HEADER.size + length
+                return position
+
+            f.seek(start)
+            while len(events) < max_records and position + HEADER.size <= segment.size:
+                length, _, _ = HEADER.unpack(f.read(HEADER.size))
+                events.append(decode_event(f.read(length)))
+                position += HEADER.size + length
+        return position
+
+    def read(self, max_records):
+        """Return up to max_records of the oldest undrained events, without consuming them.
+
+        Call commit() once the sink has stored them; reading again first re-reads the same events.
+        """
+        with self.lock:
+            events = []
+            seq, position = self.read_seq, self.read_position
+            consumed = {}
+
+            for segment in self.segments:
+                if segment.seq < seq or len(events) >= max_records:
+                    continue
+                start = position if segment.seq == seq else 0
+                before = len(events)
+                end = self._read_segment(segment, start, max_records, events)
+                consumed[segment.seq] = len(events) - before
+                seq, position = segment.seq, end
+
+            self.read_ahead = (seq, position, consumed)
+            return events
+
+    def commit(self):
+        """Consume the events returned by the last read(), deleting segments that are fully drained."""
+        with self.lock:
+            if self.read_ahead is None:
+                return
+            seq, position, consumed = self.read_ahead
+            self.read_ahead = None
+
+            drained = 0
+            for segment in list(self.segments):
+                drained += min(segment.records, consumed.get(segment.seq, 0))
+                segment.records -= min(segment.records, consumed.get(segment.seq, 0))
+
+                # a sealed segment read to its end is no longer needed
+                finished = segment.seq < seq or (segment.seq == seq and position >= segment.size)
+                if finished and segment is not self.active:
+                    self.segments.remove(segment)
+                    os.remove(segment.path)
+
+            if self.segments[0].seq > seq:
+                seq, position = self.segments[0].seq, 0
+            self.read_seq, self.read_position = seq, position
+            self._save_offset()
+            self.drained.inc(drained)
+
+    def close(self):
+        """Flush the active segment to disk; an empty one is removed."""
+        with self.lock:
+            os.fsync(self.active_file.fileno())
+            self.active_file.close()
+            if self.active.size == 0 and len(self.segments) > 1:
+                self.segments.remove(self.active)
+                os.remove(self.active.path)
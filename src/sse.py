@@ -0,0 +1,86 @@
+import re
+
+"""
+Incremental Server-Sent Events parser.
+
+Feeds on raw byte chunks as they arrive (chunk boundaries can fall anywhere,
+including inside a CRLF) and yields complete events per the EventSource spec:
+multi-line `data:` fields are joined with newlines, `id:` sets the last event
+id (kept across events until changed), comments and unknown fields are ignored.
+"""
+
+LINE_END = re.compile(rb"\r\n|\r|\n")
+
+
+class SSEEvent:
+    """One dispatched SSE event; data is the raw bytes of its joined data lines."""
+
+    __slots__ = ("id", "event", "data")
+
+    def __init__(self, id, event, data):
+        self.id = id
+        self.event = event
+        self.data = data
+
+    def __repr__(self):
+        return f"SSEEvent(id={self.id!r}, event={self.event!r}, data={self.data[:60]!r})"
+
+
+class SSEParser:
+    """Turn a byte stream into SSEEvents, tracking the last event id for reconnects."""
+
+    def __init__(self, last_event_id=None):
+        """Start with an optional last event id, e.g. the one a previous connection stopped at."""
+        self.buffer = b""
+        self.data = []
+        self.event_type = None
+        self.last_event_id = last_event_id
+        self.retry_ms = None
+        # a chunk ending in \r may be the first half of \r\n
+        self.skip_lf = False
+
+    def feed(self, chunk):
+        """Consume one chunk of bytes and return the events it completed."""
+        if self.skip_lf and chunk.startswith(b"\n"):
+            chunk = chunk[1:]
+        self.skip_lf = False
+
+        buffer = self.buffer + chunk if self.buffer else chunk
+        events = []
+        start = 0
+        for match in LINE_END.finditer(buffer):
+            self._line(buffer[start : match.start()], events)
+            start = match.end()
+        if start and buffer[start - 1 : start] == b"\r" and start == len(buffer):
+            self.skip_lf = True
+
+        self.buffer = buffer[start:]
+        return events
+
+    def _line(self, line, events):
+        """Apply one complete line to the event being built, dispatching on a blank line."""
+        if not line:
+            if self.data:
+                events.append(SSEEvent(self.last_event_id, self.event_type or "message", b"\n".join(self.data)))
+            self.data = []
+            self.event_type = None
+            return
+
+        # comment / heartbeat
+        if line.startswith(b":"):
+            return
+
+        field, sep, value = line.partition(b":")
+        if sep and value.startswith(b" "):
+            value = value[1:]
+
+        if field == b"data":
+            self.data.append(value)
+        elif field == b"id":
+            # ids containing NUL are ignored per spec
+            if b"\0" not in value:
+                self.last_event_id = value.decode(errors="replace")
+        elif field == b"event":
+            self.event_type = value.decode(errors="replace")
+        elif field == b"retry" and value.isdigit():
+            self.retry_ms = int(value)
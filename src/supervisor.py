@@ -0,0 +1,236 @@
+import argparse
+import asyncio
+import multiprocessing
+import queue
+import threading
+import time
+
+from archive_manager import ArchiveManager
+from psql_manager import PSQLManager
+
+"""
+Multi-process ingestion supervisor.
+
+Runs one pipeline process per (stream, shard) pair: every stream in --streams
+gets --workers processes, each reading the whole stream but keeping only its
+shard (by wiki or by a hash of meta.id), with its own Redis/PostgreSQL
+connections and its own resume checkpoint. Worker 0 alone handles partition
+maintenance. Workers that exit before the run window ends are restarted with
+backoff, and their throughput is combined into one progress line and one final
+summary.
+
+    python src/supervisor.py --workers 4 --shard-by id
+    python src/supervisor.py --streams recentchange page-create revision-score
+"""
+
+
+def worker_main(index, options, run_seconds, events_read, results):
+    """Process entry point: run one pipeline and report its final stats."""
+    # imported here so each spawned process builds its own clients and metrics registry
+    import pipeline
+
+    # mirror the worker's event counter into shared memory for the supervisor's progress line
+    def mirror():
+        while True:
+            events_read.value = pipeline.EVENTS_READ_SERIES.value
+            time.sleep(1.0)
+
+    threading.Thread(target=mirror, daemon=True).start()
+
+    stats = asyncio.run(pipeline.wiki_connect(run_seconds, **options))
+    events_read.value = pipeline.EVENTS_READ_SERIES.value
+    if stats:
+        results.put((index, stats))
+
+
+class Supervisor:
+    """Starts, restarts and summarizes a fixed set of pipeline worker processes."""
+
+    def __init__(self, workers, run_seconds, report_seconds=10.0, max_backoff_seconds=60.0):
+        """workers is a list of (name, wiki_connect keyword options), one per process."""
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = workers
+        self.run_seconds = run_seconds
+        self.report_seconds = report_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.results = self.context.Queue()
+
+        count = len(workers)
+        self.processes = [None] * count
+        self.events_read = [self.context.Value("q", 0, lock=False) for _ in range(count)]
+        # events from earlier (crashed) incarnations of each worker
+        self.events_before_restart = [0] * count
+        self.restarts = [0] * count
+        self.next_start = [0.0] * count
+        self.stats = [[] for _ in range(count)]
+
+    def start(self, index, deadline):
+        """Start (or restart) worker index for whatever is left of the run window."""
+        name, options = self.workers[index]
+        self.events_read[index].value = 0
+        process = self.context.Process(
+            target=worker_main,
+            args=(index, options, max(1.0, deadline - time.monotonic()), self.events_read[index], self.results),
+            name=name,
+        )
+        process.start()
+        self.processes[index] = process
+        print(f"started {name} (pid {process.pid})")
+
+    def events(self, index):
+        return self.events_before_restart[index] + self.events_read[index].value
+
+    def collect_results(self):
+        while True:
+            try:
+                index, stats = self.results.get_nowait()
+            except queue.Empty:
+                return
+            self.stats[index].append(stats)
+
+    def run(self):
+        """Run every worker until the run window ends; return combined stats."""
+        started = time.monotonic()
+        deadline = started + self.run_seconds
+        for index in range(len(self.workers)):
+            self.start(index, deadline)
+
+        last_report = started
+        last_events = 0
+        try:
+            while any(process is not None for process in self.processes):
+                time.sleep(0.5)
+                now = time.monotonic()
+                self.collect_results()
+
+                for index, process in enumerate(self.processes):
+                    if process is None:
+                        # waiting out a restart backoff
+                        if now >= self.next_start[index] and now < deadline - 1.0:
+                            self.start(index, deadline)
+                        continue
+                    if process.is_alive():
+                        continue
+
+                    process.join()
+                    self.processes[index] = None
+                    name = self.workers[index][0]
+                    if process.exitcode == 0 and now >= deadline - 1.0:
+                        continue
+
+                    # crashed or gave up early: restart after a backoff that grows with repeated failures
+                    self.events_before_restart[index] += self.events_read[index].value
+                    self.events_read[index].value = 0
+                    backoff = min(self.max_backoff_seconds, 2.0 * 2 ** self.restarts[index])
+                    self.restarts[index] += 1
+                    self.next_start[index] = now + backoff
+                    print(f"{name} exited with code {process.exitcode}. restarting in {backoff:.0f}s...")
+
+                if now - last_report >= self.report_seconds:
+                    total = sum(self.events(index) for index in range(len(self.workers)))
+                    per_worker = ", ".join(
+                        f"{self.workers[index][0]}={self.events(index)}" for index in range(len(self.workers))
+                    )
+                    rate = (total - last_events) / (now - last_report)
+                    print(f"supervisor: {total} events, {rate:,.0f}/s ({per_worker})")
+                    last_report, last_events = now, total
+
+        except KeyboardInterrupt:
+            print("interrupted. waiting for workers to drain...")
+            for process in self.processes:
+                if process is not None:
+                    process.join(30)
+                    if process.is_alive():
+                        process.terminate()
+
+        self.collect_results()
+        seconds = time.monotonic() - started
+        summary = {
+            "events": sum(self.events(index) for index in range(len(self.workers))),
+            "seconds": seconds,
+            "dropped": {
+                sink: sum(stats["dropped"][sink] for runs in self.stats for stats in runs) for sink in ("redis", "psql")
+            },
+            # the last run of each worker holds what is still on disk
+            "spooled": {
+                sink: sum(runs[-1].get("spooled", {}).get(sink, 0) for runs in self.stats if runs)
+                for sink in ("redis", "psql")
+            },
+            "restarts": sum(self.restarts),
+            "workers": {
+                self.workers[index][0]: {"events": self.events(index), "restarts": self.restarts[index]}
+                for index in range(len(self.workers))
+            },
+        }
+        return summary
+
+
+def build_workers(streams, workers, shard_by, metrics_port=None, **options):
+    """Return (name, wiki_connect options) for every (stream, shard) process."""
+    specs = []
+    for stream in streams:
+        for shard_index in range(workers):
+            name = stream if workers == 1 else f"{stream}-{shard_index}"
+            worker_options = dict(options, stream=stream)
+            if workers > 1:
+                worker_options["shard"] = (shard_index, workers, shard_by)
+            # one process prunes/creates partitions so workers don't race on the DDL
+            worker_options["partition_maintenance"] = not specs
+            if metrics_port is not None:
+                worker_options["metrics_port"] = metrics_port + len(specs)
+            specs.append((name, worker_options))
+    return specs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run sharded / multi-stream ingestion in worker processes")
+    parser.add_argument("--streams", nargs="+", default=["recentchange"], help="EventStreams to ingest")
+    parser.add_argument("--workers", type=int, default=1, help="processes per stream, each keeping one shard")
+    parser.add_argument("--shard-by", choices=["wiki", "id"], default="wiki", help="shard on wiki or meta.id hash")
+    parser.add_argument("--seconds", type=float, default=360)
+    parser.add_argument("--retention-hours", type=int, default=6)
+    parser.add_argument("--redis-write-mode", default="pipeline")
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--metrics-port", type=int, default=None, help="first worker's metrics port, then +1 each")
+    parser.add_argument("--spool-dir", default="spool", help="where events for an unreachable sink wait on disk")
+    parser.add_argument("--archive-dir", default="archive", help="parquet archive for raw events past retention")
+    parser.add_argument("--backpressure", choices=["block", "drop_oldest", "spool"], default="block")
+    args = parser.parse_args()
+
+    # partitions for the current hours exist before any worker writes, so no rows land in the default one
+    maintenance_manager = PSQLManager()
+    maintenance_manager.archive = ArchiveManager(args.archive_dir)
+    if maintenance_manager.connect():
+        # workers retry a failed pass on their own maintenance schedule
+        if not maintenance_manager.prune_old_raw_events(args.retention_hours):
+            print("failed to prune old raw events, workers will retry it")
+        maintenance_manager.conn.close()
+    else:
+        print("postgres unavailable, workers will spool raw events until it is back")
+
+    workers = build_workers(
+        args.streams,
+        args.workers,
+        args.shard_by,
+        args.metrics_port,
+        retention_hours=args.retention_hours,
+        queue_size=args.queue_size,
+        backpressure=args.backpressure,
+        redis_write_mode=args.redis_write_mode,
+        spool_dir=args.spool_dir,
+        archive_dir=args.archive_dir,
+    )
+    summary = Supervisor(workers, args.seconds).run()
+
+    rate = summary["events"] / summary["seconds"] if summary["seconds"] else 0.0
+    print("\n=== SUPERVISOR ===")
+    print(f"events: {summary['events']} in {summary['seconds']:.1f}s ({rate:,.0f}/s)")
+    print(f"restarts: {summary['restarts']}")
+    print(f"dropped: redis={summary['dropped']['redis']}, psql={summary['dropped']['psql']}")
+    print(f"left spooled: redis={summary['spooled']['redis']}, psql={summary['spooled']['psql']}")
+    for name, worker in summary["workers"].items():
+        print(f"{name}: {worker['events']} events, {worker['restarts']} restarts")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,16 @@
 import sys
+from datetime import datetime, timedelta
 from psql_manager import PSQLManager
 from redis_manager import RedisManager
+from redis_analytics import RedisAnalytics
+from psql_analytics import PSQLAnalytics
+from archive_analytics import ArchiveAnalytics
 
 
 # setup and flush utility file
 def main():
     if len(sys.argv) != 2:
-        print("usage: python psql_setup.py [setup|flush]")
+        print("usage: python utilities.py [setup|flush|rollups|migrate|check|explain|archive]")
         return
 
     command = sys.argv[1].lower()
@@ -25,9 +29,71 @@ def main():
         psql_manager = PSQLManager()
         psql_manager.truncate_db()
 
+    elif command == "rollups":
+        print("rebuilding PostgreSQL minute rollups from raw events...")
+        psql_manager = PSQLManager()
+        psql_manager.rebuild_rollups(since_hours=48)
+
+    elif command == "migrate":
+        print("migrating Redis counter keys to scope hashes...")
+        redis_manager = RedisManager()
+        redis_manager.migrate_legacy_keys()
+
+    elif command == "check":
+        print("checking Redis rolling-window rollups against minute buckets...")
+        redis_manager = RedisManager()
+        if not redis_manager.connect():
+            sys.exit(1)
+        redis_analytics = RedisAnalytics(redis_manager)
+        mismatches = redis_analytics.check_rollups()
+        if not mismatches:
+            print("rollups consistent")
+        for window, diff in mismatches.items():
+            for metric, (rollup, expected) in sorted(diff.items()):
+                print(f"{window}m {metric}: rollup={rollup} buckets={expected}")
+        # top-user error bounds need an untrimmed tally, so they are checked by the benchmark's redis suite
+        redis_manager.client.close()
+        sys.exit(1 if mismatches else 0)
+
+    elif command == "explain":
+        print("checking PostgreSQL analytics queries use indexes for their time ranges...")
+        psql_manager = PSQLManager()
+        if not psql_manager.connect():
+            sys.exit(1)
+        # plans over empty tables or stale statistics say nothing about what real data would use
+        cur = psql_manager.conn.cursor()
+        empty = []
+        for table in ("raw_events", "minute_rollups"):
+            cur.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+            if not cur.fetchone()[0]:
+                empty.append(table)
+            cur.execute(f"ANALYZE {table}")
+        psql_manager.conn.commit()
+        cur.close()
+        if empty:
+            print(f"{' and '.join(empty)} empty; run the pipeline for a while before checking plans")
+            psql_manager.conn.close()
+            sys.exit(1)
+        failed = False
+        for use_rollups in (True, False):
+            source = "minute_rollups" if use_rollups else "raw_events"
+            for name, relations in PSQLAnalytics(psql_manager, use_rollups).explain_index_usage().items():
+                if relations:
+                    failed = True
+                    print(f"{source} {name}: no index condition on {', '.join(relations)}")
+        if not failed:
+            print("all time-bounded queries use index conditions")
+        psql_manager.conn.close()
+        sys.exit(1 if failed else 0)
+
+    elif command == "archive":
+        print("querying the last 7 days of archived raw events...")
+        end = datetime.now().astimezone()
+        ArchiveAnalytics("archive").print_sql_analytics(time_range=(end - timedelta(days=7), end))
+
     else:
         print(f"unknown command: {command}")
-        print("usage: python psql_setup.py [setup|flush]")
+        print("usage: python utilities.py [setup|flush|rollups|migrate|check|explain|archive]")
 
 
 if __name__ == "__main__":
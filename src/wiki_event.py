@@ -0,0 +1,258 @@
+import json
+
+"""
+Decoding of Wikimedia recentchange payloads into compact WikiEvent records.
+
+Only the fields the Redis and PostgreSQL sinks store are kept; large blobs such
+as parsedcomment and log_params are never materialized. The decoder backend is
+picked from what is installed (msgspec, then orjson, then the stdlib json
+module) and can be forced with get_decoder(name). Streams other than
+recentchange are mapped onto the same record by get_stream_decoder(stream).
+"""
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class WikiEvent:
+    """One recentchange event projected onto the fields the pipeline stores."""
+
+    __slots__ = (
+        "id",
+        "domain",
+        "dt",
+        "type",
+        "namespace",
+        "title",
+        "comment",
+        "user",
+        "bot",
+        "wiki",
+        "minor",
+        "patrolled",
+        "log_type",
+        "length",
+        "offset",
+    )
+
+    def __init__(
+        self,
+        id=None,
+        domain=None,
+        dt=None,
+        type=None,
+        namespace=None,
+        title=None,
+        comment=None,
+        user=None,
+        bot=None,
+        wiki=None,
+        minor=None,
+        patrolled=None,
+        log_type=None,
+        length=None,
+        offset=None,
+    ):
+        """Store the projected fields; length is the edit size delta (new - old) or None.
+
+        offset is the event's position in the stream as numbered by the reader, used for checkpoints.
+        """
+        self.id = id
+        self.domain = domain
+        self.dt = dt
+        self.type = type
+        self.namespace = namespace
+        self.title = title
+        self.comment = comment
+        self.user = user
+        self.bot = bot
+        self.wiki = wiki
+        self.minor = minor
+        self.patrolled = patrolled
+        self.log_type = log_type
+        self.length = length
+        self.offset = offset
+
+    @classmethod
+    def from_dict(cls, json_data):
+        """Project a decoded recentchange dict, or return None if it isn't a change event."""
+        # edge case change events that don't match expected format
+        if "type" not in json_data or "meta" not in json_data:
+            return None
+
+        meta = json_data["meta"] or {}
+        length = json_data.get("length")
+        return cls(
+            meta.get("id"),
+            meta.get("domain"),
+            meta.get("dt"),
+            json_data["type"],
+            json_data.get("namespace"),
+            json_data.get("title"),
+            json_data.get("comment"),
+            json_data.get("user"),
+            json_data.get("bot"),
+            json_data.get("wiki"),
+            json_data.get("minor"),
+            json_data.get("patrolled"),
+            json_data.get("log_type"),
+            # store edit size delta when length object is present
+            (length.get("new") or 0) - (length.get("old") or 0) if length else None,
+        )
+
+    def __repr__(self):
+        return f"WikiEvent(id={self.id!r}, type={self.type!r}, wiki={self.wiki!r}, title={self.title!r})"
+
+
+if msgspec is not None:
+
+    class _Meta(msgspec.Struct):
+        id: str | None = None
+        domain: str | None = None
+        dt: str | None = None
+
+    class _Length(msgspec.Struct):
+        old: int | None = None
+        new: int | None = None
+
+    # fields not declared here are skipped by the parser without building python objects
+    class _RecentChange(msgspec.Struct):
+        type: str | None = None
+        meta: _Meta | None = None
+        namespace: int | None = None
+        title: str | None = None
+        comment: str | None = None
+        user: str | None = None
+        bot: bool | None = None
+        wiki: str | None = None
+        minor: bool | None = None
+        patrolled: bool | None = None
+        log_type: str | None = None
+        length: _Length | None = None
+
+    _msgspec_decoder = msgspec.json.Decoder(_RecentChange)
+
+    def _decode_msgspec(payload):
+        try:
+            change = _msgspec_decoder.decode(payload)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+        if change.type is None or change.meta is None:
+            return None
+        meta, length = change.meta, change.length
+        return WikiEvent(
+            meta.id,
+            meta.domain,
+            meta.dt,
+            change.type,
+            change.namespace,
+            change.title,
+            change.comment,
+            change.user,
+            change.bot,
+            change.wiki,
+            change.minor,
+            change.patrolled,
+            change.log_type,
+            (length.new or 0) - (length.old or 0) if length else None,
+        )
+
+
+def _decode_orjson(payload):
+    try:
+        json_data = orjson.loads(payload)
+    except orjson.JSONDecodeError as e:
+        raise ValueError(str(e)) from e
+    return WikiEvent.from_dict(json_data) if isinstance(json_data, dict) else None
+
+
+def _decode_json(payload):
+    # str input skips json's byte encoding detection; both errors are ValueErrors
+    json_data = json.loads(payload.decode())
+    return WikiEvent.from_dict(json_data) if isinstance(json_data, dict) else None
+
+
+DECODERS = {"json": _decode_json}
+if orjson is not None:
+    DECODERS["orjson"] = _decode_orjson
+if msgspec is not None:
+    DECODERS["msgspec"] = _decode_msgspec
+
+
+def get_decoder(name=None):
+    """Return a bytes -> WikiEvent | None decoder, the fastest installed one by default.
+
+    Decoders raise ValueError on malformed JSON and return None for payloads
+    that aren't change events.
+    """
+    if name is None:
+        name = next(backend for backend in ("msgspec", "orjson", "json") if backend in DECODERS)
+    if name not in DECODERS:
+        raise ValueError(f"json decoder not available: {name}")
+    return DECODERS[name]
+
+
+decode_event = get_decoder()
+
+
+def _loads(payload):
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload.decode())
+
+
+def _revision_decoder(event_type, sized=False):
+    """Return a decoder for revision-based streams (mediawiki/revision/* schemas).
+
+    These events carry database/page_*/performer fields instead of recentchange's
+    wiki/title/user; event_type becomes the WikiEvent type so their counters stay
+    separate from recentchange's, and sized streams store rev_len as the size delta.
+    """
+
+    def decode(payload):
+        # orjson's decode error is a ValueError too
+        json_data = _loads(payload)
+        if not isinstance(json_data, dict) or "meta" not in json_data:
+            return None
+
+        meta = json_data["meta"] or {}
+        performer = json_data.get("performer") or {}
+        return WikiEvent(
+            meta.get("id"),
+            meta.get("domain"),
+            meta.get("dt"),
+            event_type,
+            json_data.get("page_namespace"),
+            json_data.get("page_title"),
+            json_data.get("comment"),
+            performer.get("user_text"),
+            performer.get("user_is_bot"),
+            json_data.get("database"),
+            json_data.get("rev_minor_edit"),
+            None,
+            None,
+            json_data.get("rev_len") if sized else None,
+        )
+
+    return decode
+
+
+STREAM_DECODERS = {
+    "recentchange": decode_event,
+    # a created page's first revision is its whole size
+    "page-create": _revision_decoder("page-create", sized=True),
+    "revision-score": _revision_decoder("revision-score"),
+}
+
+
+def get_stream_decoder(stream):
+    """Return the payload decoder for an EventStreams stream name (recentchange shape by default)."""
+    return STREAM_DECODERS.get(stream, decode_event)